@@ -0,0 +1,207 @@
+#
+#
+#
+
+from logging import getLogger
+from threading import Condition
+from time import monotonic
+
+from flask import g, jsonify, request
+
+from .timing import timed
+
+
+class Limiter:
+    '''
+    Limits the number of requests of a class that are in-flight at once
+
+    Requests over the limit wait, in a queue of at most `max_queue`, for up to
+    `queue_timeout` seconds for one of the in-flight requests to finish. When
+    the queue is full they're turned away right away with a `429` and when
+    they've waited too long with a `503`.
+    '''
+
+    def __init__(
+        self, name, max_in_flight, max_queue=0, queue_timeout=1.0, retry_after=1
+    ):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._cond = Condition()
+
+    def acquire(self):
+        '''
+        :return: None if the request was admitted, in which case `release`
+                 must be called when it's done, otherwise the status code to
+                 reject it with
+        '''
+        with self._cond:
+            if self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                self.admitted += 1
+                return None
+
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                return 429
+
+            self.queued += 1
+            try:
+                deadline = monotonic() + self.queue_timeout
+                while self.in_flight >= self.max_in_flight:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        return 503
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self.admitted += 1
+                return None
+            finally:
+                self.queued -= 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+
+
+class AdmissionControl:
+    '''
+    Per route class admission control
+
+    Requests are classed as `reads`, `writes`, or `sync` and each class that's
+    configured gets its own `Limiter`, that way expensive syncs and writes
+    can't use up the capacity that cheap reads need. Classes that aren't
+    configured aren't limited.
+
+    Requests are admitted once they've been authenticated, see
+    `require_api_key`, so that unauthenticated and rate limited requests
+    never take up a slot.
+    '''
+
+    CLASSES = ('reads', 'writes', 'sync')
+
+    # endpoints whose class doesn't follow from their method
+    ENDPOINT_CLASSES = {
+        'records.lookup_records': 'reads',
+        # whole zone, or every zone, operations
+        'plans.apply_plan': 'sync',
+        'records.replace_records': 'sync',
+        'search.search': 'sync',
+        'zones.export_zone': 'sync',
+        'zones.import_zone': 'sync',
+        'zones.sync_zone': 'sync',
+    }
+
+    # endpoints that are never limited, metrics need to be available when
+    # things are overloaded
+    EXEMPT = frozenset(('metrics.get_metrics',))
+
+    READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+    log = getLogger('AdmissionControl')
+
+    def __init__(self, limiters):
+        '''
+        :param limiters: Dict of class name to Limiter
+        '''
+        self.log.info('__init__: classes=%s', sorted(limiters.keys()))
+        self.limiters = limiters
+
+    @classmethod
+    def from_config(cls, api_config):
+        '''
+        Build AdmissionControl from the `api` section of the config
+
+        :param api_config: The `api` section of the octoDNS config
+        :return: AdmissionControl or None if admission control isn't
+                 configured
+        '''
+        admission_config = api_config.get('admission', {})
+        limiters = {}
+        for name, limiter_config in admission_config.items():
+            if name not in cls.CLASSES:
+                raise ValueError(f'Unknown admission class {name}')
+            limiters[name] = Limiter(name, **limiter_config)
+        if not limiters:
+            return None
+        return cls(limiters)
+
+    def classify(self):
+        '''
+        :return: The class of the current request or None if it isn't limited
+        '''
+        endpoint = request.endpoint
+        if endpoint is None or endpoint in self.EXEMPT:
+            return None
+        try:
+            return self.ENDPOINT_CLASSES[endpoint]
+        except KeyError:
+            pass
+        if request.method in self.READ_METHODS:
+            return 'reads'
+        return 'writes'
+
+    def admit(self):
+        '''
+        Admit, or reject, the current request
+
+        :return: Error response if the request was rejected, otherwise None
+        '''
+        limiter = self.limiters.get(self.classify())
+        if limiter is None:
+            return None
+
+        with timed('admission', limiter.name):
+            status = limiter.acquire()
+        if status is not None:
+            self.log.warning(
+                'admit: rejected %s %s, class=%s, status=%d',
+                request.method,
+                request.path,
+                limiter.name,
+                status,
+            )
+            response = jsonify(
+                {'error': f'Too many {limiter.name} requests, retry later'}
+            )
+            response.status_code = status
+            response.headers['Retry-After'] = str(limiter.retry_after)
+            return response
+
+        g.admission_limiter = limiter
+        return None
+
+    def teardown_request(self, exc=None):
+        '''
+        Flask `teardown_request` hook that releases an admitted request
+        '''
+        limiter = g.pop('admission_limiter', None)
+        if limiter is not None:
+            limiter.release()
+
+    def stats(self):
+        '''
+        :return: Dict of class name to its limiter's stats
+        '''
+        return {name: l.stats() for name, l in self.limiters.items()}
@@ -0,0 +1,21 @@
+#
+#
+#
+
+from flask import request
+
+
+def version_arg(name='version'):
+    '''
+    :param name: Name of the query parameter
+    :return: The zone version query parameter as an int, or None if it
+             wasn't provided
+    :raises ValueError: if it isn't a positive integer
+    '''
+    version = request.args.get(name)
+    if version is None:
+        return None
+    version = int(version)
+    if version < 1:
+        raise ValueError(version)
+    return version
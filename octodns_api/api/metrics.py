@@ -0,0 +1,29 @@
+#
+#
+#
+
+from logging import getLogger
+
+from flask import Blueprint, current_app, jsonify
+
+from ..auth import require_api_key
+
+metrics_bp = Blueprint('metrics', __name__, url_prefix='/metrics')
+
+log = getLogger('api.Metrics')
+
+
+@metrics_bp.route('', methods=['GET'])
+@require_api_key
+def get_metrics():
+    '''Get operational metrics'''
+    try:
+        metrics = {
+            'connection_pools': current_app.manager.pools.stats(),
+            'keys': current_app.api_keys.stats(),
+        }
+        if current_app.admission:
+            metrics['admission'] = current_app.admission.stats()
+        return jsonify(metrics)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,30 @@
+#
+#
+#
+
+from logging import getLogger
+
+from flask import Blueprint, current_app, jsonify
+
+from ..auth import require_api_key
+from ..manager import ApiManagerException, StalePlanException
+
+plans_bp = Blueprint('plans', __name__, url_prefix='/plans')
+
+log = getLogger('api.Plans')
+
+
+@plans_bp.route('/<plan_id>/apply', methods=['POST'])
+@require_api_key
+def apply_plan(plan_id):
+    '''Apply the plans from a dry-run sync'''
+    try:
+        log.debug('apply_plan: plan_id=%s', plan_id)
+        result = current_app.manager.apply_plan(plan_id)
+        return jsonify(result)
+    except StalePlanException as e:
+        return jsonify({'error': str(e)}), 409
+    except ApiManagerException as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
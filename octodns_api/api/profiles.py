@@ -0,0 +1,43 @@
+#
+#
+#
+
+from logging import getLogger
+
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from ..auth import require_api_key
+
+profiles_bp = Blueprint('profiles', __name__, url_prefix='/profiles')
+
+log = getLogger('api.Profiles')
+
+
+@profiles_bp.route('/<profile_id>', methods=['GET'])
+@require_api_key
+def get_profile(profile_id):
+    '''Download a stored request profile'''
+    try:
+        profiler = current_app.profiler
+        if not profiler.authorized():
+            return jsonify({'error': 'Profiling not allowed for API key'}), 403
+
+        data = profiler.load(profile_id)
+        log.debug(
+            'get_profile: profile_id=%s, found=%s', profile_id, bool(data)
+        )
+        if data is None:
+            return jsonify({'error': f'Profile {profile_id} not found'}), 404
+
+        if request.args.get('format') == 'text':
+            return Response(profiler.summary(data), mimetype='text/plain')
+
+        return Response(
+            data,
+            mimetype='application/octet-stream',
+            headers={
+                'Content-Disposition': f'attachment; filename={profile_id}.prof'
+            },
+        )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -7,10 +7,14 @@ from logging import getLogger
 
 from flask import Blueprint, current_app, jsonify, request
 
-from octodns.idna import idna_decode
+from octodns.provider.plan import UnsafePlan
+from octodns.record import ValidationError
 
 from ..auth import require_api_key
+from ..idna import idna_decode
 from ..manager import ApiManagerException
+from ..timing import timed
+from .common import version_arg
 
 records_bp = Blueprint('records', __name__, url_prefix='/zones')
 
@@ -22,22 +26,91 @@ log = getLogger('api.Records')
 def list_records(zone_name):
     '''List all records in a zone'''
     try:
-        log.debug('list_records: zone_name=%s', zone_name)
+        version = version_arg()
+    except ValueError:
+        return jsonify({'error': 'Invalid version'}), 400
+    try:
+        log.debug('list_records: zone_name=%s, version=%s', zone_name, version)
         zone_name = idna_decode(zone_name)
-        zone = current_app.manager.get_zone(zone_name)
-        log.debug('list_records:   zone_name=%s, zone=%s', zone_name, zone)
+        snapshot = current_app.manager.get_snapshot(zone_name, version)
+        log.debug(
+            'list_records:   zone_name=%s, records=%d', zone_name, len(snapshot)
+        )
 
-        records = defaultdict(dict)
-        for record in zone.records:
-            records[record.decoded_name][record._type] = record.data
+        def serialize():
+            with timed('serialize'):
+                records = defaultdict(dict)
+                for name, _type, data in snapshot.records():
+                    records[name][_type] = data
+                response = jsonify(
+                    {
+                        'zone': snapshot.decoded_name,
+                        'version': snapshot.version,
+                        'records': records,
+                    }
+                )
+                return response.get_data()
 
-        return jsonify({'zone': zone.decoded_name, 'records': records})
+        # snapshots don't change so the serialized, and compressed, bodies
+        # can be kept and reused along with them
+        body = snapshot.derived('list_records', serialize)
+        return current_app.compression.response(
+            body,
+            request.headers.get('Accept-Encoding'),
+            'application/json',
+            cache=snapshot.derived('list_records.compressed', dict),
+        )
     except ApiManagerException as e:
         return jsonify({'error': str(e)}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@records_bp.route('/<zone_name>/records', methods=['PUT'])
+@require_api_key
+def replace_records(zone_name):
+    '''Replace all of a zone's records with the desired set'''
+    try:
+        zone_name = idna_decode(zone_name)
+        body = request.get_json(silent=True)
+        records = body.get('records') if isinstance(body, dict) else None
+        if not isinstance(records, dict) or not all(
+            isinstance(types, dict)
+            and all(isinstance(data, dict) for data in types.values())
+            for types in records.values()
+        ):
+            return (
+                jsonify(
+                    {
+                        'error': 'records must map names to types to record '
+                        'data'
+                    }
+                ),
+                400,
+            )
+        force = request.args.get('force', '').lower() in ('1', 'true', 'yes')
+        log.debug(
+            'replace_records: zone_name=%s, names=%d, force=%s',
+            zone_name,
+            len(records),
+            force,
+        )
+
+        records = {idna_decode(name): types for name, types in records.items()}
+        result = current_app.manager.replace_records(
+            zone_name, records, force=force
+        )
+        return jsonify(result)
+    except ApiManagerException as e:
+        return jsonify({'error': str(e)}), 404
+    except ValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnsafePlan as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @records_bp.route(
     '/<zone_name>/records/<record_name>/<record_type>', methods=['GET']
 )
@@ -45,17 +118,23 @@ def list_records(zone_name):
 @require_api_key
 def get_record(zone_name, record_type, record_name=''):
     '''Get a specific record'''
+    try:
+        version = version_arg()
+    except ValueError:
+        return jsonify({'error': 'Invalid version'}), 400
     try:
         log.debug(
-            'get_record: zone_name=%s, record_name=%s, record_type=%s',
+            'get_record: zone_name=%s, record_name=%s, record_type=%s, '
+            'version=%s',
             zone_name,
             record_name,
             record_type,
+            version,
         )
         zone_name = idna_decode(zone_name)
         record_name = idna_decode(record_name)
         record = current_app.manager.get_record(
-            zone_name, record_name, record_type
+            zone_name, record_name, record_type, version
         )
         log.debug(
             'get_record:   zone_name=%s, record_name=%s, record=%s',
@@ -74,12 +153,71 @@ def get_record(zone_name, record_type, record_name=''):
                 404,
             )
 
-        # Get full record data including name and type
-        data = record.data
-        data['name'] = record.decoded_name
-        data['type'] = record._type
+        with timed('serialize'):
+            # Get full record data including name and type
+            data = record.data
+            data['name'] = record.decoded_name
+            data['type'] = record._type
+
+            return jsonify(data)
+    except ApiManagerException as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        return jsonify(data)
+
+@records_bp.route('/<zone_name>/records:lookup', methods=['POST'])
+@require_api_key
+def lookup_records(zone_name):
+    '''Look up a list of records, by name and type, in one go'''
+    try:
+        version = version_arg()
+    except ValueError:
+        return jsonify({'error': 'Invalid version'}), 400
+    try:
+        zone_name = idna_decode(zone_name)
+        body = request.get_json(silent=True) or {}
+        keys = []
+        for key in body.get('records') or []:
+            if (
+                not isinstance(key, dict)
+                or not isinstance(key.get('name', ''), str)
+                or not isinstance(key.get('type'), str)
+            ):
+                return (
+                    jsonify(
+                        {'error': 'Each record must have a name and a type'}
+                    ),
+                    400,
+                )
+            keys.append((idna_decode(key.get('name', '')), key['type']))
+        if not keys:
+            return jsonify({'error': 'No records provided'}), 400
+        log.debug('lookup_records: zone_name=%s, keys=%d', zone_name, len(keys))
+
+        snapshot, found, misses = current_app.manager.lookup_records(
+            zone_name, keys, version
+        )
+        log.debug(
+            'lookup_records:   found=%d, misses=%d', len(found), len(misses)
+        )
+
+        with timed('serialize'):
+            records = []
+            for name, _type, data in found:
+                data['name'] = name
+                data['type'] = _type
+                records.append(data)
+            return jsonify(
+                {
+                    'zone': zone_name,
+                    'version': snapshot.version,
+                    'records': records,
+                    'misses': [
+                        {'name': name, 'type': _type} for name, _type in misses
+                    ],
+                }
+            )
     except ApiManagerException as e:
         return jsonify({'error': str(e)}), 404
     except Exception as e:
@@ -0,0 +1,67 @@
+#
+#
+#
+
+from logging import getLogger
+
+from flask import Blueprint, current_app, jsonify, request
+
+from ..auth import require_api_key
+from ..idna import idna_decode
+from ..manager import SearchUnavailableException
+from ..timing import timed
+
+search_bp = Blueprint('search', __name__, url_prefix='/search')
+
+log = getLogger('api.Search')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+@search_bp.route('', methods=['GET'])
+@require_api_key
+def search():
+    '''Search for records, by name, type, and/or value, across all zones'''
+    try:
+        name = request.args.get('name')
+        _type = request.args.get('type')
+        value = request.args.get('value')
+        if not name and not value:
+            return jsonify({'error': 'A name and/or value is required'}), 400
+        try:
+            limit = int(request.args.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            return jsonify({'error': 'Invalid limit'}), 400
+        if limit < 1 or limit > MAX_LIMIT:
+            return (
+                jsonify({'error': f'Limit must be between 1 and {MAX_LIMIT}'}),
+                400,
+            )
+        if name:
+            name = idna_decode(name)
+        log.debug(
+            'search: name=%s, type=%s, value=%s, limit=%d',
+            name,
+            _type,
+            value,
+            limit,
+        )
+
+        results, truncated = current_app.manager.search(
+            name=name or None, _type=_type, value=value or None, limit=limit
+        )
+        log.debug('search:   results=%d, truncated=%s', len(results), truncated)
+
+        with timed('serialize'):
+            records = []
+            for zone_name, record_name, record_type, data in results:
+                data['zone'] = zone_name
+                data['name'] = record_name
+                data['type'] = record_type
+                records.append(data)
+            return jsonify({'records': records, 'truncated': truncated})
+    except SearchUnavailableException as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
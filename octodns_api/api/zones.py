@@ -2,14 +2,27 @@
 #
 #
 
+from io import TextIOWrapper
 from logging import getLogger
 
-from flask import Blueprint, current_app, jsonify, request
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
 
-from octodns.idna import idna_decode
+from octodns.provider.plan import UnsafePlan
+from octodns.record import ValidationError
 
 from ..auth import require_api_key
+from ..idna import idna_decode
 from ..manager import ApiManagerException
+from ..timing import timed
+from ..zonefile import FORMATS, MIMETYPES, ZoneFileException
+from .common import version_arg
 
 zones_bp = Blueprint('zones', __name__, url_prefix='/zones')
 
@@ -34,8 +47,61 @@ def list_zones():
 def get_zone(zone_name):
     '''Get a zone with all its records'''
     try:
-        zone = current_app.manager.get_zone(zone_name)
-        return jsonify({'name': zone.decoded_name})
+        version = version_arg()
+    except ValueError:
+        return jsonify({'error': 'Invalid version'}), 400
+    try:
+        snapshot = current_app.manager.get_snapshot(zone_name, version)
+        return jsonify(
+            {'name': snapshot.decoded_name, 'version': snapshot.version}
+        )
+    except ApiManagerException as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@zones_bp.route('/<zone_name>/diff', methods=['GET'])
+@require_api_key
+def diff_zone(zone_name):
+    '''List the records that changed between two versions of a zone'''
+    try:
+        from_version = version_arg('from')
+        to_version = version_arg('to')
+    except ValueError:
+        return jsonify({'error': 'Invalid version'}), 400
+    if from_version is None:
+        return jsonify({'error': 'A from version is required'}), 400
+    try:
+        before, after, changes = current_app.manager.diff_zone(
+            zone_name, from_version, to_version
+        )
+        with timed('serialize'):
+            diffs = []
+            for name, _type, existing, new in changes:
+                if existing is None:
+                    change = 'create'
+                elif new is None:
+                    change = 'delete'
+                else:
+                    change = 'update'
+                diffs.append(
+                    {
+                        'name': name,
+                        'type': _type,
+                        'change': change,
+                        'existing': existing,
+                        'new': new,
+                    }
+                )
+            return jsonify(
+                {
+                    'zone': before.decoded_name,
+                    'from': before.version,
+                    'to': after.version,
+                    'changes': diffs,
+                }
+            )
     except ApiManagerException as e:
         return jsonify({'error': str(e)}), 404
     except Exception as e:
@@ -55,5 +121,74 @@ def sync_zone(zone_name):
         return jsonify(result)
     except ApiManagerException as e:
         return jsonify({'error': str(e)}), 404
+    except UnsafePlan as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def _format():
+    format = request.args.get('format', 'yaml')
+    if format not in FORMATS:
+        return None
+    return format
+
+
+@zones_bp.route('/<zone_name>/export', methods=['GET'])
+@require_api_key
+def export_zone(zone_name):
+    '''Export all of a zone's records as octoDNS YAML or a BIND zone file'''
+    format = _format()
+    if format is None:
+        return (
+            jsonify({'error': f'format must be one of {", ".join(FORMATS)}'}),
+            400,
+        )
+    try:
+        version = version_arg()
+    except ValueError:
+        return jsonify({'error': 'Invalid version'}), 400
+    try:
+        version, chunks = current_app.manager.export_zone(
+            zone_name, format, version
+        )
+        # started before streaming so that errors, e.g. an unknown zone, can
+        # still be reported
+        response = Response(
+            stream_with_context(chunks), mimetype=MIMETYPES[format]
+        )
+        if version is not None:
+            response.headers['X-Zone-Version'] = str(version)
+        return response
+    except ApiManagerException as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@zones_bp.route('/<zone_name>/import', methods=['PUT'])
+@require_api_key
+def import_zone(zone_name):
+    '''Replace all of a zone's records with those in the request body'''
+    format = _format()
+    if format is None:
+        return (
+            jsonify({'error': f'format must be one of {", ".join(FORMATS)}'}),
+            400,
+        )
+    force = request.args.get('force', '').lower() in ('1', 'true', 'yes')
+    try:
+        # the body is parsed as it's read rather than loaded all at once
+        fh = TextIOWrapper(request.stream, encoding='utf-8')
+        result = current_app.manager.import_zone(
+            zone_name, fh, format, force=force
+        )
+        return jsonify(result)
+    except ApiManagerException as e:
+        return jsonify({'error': str(e)}), 404
+    except (ValidationError, ZoneFileException, UnicodeDecodeError) as e:
+        return jsonify({'error': str(e)}), 400
+    except UnsafePlan as e:
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -7,9 +7,16 @@ from logging import getLogger
 from flask import Flask
 from flask_cors import CORS
 
+from .admission import AdmissionControl
+from .api.metrics import metrics_bp
+from .api.plans import plans_bp
 from .api.records import records_bp
+from .api.search import search_bp
 from .api.zones import zones_bp
+from .auth import ApiKeys
+from .compression import Compression
 from .manager import ApiManager
+from .timing import after_request, before_request, teardown_request
 
 
 def create_app(config_file):
@@ -31,8 +38,45 @@ def create_app(config_file):
     # Create and store ApiManager instance for reuse across requests
     app.manager = ApiManager(config_file)
 
+    # Compress large responses for clients that accept it
+    api_config = app.manager.manager.config.get('api', {})
+    app.compression = Compression(**api_config.get('compression', {}))
+    app.after_request(app.compression.after_request)
+
+    # Per-request timings, reported in a Server-Timing header and the access
+    # log. Registered after compression so that it runs first.
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+
+    # The configured API keys, requests are resolved to the key that made
+    # them, limited, and its usage recorded
+    app.api_keys = ApiKeys.from_config(api_config)
+    app.after_request(app.api_keys.after_request)
+    app.teardown_request(app.api_keys.teardown_request)
+
+    # Optional per route class admission control, requests are admitted once
+    # they're authenticated, see require_api_key
+    app.admission = AdmissionControl.from_config(api_config)
+    if app.admission:
+        app.teardown_request(app.admission.teardown_request)
+
     # Register blueprints
     app.register_blueprint(zones_bp)
     app.register_blueprint(records_bp)
+    app.register_blueprint(search_bp)
+    app.register_blueprint(plans_bp)
+    app.register_blueprint(metrics_bp)
+
+    # Opt-in per-request profiling, it's only imported when it's configured,
+    # see require_api_key
+    app.profiler = None
+    if 'profiling' in api_config:
+        from .api.profiles import profiles_bp
+        from .profiling import Profiler
+
+        app.profiler = Profiler.from_config(api_config)
+        if app.profiler:
+            app.register_blueprint(profiles_bp)
 
     return app
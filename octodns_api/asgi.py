@@ -0,0 +1,297 @@
+#
+#
+#
+
+from asyncio import get_running_loop, run_coroutine_threadsafe
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from io import BytesIO, RawIOBase
+from logging import getLogger
+from sys import stderr
+
+from werkzeug.exceptions import HTTPException
+
+from .app import create_app
+
+# endpoints that only read a zone's snapshot, answered without blocking when
+# it's cached
+CACHED_READS = frozenset(
+    ('records.get_record', 'records.list_records', 'zones.get_zone')
+)
+
+
+class _RequestBody(RawIOBase):
+    '''
+    `wsgi.input` that receives the request's body from the event loop as the
+    application reads it, rather than all of it up front
+    '''
+
+    def __init__(self, receive, loop):
+        super().__init__()
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._more = True
+
+    def _fill(self):
+        '''
+        :return: False once the whole body has been received
+        '''
+        if not self._more:
+            return False
+        message = run_coroutine_threadsafe(self._receive(), self._loop).result()
+        self._buffer += message.get('body', b'')
+        # http.disconnect doesn't have more_body, the body ends there
+        self._more = message.get('more_body', False)
+        return True
+
+    def _take(self, size):
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+    def read(self, size=-1):
+        while (size < 0 or len(self._buffer) < size) and self._fill():
+            pass
+        if size < 0:
+            size = len(self._buffer)
+        return self._take(size)
+
+    def readline(self, size=-1):
+        while (
+            b'\n' not in self._buffer
+            and (size < 0 or len(self._buffer) < size)
+            and self._fill()
+        ):
+            pass
+        end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        if size >= 0:
+            end = min(end, size)
+        return self._take(end)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+class AsgiApp:
+    '''
+    ASGI front end for the Flask application
+
+    Client connections are held by the event loop, so idle clients, and
+    clients waiting for a thread, don't tie one up. Requests that `inline`
+    says can be answered without blocking, e.g. reads of zones that are
+    cached in memory, are handled on the event loop itself. The rest are
+    handed to the WSGI application on a bounded thread pool, that's where the
+    blocking provider calls happen. Bodies are received as the application
+    reads them and responses are sent as the application produces them so
+    that neither is held in memory, e.g. importing or exporting a large zone.
+
+    A request on the pool holds a thread for as long as the application is
+    handling it, including receiving its body and sending its response, so
+    the pool's size limits the number of those that are in progress at once.
+    '''
+
+    log = getLogger('AsgiApp')
+
+    def __init__(self, wsgi_app, max_workers=None, inline=None):
+        '''
+        :param wsgi_app: The WSGI application
+        :param max_workers: Size of the thread pool requests are handled on
+        :param inline: Optional callable that's passed a request's WSGI
+                       environ and returns True if it can be handled on the
+                       event loop, its body isn't read
+        '''
+        self.log.info('__init__: max_workers=%s', max_workers)
+        self.wsgi_app = wsgi_app
+        self.inline = inline
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='AsgiApp'
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        elif scope['type'] != 'http':
+            raise ValueError(f'Unsupported scope type {scope["type"]}')
+
+        if self.inline is not None:
+            environ = self._environ(scope, BytesIO())
+            if self.inline(environ):
+                with closing(self._messages(environ)) as messages:
+                    for message in messages:
+                        await send(message)
+                return
+
+        loop = get_running_loop()
+        environ = self._environ(scope, _RequestBody(receive, loop))
+        await loop.run_in_executor(
+            self.executor, self._call_wsgi, environ, send, loop
+        )
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            else:
+                # lifespan.shutdown
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        # WSGI wants the raw bytes of the path as a latin-1 str
+        path = scope['path'].encode('utf-8').decode('latin-1')
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': path,
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            # the body ends when the client says so, it may not have a length
+            'wsgi.input_terminated': True,
+            'wsgi.errors': stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                environ[name] = value
+                continue
+            name = f'HTTP_{name}'
+            if name in environ:
+                value = f'{environ[name]},{value}'
+            environ[name] = value
+        return environ
+
+    def _call_wsgi(self, environ, send, loop):
+        '''
+        Run the WSGI application, sending its response as it's produced
+
+        Runs on the thread pool, each message is sent on the event loop and
+        waited for so that a slow client holds back the application rather
+        than having the response pile up in memory.
+        '''
+        with closing(self._messages(environ)) as messages:
+            for message in messages:
+                run_coroutine_threadsafe(send(message), loop).result()
+
+    def _messages(self, environ):
+        '''
+        Run the WSGI application
+
+        :return: Generator of the ASGI messages of its response, produced as
+                 it produces the response
+        '''
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (k.lower().encode('latin-1'), v.encode('latin-1'))
+                for k, v in headers
+            ]
+
+        def _start():
+            return {
+                'type': 'http.response.start',
+                'status': response['status'],
+                'headers': response['headers'],
+            }
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            started = False
+            for chunk in iterable:
+                if not chunk:
+                    continue
+                if not started:
+                    # start_response can be called as late as the first chunk
+                    yield _start()
+                    started = True
+                yield {
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                }
+            if not started:
+                yield _start()
+            yield {'type': 'http.response.body', 'body': b''}
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+
+def cached_reads(app):
+    '''
+    :param app: Flask application
+    :return: `AsgiApp` `inline` callable that's True for reads of zones the
+             app has cached in memory, or None if the app can block before
+             getting to them
+    '''
+    limiter = app.admission.limiters.get('reads') if app.admission else None
+    if (
+        app.api_keys.store is not None
+        or (limiter is not None and limiter.max_queue)
+        or app.profiler is not None
+    ):
+        # shared rate limits, queueing for admission, and saving profiles
+        # all block
+        return None
+
+    def inline(environ):
+        if environ['REQUEST_METHOD'] != 'GET':
+            return False
+        try:
+            endpoint, args = app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return False
+        return endpoint in CACHED_READS and app.manager.cached(
+            args['zone_name']
+        )
+
+    return inline
+
+
+def create_asgi_app(config_file):
+    '''
+    ASGI application factory
+
+    The size of the thread pool that requests are handled on can be set with
+    `max_workers` under `api.asgi` in the config. Reads of zones that are
+    cached in memory are handled on the event loop, see `cached_reads`.
+
+    :param config_file: Path to octoDNS configuration file
+    :type config_file: str
+    :return: ASGI application instance
+    '''
+    app = create_app(config_file)
+    asgi_config = app.manager.manager.config.get('api', {}).get('asgi', {})
+    return AsgiApp(
+        app,
+        max_workers=asgi_config.get('max_workers'),
+        inline=cached_reads(app),
+    )
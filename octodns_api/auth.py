@@ -3,64 +3,257 @@
 #
 
 from functools import wraps
+from hashlib import sha256
+from logging import getLogger
+from threading import Lock
 
-from flask import current_app, jsonify, request
+from flask import current_app, g, jsonify, request
+
+from .ratelimit import KeyLimits, SqliteTokenBuckets
+from .timing import current_timer, timed
 
 
 class AuthenticationError(Exception):
     pass
 
 
-def _get_api_keys():
-    '''Get the configured API keys from the octoDNS config'''
-    # Get config from the manager instance (already has env vars resolved)
-    config = current_app.manager.manager.config
-    api_config = config.get('api', {})
-    keys_config = api_config.get('keys', [])
+def _hash(token):
+    return sha256(token.encode('utf-8')).digest()
+
+
+class ApiKey:
+    '''
+    The identity of a configured API key, what an authenticated request is
+    resolved to, along with its usage
+
+    The key's value isn't kept. `limits` are its `KeyLimits`, if it has any.
+    '''
+
+    __slots__ = (
+        'name',
+        'requests',
+        'errors',
+        'methods',
+        'duration',
+        'max',
+        'limits',
+        '_lock',
+    )
+
+    def __init__(self, name, limits=None):
+        self.name = name
+        self.limits = limits
+        self.requests = 0
+        self.errors = 0
+        # method -> number of requests
+        self.methods = {}
+        self.duration = 0
+        self.max = 0
+        self._lock = Lock()
+
+    def record(self, method, status, duration):
+        '''
+        :param method: HTTP method of the request
+        :param status: Status code of the response
+        :param duration: Duration of the request in seconds
+        '''
+        with self._lock:
+            self.requests += 1
+            if status >= 400:
+                self.errors += 1
+            self.methods[method] = self.methods.get(method, 0) + 1
+            self.duration += duration
+            if duration > self.max:
+                self.max = duration
+
+    def stats(self):
+        '''
+        :return: Dict of the key's request counts and latency
+        '''
+        with self._lock:
+            stats = {
+                'requests': self.requests,
+                'errors': self.errors,
+                'methods': dict(self.methods),
+                'total_ms': round(self.duration * 1000, 2),
+                'mean_ms': round(
+                    self.duration * 1000 / max(self.requests, 1), 2
+                ),
+                'max_ms': round(self.max * 1000, 2),
+            }
+        if self.limits is not None:
+            stats['limits'] = self.limits.stats()
+        return stats
+
+    def __repr__(self):
+        return f'ApiKey<{self.name}>'
+
+
+class ApiKeys:
+    '''
+    The configured API keys
+
+    Keys are indexed by a hash of their value when the app is created so
+    authenticating a request is one hash and one lookup, and resolves it to
+    its `ApiKey`. Each key's usage, its number of requests and their latency,
+    is recorded once the response is ready and available from `stats`.
+
+    Keys can have a rate limit and concurrency cap, see `KeyLimits`, requests
+    over them are turned away with a `429`.
+    '''
+
+    LIMITS = ('rate', 'burst', 'concurrency')
+
+    log = getLogger('ApiKeys')
+
+    def __init__(self, keys, store=None):
+        '''
+        :param keys: List of (name, value, limits) tuples, limits is a dict of
+                     `KeyLimits` arguments, empty for no limits
+        :param store: Optional SqliteTokenBuckets for the keys' rate limits
+        '''
+        self.log.info('__init__: keys=%d, store=%s', len(keys), store)
+        self.store = store
+        self._keys = {}
+        # keys that share a name share their usage, and limits, the first
+        # one's limits apply
+        names = {}
+        for name, value, limits in keys:
+            if name not in names:
+                if limits:
+                    limits = KeyLimits(name, store=store, **limits)
+                names[name] = ApiKey(name, limits or None)
+            self._keys[_hash(value)] = names[name]
+        self._names = names
+
+    @classmethod
+    def from_config(cls, api_config):
+        '''
+        :param api_config: The `api` section of the octoDNS config
+        :return: ApiKeys
+        '''
+        keys = []
+        for i, key_config in enumerate(api_config.get('keys', [])):
+            value = key_config.get('key')
+            if value:
+                limits = {
+                    k: key_config[k] for k in cls.LIMITS if k in key_config
+                }
+                keys.append(
+                    (key_config.get('name', f'keys[{i}]'), value, limits)
+                )
+        store = None
+        path = api_config.get('rate_limits', {}).get('path')
+        if path:
+            store = SqliteTokenBuckets(path)
+        return cls(keys, store=store)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def resolve(self, token):
+        '''
+        :param token: The API key provided with a request
+        :return: ApiKey or None if it isn't a configured key
+        '''
+        return self._keys.get(_hash(token))
 
-    # Extract the actual key values
-    keys = []
-    for key_config in keys_config:
-        key_value = key_config.get('key')
-        if key_value:
-            keys.append(key_value)
+    def after_request(self, response):
+        '''
+        Flask `after_request` hook that records the request against the key
+        that made it
+        '''
+        key = g.get('api_key')
+        if key is not None:
+            timer = current_timer()
+            key.record(
+                request.method,
+                response.status_code,
+                timer.total if timer else 0,
+            )
+        return response
+
+    def teardown_request(self, exc=None):
+        '''
+        Flask `teardown_request` hook that releases a limited key's request
+        '''
+        limits = g.pop('api_key_limits', None)
+        if limits is not None:
+            limits.release()
 
-    return keys
+    def stats(self):
+        '''
+        :return: Dict of key name to its usage
+        '''
+        return {name: self._names[name].stats() for name in sorted(self._names)}
 
 
 def require_api_key(f):
     '''
     Decorator to require valid API key authentication
 
-    Expects Authorization header with format: Bearer <api-key>
+    Expects Authorization header with format: Bearer <api-key>. The key the
+    request is authenticated with is available as `g.api_key`. Authenticated
+    requests are then put through admission control, and profiled when asked
+    to be, when they're configured.
     '''
 
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-
-        if not auth_header:
-            return (jsonify({'error': 'Missing Authorization header'}), 401)
-
-        # Parse Bearer token
-        parts = auth_header.split()
-        if len(parts) != 2 or parts[0].lower() != 'bearer':
-            return (
-                jsonify(
-                    {
-                        'error': 'Invalid Authorization header format. Expected: Bearer <api-key>'
-                    }
-                ),
-                401,
-            )
-
-        provided_key = parts[1]
+        with timed('auth'):
+            error = _authenticate()
+        if error:
+            return error
 
-        # Validate against configured keys
-        valid_keys = _get_api_keys()
-        if provided_key not in valid_keys:
-            return jsonify({'error': 'Invalid API key'}), 401
+        admission = current_app.admission
+        if admission is not None:
+            error = admission.admit()
+            if error:
+                return error
 
+        profiler = current_app.profiler
+        if profiler is not None:
+            return profiler.call(f, *args, **kwargs)
         return f(*args, **kwargs)
 
     return decorated_function
+
+
+def _authenticate():
+    '''
+    :return: Error response if the request isn't authenticated, otherwise None
+    '''
+    auth_header = request.headers.get('Authorization')
+
+    if not auth_header:
+        return (jsonify({'error': 'Missing Authorization header'}), 401)
+
+    # Parse Bearer token
+    parts = auth_header.split()
+    if len(parts) != 2 or parts[0].lower() != 'bearer':
+        return (
+            jsonify(
+                {
+                    'error': 'Invalid Authorization header format. Expected: Bearer <api-key>'
+                }
+            ),
+            401,
+        )
+
+    # Validate against configured keys
+    key = current_app.api_keys.resolve(parts[1])
+    if key is None:
+        return jsonify({'error': 'Invalid API key'}), 401
+
+    g.api_key = key
+    if key.limits is not None:
+        retry_after = key.limits.acquire()
+        if retry_after is not None:
+            response = jsonify(
+                {'error': f'Too many requests for key {key.name}, retry later'}
+            )
+            response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        g.api_key_limits = key.limits
+    return None
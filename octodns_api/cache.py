@@ -0,0 +1,650 @@
+#
+#
+#
+
+from collections import deque
+from contextlib import contextmanager
+from logging import getLogger
+from os import getpid
+from random import getrandbits
+from struct import Struct
+from threading import Lock
+from time import monotonic, sleep, time
+from uuid import uuid4
+from zlib import compress, decompress
+
+from .snapshot import ZoneSnapshot
+
+
+class ZoneCacheEntry:
+    '''
+    A zone snapshot along with when it was fetched from its provider
+
+    Entries restored from the on-disk store, or written through after a
+    change was applied, start out unverified, they're served as-is, but
+    should be refreshed from the provider soon after.
+    '''
+
+    __slots__ = ('snapshot', 'fetched_at', 'verified')
+
+    def __init__(self, snapshot, fetched_at, verified=True):
+        self.snapshot = snapshot
+        self.fetched_at = fetched_at
+        self.verified = verified
+
+
+class SqliteZoneStore:
+    '''
+    Persists zone snapshots to a local SQLite database
+
+    Each zone is stored as a single row holding its zlib compressed packed
+    `ZoneSnapshot`, which loads without having to parse any record data.
+    The database can be shared by all of the processes on a host, leases
+    let them take turns populating zones, see `ZoneCache`.
+    '''
+
+    # bump when the stored layout changes, rows with other versions are
+    # discarded when read
+    FORMAT = 2
+
+    log = getLogger('SqliteZoneStore')
+
+    def __init__(self, path, mmap_size=64 * 1024 * 1024):
+        # only needed when there's an on-disk store
+        from sqlite3 import connect
+
+        self.log.info('__init__: path=%s, mmap_size=%d', path, mmap_size)
+        self.path = path
+        self._lock = Lock()
+        self._conn = connect(path, check_same_thread=False)
+        self._conn.execute(f'PRAGMA mmap_size = {int(mmap_size)}')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS snapshots (zone TEXT PRIMARY KEY, '
+            'format INTEGER, fetched_at REAL, data BLOB)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS leases (zone TEXT PRIMARY KEY, '
+            'owner TEXT, expires_at REAL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS plans (id TEXT PRIMARY KEY, '
+            'expires_at REAL, data BLOB)'
+        )
+        self._conn.commit()
+
+    def load(self, zone_name):
+        '''
+        Load a previously saved zone
+
+        :param zone_name: Name of the zone, with trailing dot
+        :return: Tuple of (snapshot, fetched_at) or None if nothing usable is
+                 stored
+        '''
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT format, fetched_at, data FROM snapshots WHERE zone = ?',
+                (zone_name,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        fmt, fetched_at, data = row
+        try:
+            if fmt != self.FORMAT:
+                raise ValueError(f'unsupported format {fmt}')
+            snapshot = ZoneSnapshot.unpack(zone_name, decompress(data))
+        except Exception as e:
+            self.log.warning(
+                'load: discarding invalid snapshot for %s, %s', zone_name, e
+            )
+            self.delete(zone_name)
+            return None
+
+        return snapshot, fetched_at
+
+    def save(self, zone_name, snapshot, fetched_at):
+        '''
+        Save a zone, replacing anything previously stored for it
+
+        :param zone_name: Name of the zone, with trailing dot
+        :param snapshot: ZoneSnapshot of the zone
+        :param fetched_at: Time the zone was fetched from its provider
+        '''
+        data = compress(snapshot.pack())
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)',
+                (zone_name, self.FORMAT, fetched_at, data),
+            )
+            self._conn.commit()
+
+    def delete(self, zone_name):
+        '''
+        Remove any stored snapshot of a zone
+
+        :param zone_name: Name of the zone, with trailing dot
+        '''
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM snapshots WHERE zone = ?', (zone_name,)
+            )
+            self._conn.commit()
+
+    def claim(self, zone_name, owner, duration):
+        '''
+        Take the lease to populate a zone
+
+        :param zone_name: Name of the zone, with trailing dot
+        :param owner: Id of the process taking the lease
+        :param duration: Seconds the lease is held for, unless released
+        :return: True if `owner` holds the lease
+        '''
+        now = time()
+        with self._lock:
+            # a single statement, it's atomic across processes
+            cursor = self._conn.execute(
+                'INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT (zone) DO '
+                'UPDATE SET owner = excluded.owner, expires_at = '
+                'excluded.expires_at WHERE leases.expires_at <= ? OR '
+                'leases.owner = excluded.owner',
+                (zone_name, owner, now + duration, now),
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def release(self, zone_name, owner):
+        '''
+        Give up a lease taken with `claim`
+
+        :param zone_name: Name of the zone, with trailing dot
+        :param owner: Id of the process that took the lease
+        '''
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM leases WHERE zone = ? AND owner = ?',
+                (zone_name, owner),
+            )
+            self._conn.commit()
+
+    def save_plan(self, plan_id, data, expires_at):
+        '''
+        Keep a dry-run plan so that any of the processes can apply it, see
+        `PlanStore`
+
+        :param plan_id: Id of the plan
+        :param data: bytes, the packed `StoredPlan`
+        :param expires_at: Time after which the plan is dropped
+        '''
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM plans WHERE expires_at <= ?', (time(),)
+            )
+            self._conn.execute(
+                'INSERT OR REPLACE INTO plans VALUES (?, ?, ?)',
+                (plan_id, expires_at, data),
+            )
+            self._conn.commit()
+
+    def take_plan(self, plan_id):
+        '''
+        Remove a plan kept with `save_plan`
+
+        :param plan_id: Id of the plan
+        :return: bytes, or None if there's no such plan or it's expired
+        '''
+        with self._lock:
+            # a single statement so that only one process gets the plan
+            row = self._conn.execute(
+                'DELETE FROM plans WHERE id = ? AND expires_at > ? '
+                'RETURNING data',
+                (plan_id, time()),
+            ).fetchone()
+            self._conn.commit()
+        return None if row is None else row[0]
+
+
+class KeyValueZoneStore:
+    '''
+    Shares zone snapshots through a networked key-value store, e.g. Redis, so
+    that processes on other hosts can use them
+
+    Each zone is stored as a single value, a small header with the format
+    and when it was fetched followed by its zlib compressed packed
+    `ZoneSnapshot`. `client` needs `get(key)`, `set(key, value, nx=False,
+    px=None)`, `getdel(key)`, `delete(key)`, and `eval(script, numkeys,
+    *keys_and_args)`, as provided by redis-py's `Redis`.
+    '''
+
+    # bump when the stored layout changes, values with other versions are
+    # discarded when read
+    FORMAT = 1
+
+    # format, fetched_at
+    _header = Struct('!Bd')
+
+    # deletes the lease only if it's still held by the owner, in one step so
+    # that a lease that expired and was claimed by another isn't released
+    _release = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('del', KEYS[1]) end return 0"
+    )
+
+    log = getLogger('KeyValueZoneStore')
+
+    def __init__(self, client, prefix='octodns-api'):
+        self.log.info('__init__: client=%s, prefix=%s', client, prefix)
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        '''
+        :param url: Redis URL, e.g. `redis://cache:6379/0`
+        :return: KeyValueZoneStore
+        '''
+        # only needed when there's a networked store
+        from redis import Redis
+
+        return cls(Redis.from_url(url), **kwargs)
+
+    def _key(self, kind, zone_name):
+        return f'{self.prefix}:{kind}:{zone_name}'
+
+    def load(self, zone_name):
+        '''
+        :param zone_name: Name of the zone, with trailing dot
+        :return: Tuple of (snapshot, fetched_at) or None if nothing usable is
+                 stored
+        '''
+        data = self.client.get(self._key('snapshot', zone_name))
+        if data is None:
+            return None
+
+        try:
+            fmt, fetched_at = self._header.unpack_from(data)
+            if fmt != self.FORMAT:
+                raise ValueError(f'unsupported format {fmt}')
+            snapshot = ZoneSnapshot.unpack(
+                zone_name, decompress(data[self._header.size :])
+            )
+        except Exception as e:
+            self.log.warning(
+                'load: discarding invalid snapshot for %s, %s', zone_name, e
+            )
+            self.delete(zone_name)
+            return None
+
+        return snapshot, fetched_at
+
+    def save(self, zone_name, snapshot, fetched_at):
+        '''
+        :param zone_name: Name of the zone, with trailing dot
+        :param snapshot: ZoneSnapshot of the zone
+        :param fetched_at: Time the zone was fetched from its provider
+        '''
+        data = self._header.pack(self.FORMAT, fetched_at) + compress(
+            snapshot.pack()
+        )
+        self.client.set(self._key('snapshot', zone_name), data)
+
+    def delete(self, zone_name):
+        '''
+        :param zone_name: Name of the zone, with trailing dot
+        '''
+        self.client.delete(self._key('snapshot', zone_name))
+
+    def claim(self, zone_name, owner, duration):
+        '''
+        See `SqliteZoneStore.claim`
+        '''
+        key = self._key('lease', zone_name)
+        if self.client.set(key, owner, nx=True, px=int(duration * 1000)):
+            return True
+        current = self.client.get(key)
+        if isinstance(current, bytes):
+            current = current.decode('utf-8')
+        return current == owner
+
+    def release(self, zone_name, owner):
+        '''
+        See `SqliteZoneStore.release`
+        '''
+        self.client.eval(self._release, 1, self._key('lease', zone_name), owner)
+
+    def save_plan(self, plan_id, data, expires_at):
+        '''
+        See `SqliteZoneStore.save_plan`
+        '''
+        px = max(1, int((expires_at - time()) * 1000))
+        self.client.set(self._key('plan', plan_id), data, px=px)
+
+    def take_plan(self, plan_id):
+        '''
+        See `SqliteZoneStore.take_plan`
+        '''
+        return self.client.getdel(self._key('plan', plan_id))
+
+
+class ZoneCache:
+    '''
+    In-process cache of zone snapshots
+
+    Snapshots are served from memory for `ttl` seconds after they're fetched.
+    When a `store` is provided they're also written to it so that they can be
+    restored after a restart, restored entries are marked unverified so that
+    the caller can refresh them in the background while serving them.
+
+    Each snapshot that's cached is given the next version of its zone, a
+    counter that only ever goes up, and the last `versions` of them are
+    retained so that reads can be made against a specific version.
+    Consecutive versions share the records they have in common.
+    Versions are counted per process, the counter is offset by a random
+    epoch, picked again in forked processes, so that the workers behind a
+    load balancer don't hand out the same versions for different snapshots
+    and a worker asked for another's version finds nothing. When the store
+    is `shared` snapshots aren't given one, only the most recent is
+    retained, and reads of specific versions find nothing.
+
+    Populating a zone takes a while and it may be written to in the
+    meantime. Callers note the zone's `generation` before they start and
+    pass it to `set`, which drops the snapshot if the zone has been cached,
+    or invalidated, since. Changes to the cached entries, and the store, are
+    made one at a time.
+
+    When the store is `shared` by other processes, e.g. a host's workers, or
+    a networked store used by several hosts, snapshots they've fetched within
+    the `ttl` are used as-is rather than populated again and `populating`
+    has one process at a time populate a zone while the others wait, for up
+    to `lease` seconds, to load what it populated. Stores used this way
+    need `claim` and `release`, see `SqliteZoneStore`.
+    '''
+
+    # versions are the epoch's bits followed by the counter's, together they
+    # stay within the integers JSON clients, e.g. JavaScript, represent exactly
+    EPOCH_BITS = 21
+    COUNTER_BITS = 32
+
+    log = getLogger('ZoneCache')
+
+    def __init__(self, ttl=0, store=None, versions=5, shared=False, lease=30):
+        self.log.info(
+            '__init__: ttl=%s, store=%s, versions=%d, shared=%s, lease=%s',
+            ttl,
+            store,
+            versions,
+            shared,
+            lease,
+        )
+        self.ttl = ttl
+        self.store = store
+        self.versions = versions
+        self.shared = bool(shared and store is not None)
+        self.lease = lease
+        # identifies this cache's leases
+        self._owner = uuid4().hex
+        self._epoch = None
+        self._epoch_pid = None
+        self._entries = {}
+        self._counters = {}
+        self._generations = {}
+        self._retained = {}
+        self._lock = Lock()
+        # held while the entries, and store, are changed, reads don't wait
+        # for it
+        self._changing = Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, zone_name):
+        '''
+        Get the cached entry for a zone
+
+        :param zone_name: Name of the zone, with trailing dot
+        :return: ZoneCacheEntry or None if there's no usable entry
+        '''
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(zone_name)
+        if entry:
+            if not entry.verified or time() - entry.fetched_at < self.ttl:
+                return entry
+            self.log.debug('get: zone=%s expired', zone_name)
+            if not self.shared:
+                return None
+            # another process may have fetched it since
+            return self._load(zone_name, entry, fresh=True)
+
+        if not self.store:
+            return None
+
+        return self._load(zone_name, None)
+
+    def cached(self, zone_name):
+        '''
+        :param zone_name: Name of the zone, with trailing dot
+        :return: True if `get` will answer from memory, without consulting
+                 the store
+        '''
+        if not self.enabled:
+            return False
+        entry = self._get_entry(zone_name)
+        return entry is not None and (
+            not entry.verified or time() - entry.fetched_at < self.ttl
+        )
+
+    def _load(self, zone_name, seen, fresh=False):
+        '''
+        :param seen: The entry the caller found cached, None if there wasn't
+                     one
+        :param fresh: Only use the stored snapshot if it's fresh
+        :return: ZoneCacheEntry or None if there's no usable stored snapshot
+        '''
+        loaded = self.store.load(zone_name)
+        if loaded is None:
+            return None
+        snapshot, fetched_at = loaded
+        # fetched within the ttl by another process sharing the store
+        verified = self.shared and time() - fetched_at < self.ttl
+        if fresh and not verified:
+            return None
+        self.log.info(
+            '_load: zone=%s restored from store, verified=%s',
+            zone_name,
+            verified,
+        )
+        with self._lock:
+            # someone else may have populated it while we were loading
+            entry = self._entries.get(zone_name)
+            if entry is seen:
+                snapshot = self._retain(zone_name, snapshot)
+                entry = ZoneCacheEntry(snapshot, fetched_at, verified=verified)
+                self._entries[zone_name] = entry
+            return entry
+
+    @contextmanager
+    def populating(self, zone_name):
+        '''
+        Coordinate populating a zone with the other processes sharing the
+        store
+
+        Yields None when the caller should populate, and `set`, the zone and
+        otherwise the entry another process populated while it waited. When
+        the store isn't shared it always yields None.
+
+        :param zone_name: Name of the zone, with trailing dot
+        '''
+        if not (self.enabled and self.shared):
+            yield None
+            return
+
+        owner = self._owner
+        deadline = monotonic() + self.lease
+        delay = 0.01
+        claimed = self.store.claim(zone_name, owner, self.lease)
+        while not claimed:
+            # another process is populating it, wait for its snapshot
+            sleep(delay)
+            delay = min(delay * 2, 0.5)
+            entry = self._load(zone_name, self._get_entry(zone_name), True)
+            if entry is not None:
+                self.log.debug('populating: zone=%s waited', zone_name)
+                yield entry
+                return
+            if monotonic() >= deadline:
+                self.log.warning(
+                    'populating: zone=%s lease not released, populating',
+                    zone_name,
+                )
+                break
+            claimed = self.store.claim(zone_name, owner, self.lease)
+
+        try:
+            # it may have been populated before the lease was claimed
+            yield self._load(zone_name, self._get_entry(zone_name), True)
+        finally:
+            if claimed:
+                self.store.release(zone_name, owner)
+
+    def _get_entry(self, zone_name):
+        with self._lock:
+            return self._entries.get(zone_name)
+
+    def generation(self, zone_name):
+        '''
+        :param zone_name: Name of the zone, with trailing dot
+        :return: Number that changes each time the zone is cached or
+                 invalidated, see `set`
+        '''
+        with self._lock:
+            return self._generations.get(zone_name, 0)
+
+    def set(self, zone_name, snapshot, verified=True, since=None):
+        '''
+        Cache a snapshot of a zone
+
+        :param zone_name: Name of the zone, with trailing dot
+        :param snapshot: ZoneSnapshot of the zone
+        :param verified: False if the snapshot wasn't freshly populated from
+                         the provider and should be refreshed
+        :param since: The zone's `generation` from before the snapshot was
+                      populated, it's only cached if it's unchanged
+        :return: The versioned ZoneSnapshot that was cached, `snapshot`
+                 as-is if the cache is disabled, or None if the zone changed
+                 since
+        '''
+        if not self.enabled:
+            return snapshot
+
+        with self._changing:
+            return self._set(zone_name, snapshot, verified, since)
+
+    def _set(self, zone_name, snapshot, verified, since=None):
+        # must be called with _changing held
+        fetched_at = time()
+        with self._lock:
+            if since is not None and since != self._generations.get(
+                zone_name, 0
+            ):
+                self.log.debug('set: zone=%s changed, dropped', zone_name)
+                return None
+            snapshot = self._retain(zone_name, snapshot)
+            self._entries[zone_name] = ZoneCacheEntry(
+                snapshot, fetched_at, verified=verified
+            )
+        if self.store:
+            # unverified snapshots are saved as stale so that other processes
+            # sharing the store don't use them as-is
+            self.store.save(zone_name, snapshot, fetched_at if verified else 0)
+        return snapshot
+
+    def update(self, zone_name, change):
+        '''
+        Replace the cached snapshot of a zone with a changed copy of it, e.g.
+        after a write, marked unverified
+
+        Nothing else can change the zone's entry in between. If there's no
+        cached snapshot to change any stored copy is dropped instead.
+
+        :param zone_name: Name of the zone, with trailing dot
+        :param change: Callable that's passed the cached ZoneSnapshot and
+                       returns the changed one
+        :return: The versioned ZoneSnapshot that was cached or None
+        '''
+        if not self.enabled:
+            return None
+
+        with self._changing:
+            entry = self.get(zone_name)
+            if entry is None:
+                self._invalidate(zone_name)
+                return None
+            return self._set(zone_name, change(entry.snapshot), False)
+
+    def _retain(self, zone_name, snapshot):
+        # must be called with the lock held
+        self._generations[zone_name] = self._generations.get(zone_name, 0) + 1
+        counter = self._counters.get(zone_name, 0) + 1
+        self._counters[zone_name] = counter
+        pid = getpid()
+        if self._epoch_pid != pid:
+            # a new process, or one forked from the process that made the
+            # cache, e.g. a pre-loading server's worker
+            self._epoch_pid = pid
+            self._epoch = getrandbits(self.EPOCH_BITS) << self.COUNTER_BITS
+        version = self._epoch + counter
+        retained = self._retained.get(zone_name)
+        if retained is None:
+            maxlen = 1 if self.shared else self.versions
+            retained = self._retained[zone_name] = deque(maxlen=maxlen)
+        previous = retained[-1] if retained else None
+        # other processes number the zone's versions differently
+        snapshot = snapshot.versioned(
+            None if self.shared else version, previous
+        )
+        retained.append(snapshot)
+        return snapshot
+
+    def version(self, zone_name, version=None):
+        '''
+        Get a retained version of a zone
+
+        :param zone_name: Name of the zone, with trailing dot
+        :param version: Version of the zone, the most recent when None
+        :return: ZoneSnapshot or None if the version isn't retained
+        '''
+        with self._lock:
+            retained = self._retained.get(zone_name)
+            if not retained:
+                return None
+            if version is None:
+                return retained[-1]
+            for snapshot in retained:
+                if snapshot.version == version:
+                    return snapshot
+        return None
+
+    def invalidate(self, zone_name):
+        '''
+        Drop any cached copy of a zone
+
+        Retained versions are kept, they can still be read, and the zone's
+        version counter carries on from where it was.
+
+        :param zone_name: Name of the zone, with trailing dot
+        '''
+        with self._changing:
+            self._invalidate(zone_name)
+
+    def _invalidate(self, zone_name):
+        # must be called with _changing held
+        with self._lock:
+            self._entries.pop(zone_name, None)
+            self._generations[zone_name] = (
+                self._generations.get(zone_name, 0) + 1
+            )
+        if self.store:
+            self.store.delete(zone_name)
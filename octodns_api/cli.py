@@ -5,8 +5,6 @@
 
 from octodns.cmds.args import ArgumentParser
 
-from octodns_api.app import create_app
-
 
 def main():
     parser = ArgumentParser(description='Run octoDNS API server')
@@ -26,6 +24,11 @@ def main():
 
     args = parser.parse_args()
 
+    # Flask, the blueprints, and octoDNS's manager are by far the bulk of the
+    # import time, deferring them until they're needed keeps things like
+    # --help near instant
+    from octodns_api.app import create_app
+
     app = create_app(args.config_file)
     app.run(host=args.host, port=args.port, debug=args.debug)
 
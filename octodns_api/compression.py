@@ -0,0 +1,150 @@
+#
+#
+#
+
+from gzip import compress as gzip_compress
+from logging import getLogger
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def parse_accept_encoding(header):
+    '''
+    Parse an Accept-Encoding header
+
+    :param header: Accept-Encoding header value, may be None
+    :return: Dict of lowercased encoding to its q-value
+    '''
+    encodings = {}
+    for part in (header or '').split(','):
+        encoding, *params = part.split(';')
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        encodings[encoding] = q
+    return encodings
+
+
+class Compression:
+    '''
+    Compresses response bodies for clients that accept it
+
+    gzip is always available and brotli is used when the `brotli` module is
+    installed. Bodies smaller than `min_size` bytes are sent as-is.
+    '''
+
+    log = getLogger('Compression')
+
+    def __init__(self, min_size=1024, level=6, brotli_quality=5):
+        self.log.info(
+            '__init__: min_size=%d, level=%d, brotli_quality=%d, brotli=%s',
+            min_size,
+            level,
+            brotli_quality,
+            brotli is not None,
+        )
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+
+    @property
+    def encodings(self):
+        '''
+        Supported encodings in order of preference
+        '''
+        if brotli is not None:
+            return ('br', 'gzip')
+        return ('gzip',)
+
+    def negotiate(self, accept_encoding):
+        '''
+        Pick the encoding to use for a response
+
+        :param accept_encoding: Accept-Encoding header value, may be None
+        :return: Encoding or None if the body should be sent uncompressed
+        '''
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get('*', 0.0)
+        best = None
+        best_q = 0.0
+        for encoding in self.encodings:
+            q = accepted.get(encoding, wildcard)
+            # ties go to the first, most preferred, encoding
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def compress(self, body, encoding):
+        '''
+        :param body: bytes to compress
+        :param encoding: Encoding to use, one of `encodings`
+        :return: Compressed bytes
+        '''
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        # fixed mtime so that the same body always compresses the same
+        return gzip_compress(body, compresslevel=self.level, mtime=0)
+
+    def response(self, body, accept_encoding, mimetype, cache=None):
+        '''
+        Build a response for a serialized body, compressing it if the
+        client accepts that and it's large enough to be worthwhile
+
+        :param body: Serialized body bytes
+        :param accept_encoding: Accept-Encoding header value, may be None
+        :param mimetype: Mimetype of the body
+        :param cache: Optional dict that compressed bodies are kept in, by
+                      encoding, so they aren't recompressed for every request
+        :return: Response
+        '''
+        response = Response(body, mimetype=mimetype)
+        return self._encode(response, body, accept_encoding, cache)
+
+    def after_request(self, response):
+        '''
+        Flask `after_request` hook that compresses any other large responses
+        '''
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+        ):
+            return response
+
+        return self._encode(
+            response,
+            response.get_data(),
+            request.headers.get('Accept-Encoding'),
+        )
+
+    def _encode(self, response, body, accept_encoding, cache=None):
+        if len(body) < self.min_size:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate(accept_encoding)
+        if encoding is None:
+            return response
+
+        compressed = cache.get(encoding) if cache is not None else None
+        if compressed is None:
+            compressed = self.compress(body, encoding)
+            if cache is not None:
+                cache[encoding] = compressed
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,51 @@
+#
+#
+#
+
+from functools import lru_cache
+
+from octodns.idna import idna_decode as _idna_decode
+from octodns.idna import idna_encode as _idna_encode
+
+# Zone and record names come in with every request, but there are only so many
+# of them, so conversions are memoized. Bounded so that requests for arbitrary
+# names can't grow it without limit.
+MAX_NAMES = 4096
+
+
+@lru_cache(maxsize=MAX_NAMES)
+def idna_decode(name):
+    '''
+    Memoized `octodns.idna.idna_decode`
+
+    :param name: Name, utf-8 or idna encoded
+    :return: Lowercased utf-8 name
+    '''
+    return _idna_decode(name)
+
+
+@lru_cache(maxsize=MAX_NAMES)
+def idna_encode(name):
+    '''
+    Memoized `octodns.idna.idna_encode`
+
+    :param name: Name, utf-8 or idna encoded
+    :return: Lowercased idna encoded name
+    '''
+    return _idna_encode(name)
+
+
+@lru_cache(maxsize=MAX_NAMES)
+def zone_name(name):
+    '''
+    Canonical form of a zone name, utf-8 decoded, lowercased, and with a
+    trailing dot
+
+    :param name: Zone name, utf-8 or idna encoded, with or without the
+                 trailing dot
+    :return: Canonical zone name, e.g. `exämple.com.`
+    '''
+    name = idna_decode(name)
+    if not name.endswith('.'):
+        name = f'{name}.'
+    return name
@@ -2,17 +2,42 @@
 #
 #
 
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
+from sys import stdout
+from threading import Lock
 
+from octodns.idna import IdnaError
 from octodns.manager import Manager
 from octodns.record import Record
 from octodns.zone import Zone
 
+from .cache import KeyValueZoneStore, SqliteZoneStore, ZoneCache
+from .idna import idna_encode
+from .idna import zone_name as canonical_zone_name
+from .overlay import OverlayZone
+from .planning import PlanningPool, build_zone, summarize
+from .plans import PlanStore, fingerprint
+from .pools import ConnectionPools
+from .search import SearchIndex
+from .snapshot import ZoneSnapshot
+from .timing import timed
+from .zonefile import export as export_zonefile
+from .zonefile import parse as parse_zonefile
+
 
 class ApiManagerException(Exception):
     pass
 
 
+class StalePlanException(ApiManagerException):
+    pass
+
+
+class SearchUnavailableException(ApiManagerException):
+    pass
+
+
 class _TargetOnlyManager(Manager):
 
     def process_config(self, config):
@@ -45,6 +70,60 @@ class ApiManager:
         self.config_file = config_file
         self.manager = _TargetOnlyManager(config_file)
 
+        api_config = self.manager.config.get('api', {})
+        cache_config = api_config.get('cache', {})
+        store = None
+        if cache_config.get('path'):
+            store = SqliteZoneStore(cache_config['path'])
+        elif cache_config.get('url'):
+            store = KeyValueZoneStore.from_url(
+                cache_config['url'],
+                prefix=cache_config.get('prefix', 'octodns-api'),
+            )
+        self.cache = ZoneCache(
+            ttl=cache_config.get('ttl', 0),
+            store=store,
+            versions=cache_config.get('versions', 5),
+            shared=cache_config.get('shared', False),
+            lease=cache_config.get('lease', 30),
+        )
+
+        # Pooled connections for providers' HTTP sessions, shared by all of
+        # the requests the API handles
+        self.pools = ConnectionPools(**api_config.get('connection_pools', {}))
+        for name, provider in self.manager.providers.items():
+            self.pools.configure(name, provider)
+
+        # Dry-run sync plans, kept so that they can be applied as reviewed,
+        # in the cache's store when it's shared so that any process can
+        self.plans = PlanStore(
+            store=store if self.cache.shared else None,
+            **api_config.get('plans', {}),
+        )
+
+        # Worker processes that plan large zones off of the request threads
+        self.planning = PlanningPool(
+            config_file, **api_config.get('planning', {})
+        )
+
+        # Built up from cached zone snapshots once a search has been made and
+        # then kept up to date as they're refreshed
+        self.search_index = SearchIndex()
+        self._indexing = False
+
+        # Restored snapshots are re-verified against their provider in the
+        # background so that startup doesn't wait on populating every zone
+        self._refresh_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='ApiManager-refresh'
+        )
+        self._refreshing = set()
+        self._refreshing_lock = Lock()
+
+        # Writes to a zone are made one at a time so that each is planned
+        # against the zone as the previous one left it
+        self._write_locks = {}
+        self._write_locks_lock = Lock()
+
     def list_zones(self):
         '''
         List all configured zones (including expanded dynamic zones)
@@ -53,20 +132,159 @@ class ApiManager:
         '''
         return sorted(self.manager.zones.keys())
 
-    def get_zone(self, zone_name):
+    def cached(self, zone_name):
+        '''
+        :param zone_name: Name of the zone as provided by the caller
+        :return: True if reads of the zone will be answered from memory,
+                 without blocking on the provider or the cache's store
+        '''
+        try:
+            zone_name = canonical_zone_name(zone_name)
+        except IdnaError:
+            # the read will report it
+            return False
+        return self.cache.cached(zone_name)
+
+    def _zone_name(self, zone_name):
+        '''
+        :param zone_name: Name of the zone as provided by the caller
+        :return: Canonical name of the zone
+        :raises ApiManagerException: if the zone isn't configured
+        '''
+        zone_name = canonical_zone_name(zone_name)
+        if zone_name not in self.manager.zones:
+            raise ApiManagerException(f'Zone {zone_name} not configured')
+        return zone_name
+
+    def get_zone(self, zone_name, version=None):
         '''
         Get a zone with all its records from the configured sources
 
+        When the zone cache has a usable snapshot the zone is rebuilt from it,
+        once per snapshot, rather than being populated from the provider. The
+        rebuilt zone is shared so callers get an `OverlayZone` on top of it
+        that their changes are made to.
+
         :param zone_name: Name of the zone (e.g., 'example.com.')
         :type zone_name: str
+        :param version: Optional retained version of the zone to read
+        :type version: int
         :return: Zone object populated with records
         '''
-        if not zone_name.endswith('.'):
-            zone_name = f'{zone_name}.'
+        snapshot, zone = self._get(zone_name, version)
+        if zone is None:
+            zone = OverlayZone(snapshot.derived('zone', snapshot.to_zone))
+        return zone
 
-        if zone_name not in self.manager.zones:
-            raise ApiManagerException(f'Zone {zone_name} not configured')
+    def get_snapshot(self, zone_name, version=None):
+        '''
+        Get a compact, read-only, snapshot of a zone
+
+        Served from the zone cache when it's enabled and has a usable entry
+
+        :param zone_name: Name of the zone (e.g., 'example.com.')
+        :type zone_name: str
+        :param version: Optional retained version of the zone to read
+        :type version: int
+        :return: ZoneSnapshot, its `version` is set when it came from the
+                 cache
+        '''
+        snapshot, zone = self._get(zone_name, version)
+        if snapshot is None:
+            snapshot = ZoneSnapshot.from_zone(zone)
+        return snapshot
+
+    def _get(self, zone_name, version=None):
+        '''
+        :param version: Optional retained version of the zone to read, it's
+                        never populated from the provider
+        :return: Tuple of (snapshot, zone), zone is only set when it was
+                 populated from the provider and snapshot only when the cache
+                 is enabled
+        :raises ApiManagerException: if the version isn't retained
+        '''
+        zone_name = self._zone_name(zone_name)
+
+        if version is not None:
+            with timed('zone', 'version'):
+                return self._version(zone_name, version), None
+
+        with timed('zone') as span:
+            entry = self.cache.get(zone_name)
+            if entry:
+                if entry.verified:
+                    span.desc = 'hit'
+                else:
+                    span.desc = 'unverified'
+                    self._schedule_refresh(zone_name)
+                return entry.snapshot, None
+
+            span.desc = 'miss'
+            with self.cache.populating(zone_name) as entry:
+                if entry is not None:
+                    # populated by another process while we waited
+                    span.desc = 'shared'
+                    return entry.snapshot, None
+
+                since = self.cache.generation(zone_name)
+                zone = self._populate_zone(zone_name)
+                snapshot = None
+                if self.cache.enabled:
+                    # None if the zone was written to while we populated
+                    snapshot = self._cache(
+                        zone_name, ZoneSnapshot.from_zone(zone), since=since
+                    )
+
+            return snapshot, zone
+
+    def _version(self, zone_name, version=None):
+        '''
+        :param zone_name: Canonical name of the zone
+        :param version: Version of the zone, the most recent when None
+        :return: Retained ZoneSnapshot
+        :raises ApiManagerException: if the version isn't retained
+        '''
+        if version is not None and self.cache.shared:
+            raise ApiManagerException(
+                f'Versions of zone {zone_name} are not available when the '
+                'cache is shared'
+            )
+        snapshot = self.cache.version(zone_name, version)
+        if snapshot is None:
+            if version is None:
+                raise ApiManagerException(
+                    f'No versions of zone {zone_name} available'
+                )
+            raise ApiManagerException(
+                f'Version {version} of zone {zone_name} not available'
+            )
+        return snapshot
+
+    def _cache(self, zone_name, snapshot, verified=True, since=None):
+        '''
+        :param since: The zone's cache generation from before the snapshot
+                      was populated, see `ZoneCache.set`
+        :return: The cached ZoneSnapshot or None if it wasn't cached
+        '''
+        snapshot = self.cache.set(
+            zone_name, snapshot, verified=verified, since=since
+        )
+        self._index(zone_name, snapshot)
+        return snapshot
+
+    def _index(self, zone_name, snapshot):
+        if snapshot is not None and self._indexing:
+            self.search_index.update(zone_name, snapshot)
+
+    def _invalidate(self, zone_name):
+        '''
+        Drop the cached copy of a zone, and what's indexed of it, e.g. once
+        it's been synced
+        '''
+        self.cache.invalidate(zone_name)
+        self.search_index.remove(zone_name)
 
+    def _populate_zone(self, zone_name):
         zone_config = self.manager.zones[zone_name]
         targets = self.manager._get_sources(zone_name, zone_config)
 
@@ -77,25 +295,179 @@ class ApiManager:
 
         return zone
 
-    def get_record(self, zone_name, record_name, record_type):
+    def _write_lock(self, zone_name):
+        '''
+        :param zone_name: Canonical name of the zone
+        :return: Lock that serializes writes to the zone
+        '''
+        with self._write_locks_lock:
+            lock = self._write_locks.get(zone_name)
+            if lock is None:
+                lock = self._write_locks[zone_name] = Lock()
+            return lock
+
+    def _populate_fresh(self, zone_name):
+        '''
+        Populate a zone from its provider, bypassing the cache, for a write
+        to plan against
+
+        Cached snapshots can be up to `ttl` seconds old and planning against
+        one would delete any records created since, e.g. by another worker.
+        '''
+        with timed('zone', 'fresh'):
+            return self._populate_zone(zone_name)
+
+    def _schedule_refresh(self, zone_name):
+        '''
+        Re-populate a zone in the background, replacing its cached entry
+
+        :return: Future for the refresh or None if one is already pending
+        '''
+        with self._refreshing_lock:
+            if zone_name in self._refreshing:
+                return None
+            self._refreshing.add(zone_name)
+        self.log.debug('_schedule_refresh: zone_name=%s', zone_name)
+        return self._refresh_executor.submit(self._refresh, zone_name)
+
+    def _refresh(self, zone_name):
+        try:
+            with self.cache.populating(zone_name) as entry:
+                if entry is None:
+                    since = self.cache.generation(zone_name)
+                    zone = self._populate_zone(zone_name)
+                    self._cache(
+                        zone_name, ZoneSnapshot.from_zone(zone), since=since
+                    )
+                else:
+                    # populated by another process
+                    self._index(zone_name, entry.snapshot)
+        except Exception:
+            self.log.exception('_refresh: zone_name=%s failed', zone_name)
+        finally:
+            with self._refreshing_lock:
+                self._refreshing.discard(zone_name)
+
+    def get_record(self, zone_name, record_name, record_type, version=None):
         '''
         Get a specific record from a zone
 
         :param zone_name: Name of the zone
         :param record_name: Name of the record (e.g., 'www' or '' for apex)
         :param record_type: Record type (e.g., 'A', 'CNAME')
+        :param version: Optional retained version of the zone to read
+        :return: Record object or None
+        '''
+        snapshot, zone = self._get(zone_name, version)
+        with timed('lookup'):
+            return self._find_record(snapshot, zone, record_name, record_type)
+
+    def _find_record(self, snapshot, zone, record_name, record_type):
+        '''
+        :param snapshot: Snapshot of the zone, used when zone is None
+        :param zone: Populated zone or None
         :return: Record object or None
         '''
-        zone = self.get_zone(zone_name)
+        if zone is None:
+            # only rebuild the one record we're after
+            return snapshot.record(record_name, record_type)
 
-        for record in zone.records:
-            if (
-                record.decoded_name == record_name
-                and record._type == record_type
-            ):
-                return record
+        # zones index their records by (encoded) name
+        return zone.get_type(idna_encode(record_name), record_type)
 
-        return None
+    def lookup_records(self, zone_name, keys, version=None):
+        '''
+        Look up a number of records in a zone at once
+
+        All of the lookups are made against a single snapshot of the zone so
+        that it's only fetched once and the results are consistent.
+
+        :param zone_name: Name of the zone
+        :param keys: Iterable of (decoded record name, record type) tuples
+        :param version: Optional retained version of the zone to read
+        :return: Tuple of (snapshot, found, misses), found is a list of
+                 (name, type, data) tuples and misses a list of (name, type)
+                 tuples, both in the order they were asked for
+        '''
+        snapshot = self.get_snapshot(zone_name, version)
+        found = []
+        misses = []
+        with timed('lookup'):
+            for name, _type in keys:
+                data = snapshot.get(name, _type)
+                if data is None:
+                    misses.append((name, _type))
+                else:
+                    found.append((name, _type, data))
+        return snapshot, found, misses
+
+    def diff_zone(self, zone_name, from_version, to_version=None):
+        '''
+        Find the records that changed between two retained versions of a zone
+
+        Only retained versions are compared, the provider is never consulted.
+
+        :param zone_name: Name of the zone
+        :param from_version: Version of the zone to compare from
+        :param to_version: Version of the zone to compare to, the most recent
+                           retained version when None
+        :return: Tuple of (from snapshot, to snapshot, changes), changes is a
+                 list of (name, type, existing data, new data) tuples
+        :raises ApiManagerException: if either version isn't retained
+        '''
+        zone_name = self._zone_name(zone_name)
+        with timed('zone', 'version'):
+            before = self._version(zone_name, from_version)
+            after = self._version(zone_name, to_version)
+        with timed('diff'):
+            changes = before.diff(after)
+        self.log.debug(
+            'diff_zone: zone_name=%s, from=%d, to=%d, changes=%d',
+            zone_name,
+            before.version,
+            after.version,
+            len(changes),
+        )
+        return before, after, changes
+
+    def search(self, name=None, _type=None, value=None, limit=None):
+        '''
+        Search for records across all zones
+
+        Zones are never populated by a search. Cached snapshots are brought
+        up to date in the index, and zones that aren't cached, or whose
+        cached copy needs refreshing, are refreshed in the background, and
+        re-indexed when they have been. Until then they're searched as they
+        were last indexed, if at all. Without the zone cache nothing would
+        stay indexed, every search would refresh every zone, so searching
+        needs it.
+
+        :param name: Fqdn of the record, e.g. `www.example.com`
+        :param _type: Record type
+        :param value: One of the record's values, e.g. `10.1.2.3`
+        :param limit: Maximum number of results to return
+        :return: Tuple of (results, truncated), results is a list of (zone
+                 name, record name, type, data) tuples
+        :raises SearchUnavailableException: if the zone cache is disabled
+        '''
+        if not self.cache.enabled:
+            raise SearchUnavailableException(
+                'Search requires the zone cache, api.cache.ttl'
+            )
+        self._indexing = True
+        for zone_name in self.manager.zones:
+            zone_name = canonical_zone_name(zone_name)
+            entry = self.cache.get(zone_name)
+            if entry:
+                self.search_index.update(zone_name, entry.snapshot)
+                if entry.verified:
+                    continue
+            self._schedule_refresh(zone_name)
+
+        with timed('search'):
+            return self.search_index.search(
+                name=name, _type=_type, value=value, limit=limit
+            )
 
     def create_or_update_record(
         self, zone_name, record_name, record_type, record_data
@@ -109,11 +481,7 @@ class ApiManager:
         :param record_data: Record data dictionary
         :return: Tuple of (record, changes_applied)
         '''
-        if not zone_name.endswith('.'):
-            zone_name = f'{zone_name}.'
-
-        if zone_name not in self.manager.zones:
-            raise ApiManagerException(f'Zone {zone_name} not configured')
+        zone_name = self._zone_name(zone_name)
 
         zone_config = self.manager.zones[zone_name]
         targets = zone_config.get('targets', [])
@@ -123,28 +491,59 @@ class ApiManager:
                 f'Zone {zone_name} has no targets configured'
             )
 
-        # Get current zone state
-        zone = self.get_zone(zone_name)
+        target_name = targets[0]
+        target = self.manager.providers.get(target_name)
 
-        # Create new record from data
+        if not target:
+            raise ApiManagerException(f'Target {target_name} not found')
+
+        with self._write_lock(zone_name):
+            return self._create_or_update_record(
+                zone_name, target, record_name, record_type, record_data
+            )
+
+    def _create_or_update_record(
+        self, zone_name, target, record_name, record_type, record_data
+    ):
+        # Get current zone state, always from the provider, a cached snapshot
+        # could be missing changes, e.g. written by another worker, and a
+        # record that looks unchanged against it may not be
+        zone = self._populate_fresh(zone_name)
         record_data['type'] = record_type
+
+        # Create new record from data
         new_record = Record.new(zone, record_name, record_data)
 
-        # Create desired zone with the new/updated record
-        desired = zone.copy()
+        # Re-asserting a record as the provider already has it doesn't need
+        # the zone to be planned
+        with timed('lookup'):
+            existing = self._find_record(None, zone, record_name, record_type)
+        if (
+            existing is not None
+            and new_record.changes(existing, target) is None
+            and new_record.octodns == existing.octodns
+        ):
+            self.log.debug(
+                'create_or_update_record: zone_name=%s, record_name=%s, '
+                'record_type=%s unchanged',
+                zone_name,
+                record_name,
+                record_type,
+            )
+            return new_record, False
+
+        # Desired zone is the current state plus the new/updated record
+        desired = OverlayZone(zone)
         desired.add_record(new_record, replace=True)
 
         # Sync to targets
-        target_name = targets[0]
-        target = self.manager.providers.get(target_name)
-
-        if not target:
-            raise ApiManagerException(f'Target {target_name} not found')
-
-        plan = target.plan(desired)
+        with timed('plan'):
+            plan = target.plan(desired)
 
         if plan:
-            target.apply(plan)
+            with timed('apply'):
+                target.apply(plan)
+            self._write_through(zone_name, plan.changes)
             return new_record, True
 
         return new_record, False
@@ -164,11 +563,7 @@ class ApiManager:
             record_name,
             record_type,
         )
-        if not zone_name.endswith('.'):
-            zone_name = f'{zone_name}.'
-
-        if zone_name not in self.manager.zones:
-            raise ApiManagerException(f'Zone {zone_name} not configured')
+        zone_name = self._zone_name(zone_name)
 
         zone_config = self.manager.zones[zone_name]
         targets = zone_config.get('targets', [])
@@ -179,61 +574,429 @@ class ApiManager:
                 f'Zone {zone_name} has no targets configured'
             )
 
-        # Get current zone state
-        zone = self.get_zone(zone_name)
+        with self._write_lock(zone_name):
+            return self._delete_record(
+                zone_name, targets, record_name, record_type
+            )
+
+    def _delete_record(self, zone_name, targets, record_name, record_type):
+        # Get current zone state, always from the provider, a cached snapshot
+        # could be missing records
+        zone = self._populate_fresh(zone_name)
         self.log.debug('delete_record:   zone=%s', zone)
 
         # Find the record to delete
-        record_to_delete = None
-        for record in zone.records:
-            if (
-                record.decoded_name == record_name
-                and record._type == record_type
-            ):
-                record_to_delete = record
-                break
+        with timed('lookup'):
+            record_to_delete = self._find_record(
+                None, zone, record_name, record_type
+            )
         self.log.debug('delete_record:   record_to_delete=%s', record_to_delete)
 
         if not record_to_delete:
             return False
 
-        # Create desired zone without the record (empty zone for this specific record)
-        desired = zone.copy()
+        # Desired zone is the current state less the record
+        desired = OverlayZone(zone)
         desired.remove_record(record_to_delete)
 
         # Sync to targets
         changes = False
-        for target_name in targets:
+        for i, target_name in enumerate(targets):
             target = self.manager.providers.get(target_name)
             if not target:
                 raise ApiManagerException(f'Target {target_name} not found')
 
             # Plan with target record deleted
-            plan = target.plan(desired)
+            with timed('plan'):
+                plan = target.plan(desired)
 
             if plan:
-                target.apply(plan)
+                with timed('apply'):
+                    target.apply(plan)
                 changes = True
+                # the zone is populated, and cached, from the first target
+                if i == 0:
+                    self._write_through(zone_name, plan.changes)
 
         return changes
 
+    def export_zone(self, zone_name, format='yaml', version=None):
+        '''
+        Export a zone's records
+
+        :param zone_name: Name of the zone
+        :param format: `yaml` or `bind`
+        :param version: Optional retained version of the zone to export
+        :return: Tuple of (version, generator of str chunks), version is None
+                 when the zone cache is disabled
+        '''
+        snapshot = self.get_snapshot(zone_name, version)
+        self.log.debug(
+            'export_zone: zone_name=%s, format=%s, records=%d',
+            zone_name,
+            format,
+            len(snapshot),
+        )
+        return snapshot.version, export_zonefile(snapshot, format)
+
+    def import_zone(self, zone_name, fh, format='yaml', force=False):
+        '''
+        Replace all of a zone's records with those in a zone file
+
+        :param zone_name: Name of the zone
+        :param fh: File-like object of text in `format`
+        :param format: `yaml` or `bind`
+        :param force: Apply plans that exceed the targets' safety thresholds
+        :return: Dictionary summarizing the plan for each target
+        '''
+        zone_name = self._zone_name(zone_name)
+        if self.planning.wants(None):
+            # its size isn't known until it's been parsed, it's treated as
+            # large and parsed in a worker process
+            with timed('read'):
+                text = fh.read()
+            self.log.debug(
+                'import_zone: zone_name=%s, format=%s, in a worker process',
+                zone_name,
+                format,
+            )
+            return self._replace_in_worker(
+                zone_name, 'zonefile', (text, format), force
+            )
+
+        desired = Zone(zone_name, [])
+        with timed('parse'):
+            parse_zonefile(fh, desired, format)
+        self.log.debug(
+            'import_zone: zone_name=%s, format=%s, records=%d',
+            zone_name,
+            format,
+            len(desired.records),
+        )
+        return self.replace_zone(zone_name, desired, force=force)
+
+    def replace_records(self, zone_name, records, force=False):
+        '''
+        Replace all of a zone's records
+
+        :param zone_name: Name of the zone
+        :param records: Dict of decoded record name to a dict of record type
+                        to record data, the same shape the records listing
+                        returns
+        :param force: Apply plans that exceed the targets' safety thresholds
+        :return: Dictionary summarizing the plan for each target
+        '''
+        zone_name = self._zone_name(zone_name)
+        if self.planning.wants(
+            self._replace_size(
+                zone_name, sum(len(types) for types in records.values())
+            )
+        ):
+            # built and validated in a worker process
+            return self._replace_in_worker(zone_name, 'records', records, force)
+
+        with timed('build'):
+            desired = build_zone(zone_name, records)
+        self.log.debug(
+            'replace_records: zone_name=%s, records=%d',
+            zone_name,
+            len(desired.records),
+        )
+        return self.replace_zone(zone_name, desired, force=force)
+
+    def replace_zone(self, zone_name, desired, force=False):
+        '''
+        Make a zone's targets match a desired zone
+
+        Each target gets a single plan. All of them are planned, and checked
+        against their safety thresholds, before any are applied so that an
+        unsafe plan doesn't leave targets out of sync with each other.
+
+        Large zones, see `PlanningPool`, are planned and applied in a worker
+        process.
+
+        :param zone_name: Name of the zone
+        :param desired: Zone with the complete set of desired records
+        :param force: Apply plans that exceed the targets' safety thresholds
+        :return: Dictionary summarizing the plan for each target
+        :raises UnsafePlan: if a plan isn't safe and force isn't set
+        '''
+        zone_name = self._zone_name(zone_name)
+        targets = self._targets(zone_name)
+
+        with self._write_lock(zone_name):
+            return self._replace_zone(zone_name, targets, desired, force)
+
+    def _replace_size(self, zone_name, records):
+        '''
+        :param records: Number of desired records
+        :return: The larger of the number of desired records and the number
+                 currently cached, for `PlanningPool.wants`
+        '''
+        current = self.cache.version(zone_name)
+        if current is not None:
+            records = max(records, len(current))
+        return records
+
+    def _replace_in_worker(self, zone_name, kind, data, force):
+        '''
+        Make a zone's targets match a desired zone that's built, and
+        validated, as well as planned and applied, in a worker process
+
+        :param kind: What `data` is, see `PlanningPool.replace_zone`
+        :param data: The desired zone
+        '''
+        targets = self._targets(zone_name)
+
+        with self._write_lock(zone_name):
+            return self._replace_zone_in_worker(
+                zone_name, targets, kind, data, force
+            )
+
+    def _replace_zone_in_worker(self, zone_name, targets, kind, data, force):
+        with timed('plan', 'process'):
+            summary, changes = self.planning.replace_zone(
+                zone_name,
+                [target_name for target_name, _ in targets],
+                kind,
+                data,
+                force=force,
+            )
+        if changes is not None:
+            self._write_through(zone_name, changes, packed=True)
+        return {'zone': zone_name, 'targets': summary}
+
+    def _replace_zone(self, zone_name, targets, desired, force):
+        if self.planning.wants(
+            self._replace_size(zone_name, len(desired.records))
+        ):
+            return self._replace_zone_in_worker(
+                zone_name,
+                targets,
+                'snapshot',
+                ZoneSnapshot.from_zone(desired).pack(),
+                force,
+            )
+
+        plans = []
+        for target_name, target in targets:
+            with timed('plan'):
+                plan = target.plan(desired)
+            if plan and not force:
+                plan.raise_if_unsafe()
+            plans.append((target_name, target, plan))
+
+        summary = []
+        for i, (target_name, target, plan) in enumerate(plans):
+            if plan:
+                with timed('apply'):
+                    target.apply(plan)
+                # the zone is populated, and cached, from the first target
+                if i == 0:
+                    self._write_through(zone_name, plan.changes)
+            summary.append(summarize(target_name, plan, bool(plan)))
+
+        return {'zone': zone_name, 'targets': summary}
+
+    def _targets(self, zone_name):
+        '''
+        :param zone_name: Canonical name of the zone
+        :return: List of (name, provider) tuples for the zone's targets
+        :raises ApiManagerException: if the zone has no targets or one of
+                                     them doesn't exist
+        '''
+        targets = self.manager.zones[zone_name].get('targets', [])
+        if not targets:
+            raise ApiManagerException(
+                f'Zone {zone_name} has no targets configured'
+            )
+        ret = []
+        for target_name in targets:
+            target = self.manager.providers.get(target_name)
+            if not target:
+                raise ApiManagerException(f'Target {target_name} not found')
+            ret.append((target_name, target))
+        return ret
+
+    def _write_through(self, zone_name, changes, packed=False):
+        '''
+        Cache the zone as it is now that a plan's been applied
+
+        :param changes: The plan's changes
+        :param packed: True if the changes were packed with `pack_changes`,
+                       e.g. by a planning process
+
+        The cached snapshot, adjusted for the plan's changes, replaces it so
+        that reads see the change without going back to the provider. It's
+        marked unverified so that it's refreshed in the background. If
+        there's no cached snapshot to adjust any stored copy is dropped.
+        '''
+        self.log.debug(
+            '_write_through: zone_name=%s, changes=%d', zone_name, len(changes)
+        )
+
+        def change(snapshot):
+            if packed:
+                return snapshot.apply_packed(changes)
+            return snapshot.apply(changes)
+
+        snapshot = self.cache.update(zone_name, change)
+        if snapshot is None:
+            # there was nothing cached to adjust, it's been dropped
+            self.search_index.remove(zone_name)
+        else:
+            self._index(zone_name, snapshot)
+
     def sync_zone(self, zone_name, dry_run=True):
         '''
         Sync a zone from sources to targets
 
+        Dry-runs keep the plans they compute, see `apply_plan`, and their
+        result includes the id they're kept under, `plan_id`, when there are
+        changes to apply. Other syncs of large zones, or ones that haven't
+        been cached so their size isn't known, are run in a worker process
+        when the planning pool is enabled.
+
         :param zone_name: Name of the zone
         :param dry_run: If True, only plan changes without applying
         :return: Dictionary with plan information
         '''
-        if not zone_name.endswith('.'):
-            zone_name = f'{zone_name}.'
+        zone_name = self._zone_name(zone_name)
 
-        if zone_name not in self.manager.zones:
-            raise ApiManagerException(f'Zone {zone_name} not configured')
-
-        eligible_zones = [zone_name]
-        result = self.manager.sync(
-            eligible_zones=eligible_zones, dry_run=dry_run, force=False
-        )
+        zone_config = self.manager.zones[zone_name]
+        # alias zones are planned along with the zone they alias
+        if dry_run and 'alias' not in zone_config:
+            return self._plan_sync(zone_name, zone_config)
+
+        with self._write_lock(zone_name):
+            current = self.cache.version(zone_name)
+            if self.planning.wants(None if current is None else len(current)):
+                with timed('sync', 'process'):
+                    result = self.planning.sync_zone(zone_name, dry_run)
+            else:
+                eligible_zones = [zone_name]
+                with timed('sync'):
+                    result = self.manager.sync(
+                        eligible_zones=eligible_zones,
+                        dry_run=dry_run,
+                        force=False,
+                    )
+            if not dry_run:
+                self._invalidate(zone_name)
 
         return {'zone': zone_name, 'dry_run': dry_run, 'result': result}
+
+    def _plan_sync(self, zone_name, zone_config):
+        '''
+        Plan a sync of a zone, the same way `Manager.sync` would, including
+        running the configured plan outputs, and keep the plans so that they
+        can be applied later
+
+        The plans are kept along with a fingerprint of each target's zone, as
+        it was when it was planned against, so that `apply_plan` can tell if
+        any of them have changed since.
+        '''
+        targets = [t for _, t in self._targets(zone_name)]
+        manager = self.manager
+        with timed('sync'):
+            plans, _ = manager._populate_and_plan(
+                zone_name,
+                manager._get_processors(zone_name, zone_config),
+                manager._get_sources(zone_name, zone_config),
+                targets,
+                lenient=zone_config.get('lenient', False),
+            )
+        for output in manager.plan_outputs.values():
+            output.run(plans=plans, log=manager.plan_log, fh=stdout)
+
+        for _, plan in plans:
+            plan.raise_if_unsafe()
+
+        plan_id = None
+        if plans and not zone_config.get('always-dry-run', False):
+            plan_id = self.plans.add(zone_name, fingerprint(plans), plans).id
+
+        return {
+            'zone': zone_name,
+            'dry_run': True,
+            # what Manager.sync returns for dry-runs
+            'result': 0,
+            'changes': sum(len(plan.changes) for _, plan in plans),
+            'plan_id': plan_id,
+            'targets': [
+                summarize(target.id, plan, False) for target, plan in plans
+            ],
+        }
+
+    def apply_plan(self, plan_id):
+        '''
+        Apply the plans kept by a dry-run sync, exactly as they were planned
+
+        Plans can only be applied once and only if the zone hasn't changed
+        since they were made. To tell, each of the targets is planned again,
+        populating its zone from the provider, the cache could be missing
+        writes made by other processes.
+
+        :param plan_id: Id of the plans, `plan_id` from a dry-run sync
+        :return: Dictionary with the changes applied to each target
+        :raises ApiManagerException: if there's no such plan, or it's expired
+        :raises StalePlanException: if the zone has changed since
+        '''
+        stored = self.plans.take(plan_id)
+        if stored is None:
+            raise ApiManagerException(f'Plan {plan_id} not found')
+        zone_name = stored.zone_name
+
+        with self._write_lock(zone_name):
+            return self._apply_plan(plan_id, stored, zone_name)
+
+    def _apply_plan(self, plan_id, stored, zone_name):
+        zone_config = self.manager.zones[zone_name]
+        processors = self.manager._get_processors(zone_name, zone_config)
+        lenient = zone_config.get('lenient', False)
+        # each target is planned again, against what it was planned to
+        # become, to see its zone as it is now
+        current = []
+        with timed('plan'):
+            for target_id, snapshot in stored.desired:
+                try:
+                    target = self.manager.providers[target_id]
+                except KeyError:
+                    raise ApiManagerException(
+                        f'Target {target_id} of plan {plan_id} not found'
+                    )
+                desired = snapshot.to_zone(self.manager.get_zone(zone_name))
+                replanned = target.plan(
+                    desired, processors=processors, lenient=lenient
+                )
+                if replanned is None:
+                    # it's already as planned
+                    current = None
+                    break
+                current.append((target, replanned))
+        if current is None or fingerprint(current) != stored.fingerprint:
+            self.log.info(
+                'apply_plan: plan_id=%s, zone_name=%s has changed',
+                plan_id,
+                zone_name,
+            )
+            raise StalePlanException(
+                f'Zone {zone_name} has changed since plan {plan_id} was made'
+            )
+
+        # the re-made plans have the same changes, they were made against
+        # the same zones
+        result = 0
+        with timed('apply'):
+            for target, plan in current:
+                result += target.apply(plan)
+        self._invalidate(zone_name)
+
+        return {
+            'zone': zone_name,
+            'plan_id': plan_id,
+            'result': result,
+            'targets': [
+                summarize(target.id, plan, True) for target, plan in current
+            ],
+        }
@@ -0,0 +1,104 @@
+#
+#
+#
+
+from collections import defaultdict
+
+from octodns.zone import DuplicateRecordException, Zone
+
+
+class OverlayZone(Zone):
+    '''
+    A Zone made up of a base zone plus a set of changes to it
+
+    `Zone.copy` is copy-on-write, but the first `add_record` or
+    `remove_record` hydrates the copy, re-adding every record in the zone.
+    Writes through the API change a single record so this instead keeps
+    track of just the records that have been added, replaced, or removed and
+    combines them with the untouched base zone when it's read. The base zone
+    is never modified.
+
+    Sub-zone handling (`ignore_subzone_adds`) isn't supported, the zones the
+    API builds don't have sub-zones.
+    '''
+
+    def __init__(self, base):
+        super().__init__(
+            base.name,
+            base.sub_zones,
+            base.update_pcent_threshold,
+            base.delete_pcent_threshold,
+            context=base.context,
+        )
+        self._base = base
+        # (name, _type) -> record
+        self._added = {}
+        self._removed = {}
+
+    @property
+    def _records(self):
+        nodes = defaultdict(set)
+        for record in self.records:
+            nodes[record.name].add(record)
+        return nodes
+
+    @_records.setter
+    def _records(self, value):
+        # Zone.__init__ sets up an empty set of nodes, we build ours on demand
+        pass
+
+    @property
+    def records(self):
+        records = self._base.records
+        if self._removed:
+            records -= set(self._removed.values())
+        if self._added:
+            added = set(self._added.values())
+            # drop the versions being replaced before adding the new ones
+            records -= added
+            records |= added
+        return records
+
+    @property
+    def root_ns(self):
+        key = ('', 'NS')
+        if key in self._added:
+            return self._added[key]
+        elif key in self._removed:
+            return None
+        return self._base.root_ns
+
+    def get(self, name, type=None):
+        records = {
+            r
+            for r in self._base.get(name, type=type)
+            if (r.name, r._type) not in self._removed
+            and (r.name, r._type) not in self._added
+        }
+        for (added_name, added_type), record in self._added.items():
+            if added_name == name and (type is None or added_type == type):
+                records.add(record)
+        return records
+
+    def add_record(self, record, replace=False, lenient=False):
+        key = (record.name, record._type)
+        if not replace:
+            existing = self.get_type(record.name, record._type)
+            if existing:
+                raise DuplicateRecordException(
+                    f'Duplicate record {record.fqdn}, type {record._type}',
+                    existing,
+                    record,
+                )
+        self._removed.pop(key, None)
+        self._added[key] = record
+
+    def remove_record(self, record):
+        key = (record.name, record._type)
+        self._added.pop(key, None)
+        if self._base.get_type(record.name, record._type):
+            self._removed[key] = record
+
+    def hydrate(self):
+        # there's nothing to hydrate, reads always combine base and changes
+        return False
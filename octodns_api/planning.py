@@ -0,0 +1,265 @@
+#
+#
+#
+
+from io import StringIO
+from logging import getLogger
+from pickle import dumps, loads
+from threading import Lock
+
+from octodns.provider.plan import UnsafePlan
+from octodns.record import Record, ValidationError
+from octodns.zone import Zone
+
+from .snapshot import ZoneSnapshot, pack_changes
+from .zonefile import parse as parse_zonefile
+
+# the worker process' own manager, see `_init`
+_manager = None
+
+
+class PlanningException(Exception):
+    pass
+
+
+class PlanningValidationError(ValidationError):
+    '''
+    A ValidationError that can be sent back from a worker process, octoDNS'
+    own can't be rebuilt from its message
+    '''
+
+    def __reduce__(self):
+        return self.__class__, (self.fqdn, self.reasons, self.context)
+
+
+def summarize(target_name, plan, applied):
+    '''
+    :param target_name: Name of the target the plan is for
+    :param plan: Plan or None if there are no changes
+    :param applied: True if the plan was applied
+    :return: Dictionary with the number of each kind of change in a plan
+    '''
+    counts = {'Create': 0, 'Update': 0, 'Delete': 0}
+    if plan:
+        for change in plan.changes:
+            counts[change.__class__.__name__] += 1
+    return {
+        'target': target_name,
+        'creates': counts['Create'],
+        'updates': counts['Update'],
+        'deletes': counts['Delete'],
+        'applied': applied,
+    }
+
+
+def build_zone(zone_name, records):
+    '''
+    :param zone_name: Canonical name of the zone
+    :param records: Dict of decoded record name to a dict of record type to
+                    record data, see `ApiManager.replace_records`
+    :return: Zone with the records
+    :raises ValidationError: if any of the records aren't valid
+    '''
+    zone = Zone(zone_name, [])
+    for name, types in records.items():
+        for _type, data in types.items():
+            data = dict(data, type=_type)
+            zone.add_record(Record.new(zone, name, data))
+    return zone
+
+
+def _portable(e):
+    '''
+    Exceptions raised in a worker are pickled and sent back to the API
+    process, ones that can't be unpickled there, e.g. TooMuchChange, which
+    takes arguments that it doesn't keep, break the pool.
+
+    :return: e if it can be sent back as-is, otherwise an equivalent that can
+    '''
+    try:
+        loads(dumps(e))
+        return e
+    except Exception:
+        if isinstance(e, UnsafePlan):
+            return UnsafePlan(str(e))
+        if isinstance(e, ValidationError):
+            context = str(e.context) if e.context else None
+            return PlanningValidationError(e.fqdn, list(e.reasons), context)
+        return PlanningException(f'{e.__class__.__name__}: {e}')
+
+
+def _init(config_file):
+    # runs once in each worker process
+    global _manager
+    from .manager import _TargetOnlyManager
+
+    _manager = _TargetOnlyManager(config_file)
+
+
+def _desired(zone_name, kind, data):
+    '''
+    Build a desired zone in a worker process
+
+    :param kind: What `data` is, `snapshot`, a packed ZoneSnapshot whose
+                 records were validated when it was made, `records`, records
+                 for `build_zone`, or `zonefile`, a tuple of (text, format)
+    :return: Zone
+    '''
+    if kind == 'records':
+        return build_zone(zone_name, data)
+    if kind == 'zonefile':
+        text, format = data
+        zone = Zone(zone_name, [])
+        parse_zonefile(StringIO(text), zone, format)
+        return zone
+    return ZoneSnapshot.unpack(zone_name, data).to_zone()
+
+
+def _replace_zone(zone_name, target_names, kind, data, force):
+    '''
+    Build, and validate, a desired zone then plan, and apply, it to each of
+    a zone's targets in a worker process, see `ApiManager.replace_zone`
+
+    :param kind: What `data` is, see `_desired`
+    :return: Tuple of (summaries, changes), changes are the first target's,
+             packed with `pack_changes`, or None if nothing was applied to it
+    '''
+    try:
+        desired = _desired(zone_name, kind, data)
+
+        plans = []
+        for target_name in target_names:
+            target = _manager.providers[target_name]
+            plan = target.plan(desired)
+            if plan and not force:
+                plan.raise_if_unsafe()
+            plans.append((target_name, target, plan))
+
+        summaries = []
+        changes = None
+        for i, (target_name, target, plan) in enumerate(plans):
+            if plan:
+                target.apply(plan)
+                if i == 0:
+                    changes = pack_changes(plan.changes)
+            summaries.append(summarize(target_name, plan, bool(plan)))
+
+        return summaries, changes
+    except Exception as e:
+        raise _portable(e) from None
+
+
+def _sync_zone(zone_name, dry_run):
+    '''
+    Sync a zone in a worker process, see `Manager.sync`
+
+    :return: Number of changes
+    '''
+    try:
+        return _manager.sync(
+            eligible_zones=[zone_name], dry_run=dry_run, force=False
+        )
+    except Exception as e:
+        raise _portable(e) from None
+
+
+class PlanningPool:
+    '''
+    Pool of worker processes that plan, and apply, changes to large zones
+
+    Building records, validating them, and diffing zones is pure Python and
+    for large zones holds the GIL for long enough to stall every other
+    request the process is handling. Zones with at least `min_records`
+    records have that work done in one of `processes` worker processes
+    instead, each of which loads the config and has its own providers.
+
+    Desired zones are sent to the workers as they were provided, records or
+    zone file text, so that building and validating them is done there too,
+    or as a packed snapshot, a single bytes object, when they're already
+    built. Only summaries and the changes that were applied come back. Workers
+    are spawned, rather than forked from a process with running threads, the
+    first time they're needed.
+    '''
+
+    log = getLogger('PlanningPool')
+
+    def __init__(self, config_file, processes=0, min_records=10000):
+        '''
+        :param config_file: Path to the octoDNS configuration file the
+                            workers load
+        :param processes: Number of worker processes, 0 disables the pool
+        :param min_records: Zones with fewer records are planned in-process
+        '''
+        self.log.info(
+            '__init__: processes=%d, min_records=%d', processes, min_records
+        )
+        self.config_file = config_file
+        self.processes = processes
+        self.min_records = min_records
+        self._executor = None
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        return self.processes > 0
+
+    def wants(self, records):
+        '''
+        :param records: Number of records in the zone, None if it isn't known
+        :return: True if the zone should be planned in a worker process
+        '''
+        if not self.enabled:
+            return False
+        return records is None or records >= self.min_records
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                # only needed when the pool is used
+                from concurrent.futures import ProcessPoolExecutor
+                from multiprocessing import get_context
+
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=get_context('spawn'),
+                    initializer=_init,
+                    initargs=(self.config_file,),
+                )
+        return self._executor.submit(fn, *args)
+
+    def replace_zone(self, zone_name, target_names, kind, data, force=False):
+        '''
+        :param zone_name: Canonical name of the zone
+        :param target_names: Names of the zone's targets
+        :param kind: What `data` is, see `_desired`
+        :param data: The desired zone
+        :param force: Apply plans that exceed the targets' safety thresholds
+        :return: Tuple of (summaries, changes), see `_replace_zone`
+        :raises ValidationError: if any of the desired records aren't valid
+        :raises ZoneFileException: if the desired zone file can't be parsed
+        :raises UnsafePlan: if a plan isn't safe and force isn't set
+        '''
+        self.log.debug('replace_zone: zone_name=%s, kind=%s', zone_name, kind)
+        return self._submit(
+            _replace_zone, zone_name, target_names, kind, data, force
+        ).result()
+
+    def sync_zone(self, zone_name, dry_run):
+        '''
+        :param zone_name: Canonical name of the zone
+        :param dry_run: If True, only plan changes without applying
+        :return: Number of changes
+        '''
+        self.log.debug(
+            'sync_zone: zone_name=%s, dry_run=%s', zone_name, dry_run
+        )
+        return self._submit(_sync_zone, zone_name, dry_run).result()
+
+    def shutdown(self):
+        '''
+        Stop the worker processes, if they were started
+        '''
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,191 @@
+#
+#
+#
+
+from collections import OrderedDict
+from hashlib import sha256
+from logging import getLogger
+from marshal import dumps, loads
+from threading import Lock
+from time import time
+from uuid import uuid4
+from zlib import compress, decompress
+
+from .snapshot import ZoneSnapshot
+
+
+def fingerprint(plans):
+    '''
+    :param plans: List of (target, Plan) tuples
+    :return: Hex digest of the zones, as each of the targets had them, that
+             the plans were made against
+    '''
+    digest = sha256()
+    for target, plan in plans:
+        existing = ZoneSnapshot.from_zone(plan.existing).fingerprint()
+        digest.update(f'{target.id}\t{existing}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class StoredPlan:
+    '''
+    A dry-run sync of a zone, kept so that it can be applied as reviewed
+
+    What each target was planned to become is kept, rather than the plans
+    themselves, so that it can be packed and shared with other processes.
+    Applying it plans each of the targets again, see `ApiManager.apply_plan`.
+    '''
+
+    __slots__ = ('id', 'zone_name', 'fingerprint', 'desired', 'expires_at')
+
+    # bump when the packed layout changes
+    FORMAT = 1
+
+    def __init__(self, id, zone_name, fingerprint, desired, expires_at):
+        '''
+        :param id: Id of the stored plan
+        :param zone_name: Name of the zone, with trailing dot
+        :param fingerprint: `fingerprint` of the plans, when they were made
+        :param desired: List of (target id, ZoneSnapshot) tuples, what each
+                        target was planned to become
+        :param expires_at: Time after which the plans can't be applied
+        '''
+        self.id = id
+        self.zone_name = zone_name
+        self.fingerprint = fingerprint
+        self.desired = desired
+        self.expires_at = expires_at
+
+    def pack(self):
+        '''
+        :return: bytes
+        '''
+        desired = tuple(
+            (target_id, snapshot.pack()) for target_id, snapshot in self.desired
+        )
+        return compress(
+            dumps(
+                (
+                    self.FORMAT,
+                    self.zone_name,
+                    self.fingerprint,
+                    self.expires_at,
+                    desired,
+                )
+            )
+        )
+
+    @classmethod
+    def unpack(cls, id, data):
+        '''
+        :param id: Id of the stored plan
+        :param data: bytes from `pack`
+        :return: StoredPlan
+        :raises ValueError: if the data is in an unsupported format
+        '''
+        fmt, zone_name, fingerprint, expires_at, desired = loads(
+            decompress(data)
+        )
+        if fmt != cls.FORMAT:
+            raise ValueError(f'unsupported format {fmt}')
+        desired = [
+            (target_id, ZoneSnapshot.unpack(zone_name, packed))
+            for target_id, packed in desired
+        ]
+        return cls(id, zone_name, fingerprint, desired, expires_at)
+
+
+class PlanStore:
+    '''
+    Store of dry-run plans
+
+    Plans are kept for `ttl` seconds, and at most `max_plans` of them, the
+    oldest are dropped first. Each can be taken, to be applied, only once.
+
+    They're kept in memory unless a `store` that's shared with other
+    processes, e.g. the zone cache's, is provided, in which case they're
+    kept there so that a plan made by one process can be applied by
+    another. Stores used this way need `save_plan` and `take_plan`, see
+    `SqliteZoneStore`, and expire plans themselves, `max_plans` only applies
+    in memory.
+    '''
+
+    log = getLogger('PlanStore')
+
+    def __init__(self, ttl=300, max_plans=100, store=None):
+        self.log.info(
+            '__init__: ttl=%d, max_plans=%d, store=%s', ttl, max_plans, store
+        )
+        self.ttl = ttl
+        self.max_plans = max_plans
+        self.store = store
+        self._plans = OrderedDict()
+        self._lock = Lock()
+
+    def add(self, zone_name, fingerprint, plans):
+        '''
+        :param zone_name: Name of the zone, with trailing dot
+        :param fingerprint: `fingerprint` of the plans
+        :param plans: List of (target, Plan) tuples
+        :return: StoredPlan
+        '''
+        desired = [
+            (target.id, ZoneSnapshot.from_zone(plan.desired))
+            for target, plan in plans
+        ]
+        stored = StoredPlan(
+            uuid4().hex, zone_name, fingerprint, desired, time() + self.ttl
+        )
+        if self.store is not None:
+            self.store.save_plan(stored.id, stored.pack(), stored.expires_at)
+        else:
+            with self._lock:
+                self._expire()
+                self._plans[stored.id] = stored
+                while len(self._plans) > self.max_plans:
+                    self._plans.popitem(last=False)
+        self.log.debug(
+            'add: id=%s, zone_name=%s, plans=%d',
+            stored.id,
+            zone_name,
+            len(plans),
+        )
+        return stored
+
+    def take(self, plan_id):
+        '''
+        Remove a plan from the store so that it can be applied
+
+        :param plan_id: Id of the stored plan
+        :return: StoredPlan or None if there's no such plan or it's expired
+        '''
+        if self.store is None:
+            with self._lock:
+                self._expire()
+                return self._plans.pop(plan_id, None)
+
+        data = self.store.take_plan(plan_id)
+        if data is None:
+            return None
+        try:
+            return StoredPlan.unpack(plan_id, data)
+        except Exception as e:
+            self.log.warning('take: discarding invalid plan %s, %s', plan_id, e)
+            return None
+
+    def __len__(self):
+        '''
+        :return: Number of plans kept in memory
+        '''
+        with self._lock:
+            self._expire()
+            return len(self._plans)
+
+    def _expire(self):
+        # plans are added in expiry order so the oldest are first
+        now = time()
+        while self._plans:
+            plan_id, stored = next(iter(self._plans.items()))
+            if stored.expires_at > now:
+                break
+            del self._plans[plan_id]
@@ -0,0 +1,137 @@
+#
+#
+#
+
+import socket
+from logging import getLogger
+from sys import modules
+
+# not every platform lets the keep-alive timing be tuned
+_KEEPALIVE_TIMING = tuple(
+    getattr(socket, name)
+    for name in ('TCP_KEEPIDLE', 'TCP_KEEPINTVL')
+    if hasattr(socket, name)
+)
+
+
+class ConnectionPools:
+    '''
+    Connection pool configuration for providers' HTTP sessions
+
+    Most HTTP based providers make their calls through a `requests.Session`
+    that they hold on to. Its default adapter keeps at most 10 connections
+    per host, under more concurrent requests than that extra connections are
+    opened, and TLS negotiated, for a single call and then thrown away. This
+    mounts adapters sized for the API's concurrency on those sessions.
+
+    The adapters' connection pools are thread-safe and shared by all of the
+    requests a provider makes. The number of connections they've opened and
+    requests they've made are available from `stats`.
+    '''
+
+    log = getLogger('ConnectionPools')
+
+    def __init__(
+        self,
+        pool_connections=10,
+        pool_maxsize=10,
+        pool_block=False,
+        keep_alive=None,
+    ):
+        '''
+        :param pool_connections: Number of hosts to keep pools for
+        :param pool_maxsize: Number of connections to keep per host
+        :param pool_block: Wait for a pooled connection rather than opening an
+                           extra one when they're all in use
+        :param keep_alive: Seconds a connection can be idle before TCP
+                           keep-alive probes are sent, None to leave it to the
+                           OS
+        '''
+        self.log.info(
+            '__init__: pool_connections=%d, pool_maxsize=%d, pool_block=%s, '
+            'keep_alive=%s',
+            pool_connections,
+            pool_maxsize,
+            pool_block,
+            keep_alive,
+        )
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        # provider name -> list of adapters
+        self._adapters = {}
+
+    def _socket_options(self):
+        from urllib3.connection import HTTPConnection
+
+        options = list(HTTPConnection.default_socket_options)
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        # idle time before the first probe and then the interval between them,
+        # setsockopt only takes whole seconds
+        idle = int(self.keep_alive)
+        for opt, value in zip(_KEEPALIVE_TIMING, (idle, max(1, idle // 4))):
+            options.append((socket.IPPROTO_TCP, opt, value))
+        return options
+
+    def configure(self, name, provider):
+        '''
+        Mount pooled adapters on any HTTP sessions a provider holds
+
+        :param name: Name of the provider
+        :param provider: Provider instance
+        :return: Number of sessions configured
+        '''
+        # if requests hasn't been imported no provider can have a session
+        requests = modules.get('requests')
+        if requests is None:
+            return 0
+
+        from requests.adapters import HTTPAdapter
+
+        adapters = []
+        for value in vars(provider).values():
+            if not isinstance(value, requests.Session):
+                continue
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_connections,
+                pool_maxsize=self.pool_maxsize,
+                pool_block=self.pool_block,
+            )
+            if self.keep_alive is not None:
+                adapter.poolmanager.connection_pool_kw['socket_options'] = (
+                    self._socket_options()
+                )
+            value.mount('https://', adapter)
+            value.mount('http://', adapter)
+            adapters.append(adapter)
+
+        if adapters:
+            self.log.info(
+                'configure: provider=%s, sessions=%d', name, len(adapters)
+            )
+            self._adapters[name] = adapters
+        return len(adapters)
+
+    def stats(self):
+        '''
+        :return: Dict of provider name to the number of host pools it
+                 currently has and the number of connections they've opened
+                 and requests they've made
+        '''
+        stats = {}
+        for name, adapters in self._adapters.items():
+            provider = {'pools': 0, 'connections': 0, 'requests': 0}
+            for adapter in adapters:
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    try:
+                        pool = pools[key]
+                    except KeyError:
+                        # evicted since we listed the keys
+                        continue
+                    provider['pools'] += 1
+                    provider['connections'] += pool.num_connections
+                    provider['requests'] += pool.num_requests
+            stats[name] = provider
+        return stats
@@ -0,0 +1,170 @@
+#
+#
+#
+
+from collections import OrderedDict
+from cProfile import Profile
+from io import StringIO
+from logging import getLogger
+from marshal import dumps, loads
+from os.path import join
+from pstats import Stats
+from re import compile as re_compile
+from threading import Lock
+from uuid import uuid4
+
+from flask import g, make_response, request
+
+
+class _LoadedStats:
+    # what pstats.Stats expects of a profile it's handed
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class Profiler:
+    '''
+    Opt-in, per-request, profiling
+
+    Requests that include a `X-Profile` header and are authenticated with
+    one of the allowed keys are run under cProfile. The resulting profile is
+    stored and its id returned in the `X-Profile-Id` response header so that
+    it can be downloaded from `/profiles/<id>`. Profiles are kept in memory,
+    the most recent `max_profiles` of them, unless a `directory` is
+    configured in which case they're written there.
+
+    Views are run through `call` once their requests are authenticated, see
+    `require_api_key`, and only when profiling is configured.
+    '''
+
+    HEADER = 'X-Profile'
+    ID_HEADER = 'X-Profile-Id'
+
+    log = getLogger('Profiler')
+
+    _id_re = re_compile(r'^[0-9a-f]{32}$')
+
+    def __init__(self, keys, directory=None, max_profiles=20):
+        '''
+        :param keys: Names of the API keys allowed to request profiles
+        :param directory: Optional directory to write profiles to
+        :param max_profiles: Number of profiles kept when there's no
+                             directory
+        '''
+        self.log.info(
+            '__init__: keys=%d, directory=%s, max_profiles=%d',
+            len(keys),
+            directory,
+            max_profiles,
+        )
+        self.keys = set(keys)
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()
+        self._lock = Lock()
+        self._active = Lock()
+
+    @classmethod
+    def from_config(cls, api_config):
+        '''
+        Build a Profiler from the `api` section of the config
+
+        :param api_config: The `api` section of the octoDNS config
+        :return: Profiler or None if profiling isn't configured
+        '''
+        profiling_config = dict(api_config.get('profiling', {}))
+        names = set(profiling_config.pop('keys', []))
+        if not names:
+            return None
+        keys = [
+            k['name']
+            for k in api_config.get('keys', [])
+            if k.get('name') in names and k.get('key')
+        ]
+        return cls(keys, **profiling_config)
+
+    def authorized(self):
+        '''
+        :return: True if the key the current request was authenticated with,
+                 `g.api_key`, may use profiling
+        '''
+        key = g.get('api_key')
+        return key is not None and key.name in self.keys
+
+    def call(self, view, *args, **kwargs):
+        '''
+        Call an authenticated request's view, profiling it when it's asked
+        to be
+        '''
+        if not request.headers.get(self.HEADER) or not self.authorized():
+            return view(*args, **kwargs)
+
+        # only one profiler can be active at a time
+        if not self._active.acquire(blocking=False):
+            self.log.warning('call: busy, not profiling request')
+            return view(*args, **kwargs)
+        try:
+            profile = Profile()
+            response = profile.runcall(view, *args, **kwargs)
+        finally:
+            self._active.release()
+
+        response = make_response(response)
+        profile_id = self.save(profile)
+        self.log.info(
+            'call: %s %s, id=%s', request.method, request.path, profile_id
+        )
+        response.headers[self.ID_HEADER] = profile_id
+        return response
+
+    def save(self, profile):
+        '''
+        :param profile: Completed cProfile.Profile
+        :return: Id of the stored profile
+        '''
+        profile_id = uuid4().hex
+        # same format as Profile.dump_stats
+        profile.create_stats()
+        data = dumps(profile.stats)
+        if self.directory:
+            with open(join(self.directory, f'{profile_id}.prof'), 'wb') as fh:
+                fh.write(data)
+            return profile_id
+
+        with self._lock:
+            self._profiles[profile_id] = data
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def load(self, profile_id):
+        '''
+        :param profile_id: Id of a stored profile
+        :return: Profile data, in pstats format, or None if it's not found
+        '''
+        if not self._id_re.match(profile_id):
+            return None
+        if self.directory:
+            try:
+                with open(
+                    join(self.directory, f'{profile_id}.prof'), 'rb'
+                ) as fh:
+                    return fh.read()
+            except FileNotFoundError:
+                return None
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def summary(self, data, limit=50):
+        '''
+        :param data: Profile data, in pstats format
+        :param limit: Number of functions to include
+        :return: Text summary of the profile sorted by cumulative time
+        '''
+        out = StringIO()
+        stats = Stats(_LoadedStats(loads(data)), stream=out)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
@@ -0,0 +1,193 @@
+#
+#
+#
+
+from logging import getLogger
+from math import ceil
+from threading import Lock
+from time import monotonic, time
+
+
+def _take(tokens, elapsed, rate, burst):
+    '''
+    :param tokens: Tokens in the bucket when it was last updated
+    :param elapsed: Seconds since it was last updated
+    :return: Tuple of (tokens, wait), wait is 0 if a token was taken,
+             otherwise the number of seconds until one will be available
+    '''
+    tokens = min(burst, tokens + elapsed * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class TokenBucket:
+    '''
+    In-memory token bucket, `rate` tokens are added a second up to `burst`
+    and each request takes one
+    '''
+
+    __slots__ = ('rate', 'burst', '_tokens', '_updated', '_lock')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def take(self):
+        '''
+        :return: 0 if a token was taken, otherwise the number of seconds until
+                 one will be available
+        '''
+        with self._lock:
+            now = monotonic()
+            self._tokens, wait = _take(
+                self._tokens, now - self._updated, self.rate, self.burst
+            )
+            self._updated = now
+            return wait
+
+
+class SqliteTokenBuckets:
+    '''
+    Token buckets kept in a SQLite database so that they're shared by all of
+    the processes, e.g. gunicorn workers, on a host that use it
+
+    Each take is a single short write transaction.
+    '''
+
+    log = getLogger('SqliteTokenBuckets')
+
+    def __init__(self, path, timeout=1.0):
+        # only needed when there's a shared store
+        from sqlite3 import connect
+
+        self.log.info('__init__: path=%s', path)
+        self.path = path
+        self._lock = Lock()
+        # transactions are managed explicitly
+        self._conn = connect(
+            path, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, '
+            'tokens REAL, updated REAL)'
+        )
+
+    def take(self, name, rate, burst):
+        '''
+        :param name: Name of the bucket
+        :param rate: Tokens added a second
+        :param burst: Size of the bucket
+        :return: 0 if a token was taken, otherwise the number of seconds until
+                 one will be available
+        '''
+        with self._lock:
+            conn = self._conn
+            # take the write lock up front so that the read and update can't
+            # interleave with another process'
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time()
+                row = conn.execute(
+                    'SELECT tokens, updated FROM buckets WHERE name = ?',
+                    (name,),
+                ).fetchone()
+                if row is None:
+                    tokens, wait = _take(burst, 0, rate, burst)
+                else:
+                    tokens, wait = _take(
+                        row[0], max(0, now - row[1]), rate, burst
+                    )
+                conn.execute(
+                    'INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)',
+                    (name, tokens, now),
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return wait
+
+
+class KeyLimits:
+    '''
+    The rate limit and concurrency cap of an API key
+
+    The rate limit is a token bucket, in-memory or in a shared `store`, and
+    the concurrency cap is the number of the key's requests that are
+    in-flight in this process. Requests over either are turned away, there's
+    no queue.
+    '''
+
+    def __init__(
+        self, name, rate=None, burst=None, concurrency=None, store=None
+    ):
+        '''
+        :param name: Name of the key
+        :param rate: Requests a second, None for no rate limit
+        :param burst: Requests that can be made at once, defaults to `rate`
+        :param concurrency: Requests in-flight at once, None for no cap
+        :param store: Optional SqliteTokenBuckets shared with other processes
+        '''
+        self.name = name
+        self.rate = rate
+        self.burst = burst or max(1, ceil(rate or 0))
+        self.concurrency = concurrency
+        self.store = store
+        self._bucket = None
+        if rate and store is None:
+            self._bucket = TokenBucket(rate, self.burst)
+
+        self.in_flight = 0
+        self.rate_limited = 0
+        self.concurrency_limited = 0
+        self._lock = Lock()
+
+    def _take(self):
+        if not self.rate:
+            return 0
+        if self.store is not None:
+            return self.store.take(self.name, self.rate, self.burst)
+        return self._bucket.take()
+
+    def acquire(self):
+        '''
+        :return: None if the request can go ahead, in which case `release`
+                 must be called when it's done, otherwise the number of
+                 seconds to wait before retrying
+        '''
+        with self._lock:
+            if (
+                self.concurrency is not None
+                and self.in_flight >= self.concurrency
+            ):
+                self.concurrency_limited += 1
+                return 1
+            self.in_flight += 1
+
+        wait = self._take()
+        if wait:
+            with self._lock:
+                self.in_flight -= 1
+                self.rate_limited += 1
+            return max(1, ceil(wait))
+        return None
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst if self.rate else None,
+                'concurrency': self.concurrency,
+                'in_flight': self.in_flight,
+                'rate_limited': self.rate_limited,
+                'concurrency_limited': self.concurrency_limited,
+            }
@@ -0,0 +1,201 @@
+#
+#
+#
+
+from collections import defaultdict
+from json import loads
+from logging import getLogger
+from threading import Lock
+
+
+def _normalize(value):
+    # case and the trailing dot don't matter when searching
+    return value.lower().rstrip('.')
+
+
+def _values(data):
+    '''
+    :param data: Record data dictionary
+    :return: Generator of the strings in the record's value(s), including
+             those of dynamic pools and in structured values, e.g. an MX's
+             exchange
+    '''
+    values = list(data.get('values', []))
+    if 'value' in data:
+        values.append(data['value'])
+    for pool in data.get('dynamic', {}).get('pools', {}).values():
+        values.extend(v.get('value') for v in pool.get('values', []))
+
+    for value in values:
+        if isinstance(value, dict):
+            yield from (v for v in value.values() if isinstance(v, str))
+        else:
+            yield value
+
+
+class SearchIndex:
+    '''
+    Inverted index of records across all zones
+
+    Records are indexed by their fqdn, type, and values so that questions
+    like "which zone holds www.example.com" or "what points at 10.1.2.3" can
+    be answered without looking at every zone. Zones are indexed from their
+    snapshots and re-indexing a zone only touches the records that have
+    changed since the snapshot it was last indexed from.
+    '''
+
+    log = getLogger('SearchIndex')
+
+    def __init__(self):
+        # zone name -> ZoneSnapshot it was last indexed from
+        self._zones = {}
+        # term -> set of (zone name, record name, type)
+        self._names = defaultdict(set)
+        self._types = defaultdict(set)
+        self._values = defaultdict(set)
+        self._lock = Lock()
+
+    def __contains__(self, zone_name):
+        return zone_name in self._zones
+
+    def _terms(self, zone_name, snapshot, name, _type, packed):
+        '''
+        :return: Tuple of (key, terms), terms is a list of (index, term)
+        '''
+        fqdn = snapshot.decoded_name
+        if name:
+            fqdn = f'{name}.{fqdn}'
+        terms = [(self._names, _normalize(fqdn)), (self._types, _type)]
+        for value in _values(loads(packed)):
+            terms.append((self._values, _normalize(value)))
+        return (zone_name, name, _type), terms
+
+    def _add(self, key, terms):
+        for index, term in terms:
+            index[term].add(key)
+
+    def _remove(self, key, terms):
+        for index, term in terms:
+            keys = index.get(term)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[term]
+
+    def _changes(self, zone_name, previous, snapshot):
+        '''
+        :param previous: ZoneSnapshot the zone was last indexed from or None
+        :param snapshot: ZoneSnapshot to index
+        :return: Tuple of (removes, adds), lists of (key, terms)
+        '''
+        keys = None
+        if previous is not None:
+            # versions of a zone share records, only the layers between them
+            # need looking at
+            keys = previous._changed_keys(snapshot)
+        if keys is None:
+            before = dict(previous.packed()) if previous else {}
+            after = dict(snapshot.packed())
+        else:
+            before = {key: previous._lookup(key) for key in keys}
+            after = {key: snapshot._lookup(key) for key in keys}
+
+        removes = [
+            self._terms(zone_name, previous, name, _type, packed)
+            for (name, _type), packed in before.items()
+            if packed is not None and after.get((name, _type)) != packed
+        ]
+        adds = [
+            self._terms(zone_name, snapshot, name, _type, packed)
+            for (name, _type), packed in after.items()
+            if packed is not None and before.get((name, _type)) != packed
+        ]
+        return removes, adds
+
+    def update(self, zone_name, snapshot):
+        '''
+        (Re-)index a zone
+
+        What's changed is worked out without the lock held, searches only wait
+        for the index itself to be updated.
+
+        :param zone_name: Name of the zone, with trailing dot
+        :param snapshot: Current ZoneSnapshot of the zone
+        :return: Number of records that were (re-)indexed or removed
+        '''
+        while True:
+            with self._lock:
+                previous = self._zones.get(zone_name)
+            if previous is snapshot:
+                return 0
+            removes, adds = self._changes(zone_name, previous, snapshot)
+            with self._lock:
+                if self._zones.get(zone_name) is not previous:
+                    # re-indexed while we were working, start over from there
+                    continue
+                for key, terms in removes:
+                    self._remove(key, terms)
+                for key, terms in adds:
+                    self._add(key, terms)
+                self._zones[zone_name] = snapshot
+            changed = len(removes) + len(adds)
+            self.log.debug('update: zone=%s, changed=%d', zone_name, changed)
+            return changed
+
+    def remove(self, zone_name):
+        '''
+        Drop a zone from the index
+
+        :param zone_name: Name of the zone, with trailing dot
+        '''
+        with self._lock:
+            snapshot = self._zones.pop(zone_name, None)
+            if snapshot is None:
+                return
+            for (name, _type), packed in snapshot.packed():
+                self._remove(
+                    *self._terms(zone_name, snapshot, name, _type, packed)
+                )
+
+    def search(self, name=None, _type=None, value=None, limit=None):
+        '''
+        Find records matching all of the provided criteria
+
+        :param name: Fqdn of the record, e.g. `www.example.com`
+        :param _type: Record type
+        :param value: One of the record's values, e.g. `10.1.2.3`
+        :param limit: Maximum number of results to return
+        :return: Tuple of (results, truncated), results is a sorted list of
+                 (zone name, record name, type, data) tuples
+        '''
+        criteria = []
+        if name is not None:
+            criteria.append((self._names, _normalize(name)))
+        if _type is not None:
+            criteria.append((self._types, _type))
+        if value is not None:
+            criteria.append((self._values, _normalize(value)))
+
+        with self._lock:
+            matches = None
+            # smallest first so that the intersection is as cheap as possible
+            for keys in sorted(
+                (index.get(term, set()) for index, term in criteria), key=len
+            ):
+                matches = set(keys) if matches is None else matches & keys
+                if not matches:
+                    break
+            matches = sorted(matches or ())
+            truncated = limit is not None and len(matches) > limit
+            if truncated:
+                matches = matches[:limit]
+            results = [
+                (
+                    zone_name,
+                    name,
+                    _type,
+                    self._zones[zone_name].get(name, _type),
+                )
+                for zone_name, name, _type in matches
+            ]
+        return results, truncated
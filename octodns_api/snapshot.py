@@ -0,0 +1,416 @@
+#
+#
+#
+
+from hashlib import sha256
+from json import dumps, loads
+from sys import intern
+
+from octodns.record import Record
+from octodns.zone import Zone
+
+from .idna import idna_decode, idna_encode
+
+
+def _pack(data):
+    return dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def pack_changes(changes):
+    '''
+    Pack a set of plan changes the same way snapshots pack records, e.g. to
+    send them to another process
+
+    :param changes: Iterable of plan changes, e.g. `Plan.changes`
+    :return: Dict of (decoded name, type) to packed record data, None for
+             records that are removed
+    '''
+    packed = {}
+    for change in changes:
+        if change.new is None:
+            record = change.existing
+            packed[(record.decoded_name, record._type)] = None
+        else:
+            record = change.new
+            packed[(intern(record.decoded_name), intern(record._type))] = _pack(
+                record.data
+            )
+    return packed
+
+
+class ZoneSnapshot:
+    '''
+    Compact, read-only, representation of a populated zone
+
+    Rather than holding on to `Record` objects, with their values and
+    `_octodns` dicts, each record is kept as its (interned) decoded name and
+    type along with its data packed into compact JSON bytes. Reads unpack just
+    the records they need and `Record` objects are only rebuilt, with
+    `to_zone`, when a write needs them.
+
+    Snapshots never change, one made by applying changes to another, or
+    versioned on top of a previous version, only holds the records that
+    differ and shares the rest with the snapshot it's based on. Chains of
+    them are flattened once they're `MAX_DEPTH` long so that lookups stay
+    cheap.
+    '''
+
+    MAX_DEPTH = 8
+
+    __slots__ = (
+        'name',
+        'decoded_name',
+        'version',
+        '_records',
+        '_base',
+        '_depth',
+        '_len',
+        '_derived',
+    )
+
+    def __init__(
+        self, name, decoded_name, records, base=None, version=None, length=None
+    ):
+        '''
+        :param name: IDNA encoded name of the zone
+        :param decoded_name: Decoded name of the zone
+        :param records: Dict of (decoded name, type) to packed record data,
+                        when there's a base None marks records that have been
+                        removed from it
+        :param base: Optional snapshot that records are layered on top of
+        :param version: Version of the zone, set when it's cached
+        :param length: Number of records, required when there's a base
+        '''
+        self.name = name
+        self.decoded_name = decoded_name
+        self.version = version
+        self._records = records
+        self._base = base
+        self._depth = 0 if base is None else base._depth + 1
+        self._len = len(records) if base is None else length
+        self._derived = {}
+
+    @classmethod
+    def from_zone(cls, zone):
+        '''
+        Build a snapshot from a populated Zone
+
+        :param zone: Zone object populated with records
+        :return: ZoneSnapshot
+        '''
+        records = {
+            (intern(r.decoded_name), intern(r._type)): _pack(r.data)
+            for r in zone.records
+        }
+        return cls(zone.name, zone.decoded_name, records)
+
+    def _layer(self, changes, version=None):
+        '''
+        :param changes: Dict of key to packed data, or None for removals, to
+                        layer on top of this snapshot
+        :return: ZoneSnapshot
+        '''
+        length = self._len
+        for key, packed in changes.items():
+            exists = self._lookup(key) is not None
+            if packed is None:
+                length -= exists
+            else:
+                length += not exists
+
+        if self._depth + 1 < self.MAX_DEPTH:
+            return ZoneSnapshot(
+                self.name,
+                self.decoded_name,
+                changes,
+                base=self,
+                version=version,
+                length=length,
+            )
+
+        # flatten
+        records = dict(self.packed())
+        for key, packed in changes.items():
+            if packed is None:
+                records.pop(key, None)
+            else:
+                records[key] = packed
+        return ZoneSnapshot(
+            self.name, self.decoded_name, records, version=version
+        )
+
+    def apply(self, changes):
+        '''
+        Build a snapshot of the zone as it is after a set of changes
+
+        Records that aren't changed are shared with this snapshot, which is
+        left as-is.
+
+        :param changes: Iterable of plan changes, e.g. `Plan.changes`
+        :return: ZoneSnapshot
+        '''
+        return self._layer(pack_changes(changes))
+
+    def apply_packed(self, changes):
+        '''
+        Build a snapshot of the zone as it is after a set of changes that were
+        packed with `pack_changes`
+
+        :param changes: Dict from `pack_changes`
+        :return: ZoneSnapshot
+        '''
+        return self._layer(changes)
+
+    def versioned(self, version, previous=None):
+        '''
+        A copy of the snapshot with a version
+
+        When the snapshot has records of its own, e.g. it was freshly
+        populated, and a previous version is provided that it mostly matches
+        the copy is layered on top of that version so that the records they
+        have in common are only kept once.
+
+        :param version: Version of the zone
+        :param previous: Optional previous version of the zone
+        :return: ZoneSnapshot
+        '''
+        if self._base is None and previous is not None:
+            changes = {}
+            records = self._records
+            for key, packed in previous.packed():
+                current = records.get(key)
+                if current != packed:
+                    changes[key] = current
+            for key, packed in records.items():
+                if key not in changes and previous._lookup(key) is None:
+                    changes[key] = packed
+            if len(changes) <= len(records) // 4:
+                return previous._layer(changes, version)
+
+        return ZoneSnapshot(
+            self.name,
+            self.decoded_name,
+            self._records,
+            base=self._base,
+            version=version,
+            length=self._len,
+        )
+
+    def _changed_keys(self, other):
+        '''
+        :return: Set of the keys that may differ between this snapshot and
+                 other, found from the layers between them and the snapshot
+                 they're both based on, or None if they don't share one
+        '''
+        ancestors = {}
+        snapshot = self
+        while snapshot is not None:
+            ancestors[id(snapshot)] = snapshot
+            snapshot = snapshot._base
+
+        keys = set()
+        snapshot = other
+        while id(snapshot) not in ancestors:
+            if snapshot is None:
+                return None
+            keys.update(snapshot._records)
+            snapshot = snapshot._base
+
+        common = snapshot
+        snapshot = self
+        while snapshot is not common:
+            keys.update(snapshot._records)
+            snapshot = snapshot._base
+        return keys
+
+    def diff(self, other):
+        '''
+        Find the records that differ between this snapshot and another
+
+        When the snapshots share records, e.g. they're versions of a zone
+        with a few writes between them, only the records in the layers that
+        separate them are compared so the cost is proportional to the
+        changes rather than the size of the zone.
+
+        :param other: ZoneSnapshot to compare against, the newer one
+        :return: List of (decoded name, type, existing data, new data)
+                 tuples sorted by name and type, existing data is None for
+                 records only in other and new data for those only in this
+                 snapshot
+        '''
+        keys = self._changed_keys(other)
+        changed = []
+        if keys is None:
+            existing = dict(self.packed())
+            for key, packed in other.packed():
+                if existing.get(key) != packed:
+                    changed.append((key, existing.get(key), packed))
+                existing.pop(key, None)
+            changed.extend(
+                (key, packed, None) for key, packed in existing.items()
+            )
+        else:
+            for key in keys:
+                before = self._lookup(key)
+                after = other._lookup(key)
+                if before != after:
+                    changed.append((key, before, after))
+
+        changed.sort(key=lambda c: c[0])
+        return [
+            (
+                name,
+                _type,
+                None if before is None else loads(before),
+                None if after is None else loads(after),
+            )
+            for (name, _type), before, after in changed
+        ]
+
+    def derived(self, key, build):
+        '''
+        Get a value computed from the snapshot, e.g. a serialized response,
+        building it on first use
+
+        Snapshots never change so derived values are kept for as long as the
+        snapshot is.
+
+        :param key: Hashable key for the value
+        :param build: Callable that computes the value
+        :return: The value
+        '''
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = self._derived[key] = build()
+            return value
+
+    def fingerprint(self):
+        '''
+        :return: Hex digest of the snapshot's records, snapshots with the same
+                 records have the same fingerprint
+        '''
+
+        def build():
+            digest = sha256()
+            for key, packed in sorted(self.packed()):
+                digest.update(_pack(key) + b'\t' + packed + b'\n')
+            return digest.hexdigest()
+
+        return self.derived('fingerprint', build)
+
+    def __len__(self):
+        return self._len
+
+    def _lookup(self, key):
+        snapshot = self
+        while snapshot is not None:
+            try:
+                return snapshot._records[key]
+            except KeyError:
+                snapshot = snapshot._base
+        return None
+
+    def get(self, name, _type):
+        '''
+        Get the data for a single record
+
+        :param name: Decoded name of the record, '' for the apex
+        :param _type: Record type
+        :return: Record data dictionary or None if there's no such record
+        '''
+        packed = self._lookup((name, _type))
+        if packed is None:
+            return None
+        return loads(packed)
+
+    def packed(self):
+        '''
+        Iterate over all of the records in the snapshot without unpacking
+        them, e.g. to compare snapshots
+
+        :return: Iterator of ((decoded name, type), packed data) tuples
+        '''
+        if self._base is None:
+            return iter(self._records.items())
+        return self._layered()
+
+    def _layered(self):
+        records = self._records
+        for key, packed in self._base.packed():
+            if key not in records:
+                yield key, packed
+        for key, packed in records.items():
+            if packed is not None:
+                yield key, packed
+
+    def records(self):
+        '''
+        Iterate over all of the records in the snapshot
+
+        :return: Generator of (decoded name, type, data) tuples
+        '''
+        for (name, _type), packed in self.packed():
+            yield name, _type, loads(packed)
+
+    def record(self, name, _type):
+        '''
+        Build a `Record` object for a single record
+
+        :param name: Decoded name of the record, '' for the apex
+        :param _type: Record type
+        :return: Record object or None if there's no such record
+        '''
+        data = self.get(name, _type)
+        if data is None:
+            return None
+        data['type'] = _type
+        return Record.new(Zone(self.name, []), name, data, lenient=True)
+
+    def to_zone(self, zone=None):
+        '''
+        Rebuild a Zone, with `Record` objects, from the snapshot
+
+        :param zone: Empty Zone to add the records to, e.g. one with the
+                     zone's configured sub-zones and thresholds, a new one if
+                     not provided
+        :return: Zone object populated with records
+        '''
+        if zone is None:
+            zone = Zone(self.name, [])
+        for name, _type, data in self.records():
+            data['type'] = _type
+            record = Record.new(zone, name, data, lenient=True)
+            zone.add_record(record, lenient=True)
+        return zone
+
+    def pack(self):
+        '''
+        Serialize the snapshot to bytes
+
+        One line per record, its JSON encoded name and type, a tab, then its
+        already packed data. Compact JSON never contains a raw tab or newline
+        so `unpack` can split things apart without parsing the record data.
+
+        :return: bytes
+        '''
+        return b'\n'.join(
+            _pack(key) + b'\t' + packed for key, packed in self.packed()
+        )
+
+    @classmethod
+    def unpack(cls, zone_name, packed):
+        '''
+        Deserialize a snapshot serialized with `pack`
+
+        :param zone_name: Name of the zone, with trailing dot
+        :param packed: bytes from `pack`
+        :return: ZoneSnapshot
+        '''
+        records = {}
+        if packed:
+            for line in packed.split(b'\n'):
+                key, data = line.split(b'\t', 1)
+                name, _type = loads(key)
+                records[(intern(name), intern(_type))] = data
+        return cls(idna_encode(zone_name), idna_decode(zone_name), records)
@@ -0,0 +1,145 @@
+#
+#
+#
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import getLogger
+from time import perf_counter
+
+from flask import g, request
+
+_current = ContextVar('octodns_api_timer', default=None)
+
+log = getLogger('api.Access')
+
+
+class Span:
+    '''
+    Handed out by `timed`, `desc` can be set to annotate the timing, e.g.
+    with whether or not a cache was hit
+    '''
+
+    __slots__ = ('desc',)
+
+    def __init__(self, desc=None):
+        self.desc = desc
+
+
+class RequestTimer:
+    '''
+    Collects named timings for a single request
+
+    Timings with the same name, e.g. plans for multiple targets, are summed.
+    '''
+
+    def __init__(self):
+        self.start = perf_counter()
+        # name -> [duration in seconds, desc]
+        self.timings = {}
+
+    def add(self, name, duration, desc=None):
+        try:
+            entry = self.timings[name]
+            entry[0] += duration
+            if desc is not None:
+                entry[1] = desc
+        except KeyError:
+            self.timings[name] = [duration, desc]
+
+    @property
+    def total(self):
+        return perf_counter() - self.start
+
+    def server_timing(self, total):
+        '''
+        :param total: Total duration of the request in seconds
+        :return: Value for a `Server-Timing` header
+        '''
+        metrics = []
+        for name, (duration, desc) in self.timings.items():
+            metric = name
+            if desc is not None:
+                metric += f';desc="{desc}"'
+            metrics.append(f'{metric};dur={duration * 1000:.2f}')
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(metrics)
+
+    def log_fields(self, total):
+        '''
+        :param total: Total duration of the request in seconds
+        :return: List of `key=value` strings for the access log
+        '''
+        fields = [f'total_ms={total * 1000:.2f}']
+        for name, (duration, desc) in self.timings.items():
+            fields.append(f'{name}_ms={duration * 1000:.2f}')
+            if desc is not None:
+                fields.append(f'{name}={desc}')
+        return fields
+
+
+def current_timer():
+    '''
+    :return: The RequestTimer for the current request or None when there
+             isn't one, e.g. outside of a request
+    '''
+    return _current.get()
+
+
+@contextmanager
+def timed(name, desc=None):
+    '''
+    Time a block of code, recording it with the current request's timer if
+    there is one
+
+    :param name: Name of the timing, e.g. `plan`
+    :param desc: Optional description, can also be set on the yielded Span
+    '''
+    span = Span(desc)
+    timer = _current.get()
+    if timer is None:
+        yield span
+        return
+    start = perf_counter()
+    try:
+        yield span
+    finally:
+        timer.add(name, perf_counter() - start, span.desc)
+
+
+def before_request():
+    '''
+    Flask `before_request` hook that starts timing the request
+    '''
+    g.timer_token = _current.set(RequestTimer())
+
+
+def after_request(response):
+    '''
+    Flask `after_request` hook that adds a `Server-Timing` header to the
+    response and writes the access log line
+    '''
+    timer = _current.get()
+    if timer is None:
+        return response
+    total = timer.total
+    response.headers['Server-Timing'] = timer.server_timing(total)
+    key = g.get('api_key')
+    log.info(
+        'method=%s path=%s status=%d key=%s %s',
+        request.method,
+        request.path,
+        response.status_code,
+        '-' if key is None else key.name,
+        ' '.join(timer.log_fields(total)),
+    )
+    return response
+
+
+def teardown_request(exc=None):
+    '''
+    Flask `teardown_request` hook that clears the request's timer
+    '''
+    token = g.pop('timer_token', None)
+    if token is not None:
+        _current.reset(token)
@@ -0,0 +1,224 @@
+#
+#
+#
+
+from io import StringIO
+
+from natsort import natsort_keygen
+from yaml import MappingEndEvent, MappingStartEvent, StreamEndEvent, YAMLError
+
+from octodns.record import Record, Rr
+from octodns.yaml import ContextLoader, safe_dump
+from octodns.zone import DuplicateRecordException, InvalidNameError
+
+FORMATS = ('yaml', 'bind')
+
+MIMETYPES = {'yaml': 'application/yaml', 'bind': 'text/dns'}
+
+# records w/o a ttl get the same default YamlProvider gives them
+DEFAULT_TTL = 3600
+
+# octoDNS types that don't exist outside of it and so have no place in a zone
+# file
+_NON_RFC_TYPES = ('ALIAS', 'URLFWD')
+
+_natsort_key = natsort_keygen()
+
+
+class ZoneFileException(Exception):
+    pass
+
+
+def _add_record(zone, record):
+    try:
+        zone.add_record(record)
+    except (DuplicateRecordException, InvalidNameError) as e:
+        raise ZoneFileException(str(e)) from e
+
+
+def _by_name(snapshot):
+    '''
+    :return: Iterator of (decoded name, [(type, data), ...]) in octoDNS's
+             natural name order with each name's records sorted by type
+    '''
+    names = {}
+    for name, _type in (key for key, _ in snapshot.packed()):
+        names.setdefault(name, []).append(_type)
+    for name in sorted(names, key=_natsort_key):
+        yield name, [
+            (_type, snapshot.get(name, _type)) for _type in sorted(names[name])
+        ]
+
+
+def export_yaml(snapshot):
+    '''
+    Serialize a zone snapshot in the octoDNS YAML format, i.e. what
+    YamlProvider reads and writes
+
+    Each name is dumped on its own so that the zone can be streamed out a
+    chunk at a time rather than building the whole document in memory.
+
+    :param snapshot: ZoneSnapshot
+    :return: Generator of str chunks
+    '''
+    yield '---\n'
+    for name, records in _by_name(snapshot):
+        node = []
+        for _type, data in records:
+            data['type'] = _type
+            node.append(data)
+        if len(node) == 1:
+            node = node[0]
+        buf = StringIO()
+        safe_dump({name: node}, buf, explicit_start=False)
+        yield buf.getvalue()
+
+
+def export_bind(snapshot):
+    '''
+    Serialize a zone snapshot as a BIND style zone file
+
+    Only the standard record data is included, octoDNS specific things like
+    dynamic rules or geo are dropped, and octoDNS specific types, e.g.
+    ALIAS, are left as comments.
+
+    :param snapshot: ZoneSnapshot
+    :return: Generator of str lines
+    '''
+    yield f'$ORIGIN {snapshot.name}\n'
+    for (name, _type), _ in sorted(snapshot.packed()):
+        record = snapshot.record(name, _type)
+        fqdn, ttl, _type, rdatas = record.rrs
+        if _type in _NON_RFC_TYPES:
+            yield f'; {fqdn} {ttl} {_type} skipped, not a standard type\n'
+            continue
+        for rdata in rdatas:
+            yield f'{fqdn} {ttl} IN {_type} {rdata}\n'
+
+
+def parse_yaml(fh, zone):
+    '''
+    Parse octoDNS YAML into a zone
+
+    The input is parsed as a stream and each top-level name's records are
+    added as soon as the name's been read so that large uploads are never
+    held in memory, or loaded by YAML, all at once. Anchors can be aliased
+    from later names. Names don't have to be in sorted order.
+
+    :param fh: File-like object of text
+    :param zone: Zone to add the records to
+    '''
+    loader = ContextLoader(fh)
+    try:
+        for name, node in _yaml_names(loader):
+            _add_yaml_records(zone, name, node)
+    except YAMLError as e:
+        raise ZoneFileException(f'Invalid YAML: {e}') from e
+    finally:
+        loader.dispose()
+
+
+def _yaml_names(loader):
+    '''
+    Compose and construct each document's top-level names one at a time,
+    rather than each document as a whole
+
+    :return: Generator of (name, data)
+    '''
+    # stream start
+    loader.get_event()
+    while not loader.check_event(StreamEndEvent):
+        # document start
+        loader.get_event()
+        if loader.check_event(MappingStartEvent):
+            loader.get_event()
+            while not loader.check_event(MappingEndEvent):
+                key = loader.compose_node(None, None)
+                value = loader.compose_node(None, None)
+                yield (
+                    loader.construct_object(key, deep=True),
+                    loader.construct_object(value, deep=True),
+                )
+                # anchored nodes are kept, for aliases, but what's been
+                # constructed isn't
+                loader.constructed_objects = {}
+                loader.recursive_objects = {}
+            loader.get_event()
+        elif loader.construct_object(
+            loader.compose_node(None, None), deep=True
+        ):
+            raise ZoneFileException('Invalid YAML: expected a mapping of names')
+        # document end
+        loader.get_event()
+        loader.anchors = {}
+
+
+def _add_yaml_records(zone, name, node):
+    if not isinstance(node, list):
+        node = [node]
+    for d in node:
+        if not isinstance(d, dict):
+            raise ZoneFileException(f'Invalid record data for "{name}"')
+        d.setdefault('ttl', DEFAULT_TTL)
+        _add_record(zone, Record.new(zone, str(name or ''), d))
+
+
+def parse_bind(fh, zone):
+    '''
+    Parse a BIND style zone file into a zone
+
+    SOA records are ignored, they're managed by the providers.
+
+    Unlike YAML, zone files are parsed as a whole before any records are
+    added, a name's records can be spread throughout the file and octoDNS
+    needs all of them at once, so they're held in memory, twice over while
+    the records are built.
+
+    :param fh: File-like object of text
+    :param zone: Zone to add the records to
+    '''
+    # only needed for imports
+    from dns.exception import DNSException
+    from dns.rdatatype import to_text
+    from dns.zone import from_file
+
+    try:
+        parsed = from_file(fh, zone.name, relativize=False, check_origin=False)
+    except DNSException as e:
+        raise ZoneFileException(f'Invalid zone file: {e}') from e
+
+    rrs = []
+    for name, rdataset in parsed.iterate_rdatasets():
+        _type = to_text(rdataset.rdtype)
+        if _type == 'SOA':
+            continue
+        if _type not in Record.registered_types():
+            raise ZoneFileException(f'Unsupported record type {_type}')
+        for rdata in rdataset:
+            rrs.append(Rr(name.to_text(), _type, rdataset.ttl, rdata.to_text()))
+
+    for record in Record.from_rrs(zone, rrs):
+        _add_record(zone, record)
+
+
+def parse(fh, zone, format):
+    '''
+    :param fh: File-like object of text
+    :param zone: Zone to add the records to
+    :param format: One of FORMATS
+    '''
+    if format == 'bind':
+        parse_bind(fh, zone)
+    else:
+        parse_yaml(fh, zone)
+
+
+def export(snapshot, format):
+    '''
+    :param snapshot: ZoneSnapshot
+    :param format: One of FORMATS
+    :return: Generator of str chunks
+    '''
+    if format == 'bind':
+        return export_bind(snapshot)
+    return export_yaml(snapshot)
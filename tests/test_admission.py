@@ -0,0 +1,273 @@
+#
+#
+#
+
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Event, Thread
+from unittest import TestCase
+from unittest.mock import patch
+
+from octodns_api.admission import AdmissionControl, Limiter
+from octodns_api.app import create_app
+
+
+class TestLimiter(TestCase):
+    def test_limits(self):
+        limiter = Limiter('reads', 2, max_queue=1, queue_timeout=0.01)
+        self.assertIsNone(limiter.acquire())
+        self.assertIsNone(limiter.acquire())
+        # waits in the queue and times out
+        self.assertEqual(503, limiter.acquire())
+        self.assertEqual(
+            {
+                'max_in_flight': 2,
+                'in_flight': 2,
+                'queued': 0,
+                'admitted': 2,
+                'rejected': 0,
+                'timed_out': 1,
+            },
+            limiter.stats(),
+        )
+
+        limiter.release()
+        self.assertIsNone(limiter.acquire())
+        self.assertEqual(3, limiter.stats()['admitted'])
+
+    def test_queue_full(self):
+        limiter = Limiter('sync', 1)
+        self.assertIsNone(limiter.acquire())
+        # no queue, turned away right away
+        self.assertEqual(429, limiter.acquire())
+        self.assertEqual(1, limiter.stats()['rejected'])
+
+    def test_queued_admitted(self):
+        limiter = Limiter('writes', 1, max_queue=1, queue_timeout=10)
+        self.assertIsNone(limiter.acquire())
+
+        waiting = Event()
+        results = []
+
+        def queued():
+            waiting.set()
+            results.append(limiter.acquire())
+
+        thread = Thread(target=queued)
+        thread.start()
+        waiting.wait()
+        # the queue is full now, or will be shortly, either way there's no
+        # room for another
+        while limiter.stats()['queued'] == 0:
+            thread.join(0.001)
+        self.assertEqual(429, limiter.acquire())
+
+        limiter.release()
+        thread.join()
+        self.assertEqual([None], results)
+        stats = limiter.stats()
+        self.assertEqual(1, stats['in_flight'])
+        self.assertEqual(2, stats['admitted'])
+
+
+class TestAdmissionControl(TestCase):
+    def test_from_config(self):
+        self.assertIsNone(AdmissionControl.from_config({}))
+        with self.assertRaises(ValueError) as ctx:
+            AdmissionControl.from_config(
+                {'admission': {'other': {'max_in_flight': 1}}}
+            )
+        self.assertEqual('Unknown admission class other', str(ctx.exception))
+
+        admission = AdmissionControl.from_config(
+            {
+                'admission': {
+                    'reads': {'max_in_flight': 10},
+                    'sync': {'max_in_flight': 1, 'retry_after': 30},
+                }
+            }
+        )
+        self.assertEqual({'reads', 'sync'}, set(admission.limiters.keys()))
+        self.assertEqual(30, admission.limiters['sync'].retry_after)
+
+
+class TestAdmissionApi(TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        config_dir = join(self.tmpdir, 'config')
+        makedirs(config_dir)
+        with open(join(config_dir, 'example.com.yaml'), 'w') as f:
+            f.write(
+                '''
+---
+www:
+  ttl: 300
+  type: A
+  value: 1.2.3.4
+'''
+            )
+        config_file = join(self.tmpdir, 'config.yaml')
+        with open(config_file, 'w') as f:
+            f.write(
+                f'''
+api:
+  keys:
+    - name: admin
+      key: admin-key
+    - name: limited
+      key: limited-key
+      rate: 0.001
+  admission:
+    reads:
+      max_in_flight: 1
+      max_queue: 1
+      queue_timeout: 0.01
+    writes:
+      max_in_flight: 1
+    sync:
+      max_in_flight: 1
+      retry_after: 30
+
+providers:
+  config:
+    class: octodns.provider.yaml.YamlProvider
+    directory: {config_dir}
+
+zones:
+  example.com.:
+    sources:
+      - config
+    targets:
+      - config
+'''
+            )
+        self.app = create_app(config_file)
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        self.headers = {'Authorization': 'Bearer admin-key'}
+        self.limiters = self.app.admission.limiters
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_classes(self):
+        response = self.client.get(
+            '/zones/example.com./records/www/A', headers=self.headers
+        )
+        self.assertEqual(200, response.status_code)
+        response = self.client.post(
+            '/zones/example.com./records:lookup',
+            headers=self.headers,
+            json={'records': [{'name': 'www', 'type': 'A'}]},
+        )
+        self.assertEqual(200, response.status_code)
+        response = self.client.post(
+            '/zones/example.com./records/www/A',
+            headers=self.headers,
+            json={'ttl': 300, 'value': '1.2.3.4'},
+        )
+        self.assertEqual(200, response.status_code)
+        # replacing the whole zone, with what it already has, is a sync
+        records = self.client.get(
+            '/zones/example.com./records', headers=self.headers
+        ).get_json()['records']
+        response = self.client.put(
+            '/zones/example.com./records',
+            headers=self.headers,
+            json={'records': records},
+        )
+        self.assertEqual(200, response.status_code)
+        # searching and exporting look at whole zones, searching needs the
+        # zone cache, but it's still admitted as a sync
+        response = self.client.get(
+            '/search', headers=self.headers, query_string={'value': '1.2.3.4'}
+        )
+        self.assertEqual(503, response.status_code)
+        response = self.client.get(
+            '/zones/example.com./export', headers=self.headers
+        )
+        self.assertEqual(200, response.status_code)
+        # not found isn't limited
+        response = self.client.get('/nope', headers=self.headers)
+        self.assertEqual(404, response.status_code)
+
+        self.assertEqual(3, self.limiters['reads'].admitted)
+        self.assertEqual(1, self.limiters['writes'].admitted)
+        self.assertEqual(3, self.limiters['sync'].admitted)
+        # everything's been released
+        for limiter in self.limiters.values():
+            self.assertEqual(0, limiter.in_flight)
+
+    def test_sync_saturated(self):
+        # a sync in progress
+        self.assertIsNone(self.limiters['sync'].acquire())
+
+        response = self.client.post(
+            '/zones/example.com./sync', headers=self.headers
+        )
+        self.assertEqual(429, response.status_code)
+        self.assertEqual('30', response.headers['Retry-After'])
+        self.assertEqual(
+            {'error': 'Too many sync requests, retry later'},
+            response.get_json(),
+        )
+        self.assertIn(
+            'admission;desc="sync"', response.headers['Server-Timing']
+        )
+
+        # reads are unaffected
+        response = self.client.get(
+            '/zones/example.com./records/www/A', headers=self.headers
+        )
+        self.assertEqual(200, response.status_code)
+
+    def test_admitted_after_auth(self):
+        limiter = self.limiters['sync']
+        with patch.object(
+            limiter, 'acquire', wraps=limiter.acquire
+        ) as mock_acquire:
+            # unauthenticated requests never get as far as admission
+            response = self.client.get('/zones/example.com./export')
+            self.assertEqual(401, response.status_code)
+            response = self.client.get(
+                '/zones/example.com./export',
+                headers={'Authorization': 'Bearer nope'},
+            )
+            self.assertEqual(401, response.status_code)
+
+            # nor do those over their key's rate limit
+            headers = {'Authorization': 'Bearer limited-key'}
+            response = self.client.get(
+                '/zones/example.com./export', headers=headers
+            )
+            self.assertEqual(200, response.status_code)
+            mock_acquire.assert_called_once()
+            response = self.client.get(
+                '/zones/example.com./export', headers=headers
+            )
+            self.assertEqual(429, response.status_code)
+            self.assertIn('limited', response.get_json()['error'])
+            mock_acquire.assert_called_once()
+
+        self.assertEqual(1, limiter.admitted)
+        self.assertEqual(0, limiter.in_flight)
+
+    def test_reads_saturated(self):
+        self.assertIsNone(self.limiters['reads'].acquire())
+
+        # waits in the queue and then gives up
+        response = self.client.get(
+            '/zones/example.com./records/www/A', headers=self.headers
+        )
+        self.assertEqual(503, response.status_code)
+        self.assertEqual('1', response.headers['Retry-After'])
+
+        # metrics are still available
+        response = self.client.get('/metrics', headers=self.headers)
+        self.assertEqual(200, response.status_code)
+        admission = response.get_json()['admission']
+        self.assertEqual(1, admission['reads']['in_flight'])
+        self.assertEqual(1, admission['reads']['timed_out'])
+        self.assertEqual(0, admission['sync']['in_flight'])
@@ -2,6 +2,8 @@
 #
 #
 
+from gzip import decompress
+from json import loads
 from os import makedirs
 from os.path import join
 from shutil import rmtree
@@ -9,12 +11,21 @@ from tempfile import mkdtemp
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 
+from octodns.provider.plan import UnsafePlan
+
 from octodns_api.app import create_app
-from octodns_api.manager import ApiManagerException
+from octodns_api.manager import ApiManagerException, StalePlanException
+from octodns_api.planning import PlanningValidationError
 
 
 class TestApi(TestCase):
     def setUp(self):
+        # versions are offset by a random epoch, zero it so that they're
+        # predictable
+        patcher = patch('octodns_api.cache.getrandbits', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
         self.tmpdir = mkdtemp()
         self.config_dir = join(self.tmpdir, 'config')
         makedirs(self.config_dir)
@@ -99,6 +110,27 @@ zones:
         self.assertEqual(data['zone'], 'example.com.')
         self.assertEqual(len(data['records']), 2)
 
+    def test_list_records_compressed(self):
+        self.app.compression.min_size = 10
+        headers = dict(self.headers)
+        headers['Accept-Encoding'] = 'gzip'
+        response = self.client.get(
+            '/zones/example.com./records', headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+        data = loads(decompress(response.get_data()))
+        self.assertEqual(data['zone'], 'example.com.')
+        self.assertEqual(len(data['records']), 2)
+
+        # identical to the uncompressed body
+        response = self.client.get(
+            '/zones/example.com./records', headers=self.headers
+        )
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(data, response.get_json())
+
     def test_get_record(self):
         response = self.client.get(
             '/zones/example.com./records/www/A', headers=self.headers
@@ -239,6 +271,468 @@ zones:
         )
         self.assertEqual(response.status_code, 404)
 
+    @patch('octodns_api.manager.ApiManager._schedule_refresh')
+    def test_versions(self, _):
+        # writes are written through, as unverified versions, and not
+        # refreshed so the versions are predictable
+        self.app.manager.cache.ttl = 60
+        response = self.client.get('/zones/example.com.', headers=self.headers)
+        self.assertEqual(
+            {'name': 'example.com.', 'version': 1}, response.get_json()
+        )
+
+        response = self.client.post(
+            '/zones/example.com./records/www/A',
+            headers=self.headers,
+            json={'ttl': 300, 'value': '9.9.9.9'},
+        )
+        self.assertEqual(201, response.status_code)
+
+        response = self.client.get(
+            '/zones/example.com./records', headers=self.headers
+        )
+        data = response.get_json()
+        self.assertEqual(2, data['version'])
+        self.assertEqual('9.9.9.9', data['records']['www']['A']['value'])
+
+        # point-in-time reads of the earlier version
+        response = self.client.get(
+            '/zones/example.com./records?version=1', headers=self.headers
+        )
+        data = response.get_json()
+        self.assertEqual(1, data['version'])
+        self.assertEqual('5.6.7.8', data['records']['www']['A']['value'])
+        response = self.client.get(
+            '/zones/example.com./records/www/A?version=1', headers=self.headers
+        )
+        self.assertEqual('5.6.7.8', response.get_json()['value'])
+        response = self.client.post(
+            '/zones/example.com./records:lookup?version=1',
+            headers=self.headers,
+            json={'records': [{'name': 'www', 'type': 'A'}]},
+        )
+        data = response.get_json()
+        self.assertEqual(1, data['version'])
+        self.assertEqual('5.6.7.8', data['records'][0]['value'])
+        response = self.client.get(
+            '/zones/example.com./export?format=bind&version=1',
+            headers=self.headers,
+        )
+        self.assertEqual('1', response.headers['X-Zone-Version'])
+        self.assertIn('5.6.7.8', response.get_data(as_text=True))
+        response = self.client.get(
+            '/zones/example.com./export', headers=self.headers
+        )
+        self.assertEqual('2', response.headers['X-Zone-Version'])
+
+        # versions that aren't retained
+        response = self.client.get(
+            '/zones/example.com.?version=42', headers=self.headers
+        )
+        self.assertEqual(404, response.status_code)
+        self.assertIn('Version 42', response.get_json()['error'])
+
+        # and ones that aren't versions at all
+        for url in (
+            '/zones/example.com.',
+            '/zones/example.com./records',
+            '/zones/example.com./records/www/A',
+            '/zones/example.com./export',
+        ):
+            for version in ('nope', '0'):
+                response = self.client.get(
+                    f'{url}?version={version}', headers=self.headers
+                )
+                self.assertEqual(400, response.status_code)
+                self.assertEqual(
+                    {'error': 'Invalid version'}, response.get_json()
+                )
+        response = self.client.post(
+            '/zones/example.com./records:lookup?version=nope',
+            headers=self.headers,
+            json={'records': [{'name': 'www', 'type': 'A'}]},
+        )
+        self.assertEqual(400, response.status_code)
+
+    @patch('octodns_api.manager.ApiManager._schedule_refresh')
+    def test_diff_zone(self, _):
+        self.app.manager.cache.ttl = 60
+        self.client.get('/zones/example.com.', headers=self.headers)
+        self.client.post(
+            '/zones/example.com./records/www/A',
+            headers=self.headers,
+            json={'ttl': 300, 'value': '9.9.9.9'},
+        )
+        self.client.post(
+            '/zones/example.com./records/new/A',
+            headers=self.headers,
+            json={'ttl': 60, 'value': '3.3.3.3'},
+        )
+        self.client.delete(
+            '/zones/example.com./records//A', headers=self.headers
+        )
+
+        response = self.client.get(
+            '/zones/example.com./diff?from=1', headers=self.headers
+        )
+        self.assertEqual(200, response.status_code, response.get_json())
+        self.assertEqual(
+            {
+                'zone': 'example.com.',
+                'from': 1,
+                'to': 4,
+                'changes': [
+                    {
+                        'name': '',
+                        'type': 'A',
+                        'change': 'delete',
+                        'existing': {'ttl': 300, 'value': '1.2.3.4'},
+                        'new': None,
+                    },
+                    {
+                        'name': 'new',
+                        'type': 'A',
+                        'change': 'create',
+                        'existing': None,
+                        'new': {'ttl': 60, 'value': '3.3.3.3'},
+                    },
+                    {
+                        'name': 'www',
+                        'type': 'A',
+                        'change': 'update',
+                        'existing': {'ttl': 300, 'value': '5.6.7.8'},
+                        'new': {'ttl': 300, 'value': '9.9.9.9'},
+                    },
+                ],
+            },
+            response.get_json(),
+        )
+
+        response = self.client.get(
+            '/zones/example.com./diff?from=2&to=3', headers=self.headers
+        )
+        self.assertEqual(
+            ['new'], [c['name'] for c in response.get_json()['changes']]
+        )
+
+        for query, status in (
+            ('', 400),
+            ('?from=nope', 400),
+            ('?from=1&to=0', 400),
+            ('?from=1&to=42', 404),
+        ):
+            response = self.client.get(
+                f'/zones/example.com./diff{query}', headers=self.headers
+            )
+            self.assertEqual(status, response.status_code)
+        response = self.client.get(
+            '/zones/notfound.com./diff?from=1', headers=self.headers
+        )
+        self.assertEqual(404, response.status_code)
+
+        with patch.object(
+            self.app.manager, 'diff_zone', side_effect=Exception('boom')
+        ):
+            response = self.client.get(
+                '/zones/example.com./diff?from=1', headers=self.headers
+            )
+            self.assertEqual(500, response.status_code)
+
+    def test_export_zone(self):
+        response = self.client.get(
+            '/zones/example.com./export', headers=self.headers
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/yaml', response.mimetype)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(
+            '''---
+? ''
+: ttl: 300
+  type: A
+  value: 1.2.3.4
+www:
+  ttl: 300
+  type: A
+  value: 5.6.7.8
+''',
+            response.get_data(as_text=True),
+        )
+
+        response = self.client.get(
+            '/zones/example.com./export?format=bind', headers=self.headers
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/dns', response.mimetype)
+        self.assertEqual(
+            '''$ORIGIN example.com.
+example.com. 300 IN A 1.2.3.4
+www.example.com. 300 IN A 5.6.7.8
+''',
+            response.get_data(as_text=True),
+        )
+
+        response = self.client.get(
+            '/zones/example.com./export?format=xml', headers=self.headers
+        )
+        self.assertEqual(400, response.status_code)
+        self.assertIn('yaml, bind', response.get_json()['error'])
+
+        response = self.client.get(
+            '/zones/notfound.com./export', headers=self.headers
+        )
+        self.assertEqual(404, response.status_code)
+
+        with patch.object(
+            self.app.manager, 'export_zone', side_effect=Exception('boom')
+        ):
+            response = self.client.get(
+                '/zones/example.com./export', headers=self.headers
+            )
+        self.assertEqual(500, response.status_code)
+
+    def test_import_zone(self):
+        response = self.client.put(
+            '/zones/example.com./import?format=bind',
+            data='www 60 IN A 9.9.9.9\n',
+            headers=self.headers,
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            {
+                'zone': 'example.com.',
+                'targets': [
+                    {
+                        'target': 'config',
+                        'creates': 0,
+                        'updates': 1,
+                        'deletes': 1,
+                        'applied': True,
+                    }
+                ],
+            },
+            response.get_json(),
+        )
+        response = self.client.get(
+            '/zones/example.com./records', headers=self.headers
+        )
+        self.assertEqual(
+            {'www': {'A': {'ttl': 60, 'value': '9.9.9.9'}}},
+            response.get_json()['records'],
+        )
+
+        for url, data in (
+            ('/zones/example.com./import?format=xml', ''),
+            ('/zones/example.com./import', 'www: [\n'),
+            ('/zones/example.com./import', 'www:\n  type: A\n  value: x\n'),
+            ('/zones/example.com./import', b'\xff\n'),
+        ):
+            response = self.client.put(url, data=data, headers=self.headers)
+            self.assertEqual(400, response.status_code, data)
+
+        response = self.client.put(
+            '/zones/notfound.com./import', data='', headers=self.headers
+        )
+        self.assertEqual(404, response.status_code)
+
+    def test_import_zone_unsafe(self):
+        with patch.object(self.app.manager, 'import_zone') as import_zone:
+            import_zone.side_effect = UnsafePlan('Too many deletes')
+            response = self.client.put(
+                '/zones/example.com./import', data='', headers=self.headers
+            )
+            self.assertEqual(409, response.status_code)
+            self.assertIn('Too many deletes', response.get_json()['error'])
+            self.assertFalse(import_zone.call_args.kwargs['force'])
+
+            import_zone.side_effect = None
+            import_zone.return_value = {'zone': 'example.com.', 'targets': []}
+            response = self.client.put(
+                '/zones/example.com./import?force=true',
+                data='',
+                headers=self.headers,
+            )
+            self.assertEqual(200, response.status_code)
+            self.assertTrue(import_zone.call_args.kwargs['force'])
+
+            import_zone.side_effect = Exception('boom')
+            response = self.client.put(
+                '/zones/example.com./import', data='', headers=self.headers
+            )
+            self.assertEqual(500, response.status_code)
+
+    def test_replace_records(self):
+        records = {
+            '': {'A': {'ttl': 300, 'values': ['1.2.3.4']}},
+            'mail': {
+                'A': {'ttl': 60, 'value': '2.3.4.5'},
+                'MX': {
+                    'ttl': 60,
+                    'value': {
+                        'preference': 10,
+                        'exchange': 'mail.example.com.',
+                    },
+                },
+            },
+        }
+        response = self.client.put(
+            '/zones/example.com./records',
+            json={'records': records},
+            headers=self.headers,
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            {
+                'zone': 'example.com.',
+                'targets': [
+                    {
+                        'target': 'config',
+                        'creates': 2,
+                        'updates': 0,
+                        'deletes': 1,
+                        'applied': True,
+                    }
+                ],
+            },
+            response.get_json(),
+        )
+        response = self.client.get(
+            '/zones/example.com./records', headers=self.headers
+        )
+        self.assertEqual(
+            {'', 'mail'}, set(response.get_json()['records'].keys())
+        )
+
+        # the same again is a no-op
+        response = self.client.put(
+            '/zones/example.com./records',
+            json={'records': records},
+            headers=self.headers,
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.get_json()['targets'][0]['applied'])
+
+        for body in (
+            None,
+            [],
+            {},
+            {'records': []},
+            {'records': {'www': []}},
+            {'records': {'www': {'A': 'nope'}}},
+        ):
+            response = self.client.put(
+                '/zones/example.com./records', json=body, headers=self.headers
+            )
+            self.assertEqual(400, response.status_code, body)
+            self.assertIn('records must map', response.get_json()['error'])
+
+        # invalid record data
+        response = self.client.put(
+            '/zones/example.com./records',
+            json={'records': {'www': {'A': {'ttl': 60, 'value': 'nope'}}}},
+            headers=self.headers,
+        )
+        self.assertEqual(400, response.status_code)
+        self.assertIn('www.example.com.', response.get_json()['error'])
+
+        response = self.client.put(
+            '/zones/notfound.com./records',
+            json={'records': {}},
+            headers=self.headers,
+        )
+        self.assertEqual(404, response.status_code)
+
+    def test_replace_records_unsafe(self):
+        with patch.object(self.app.manager, 'replace_records') as replace:
+            replace.side_effect = UnsafePlan('Too many deletes')
+            response = self.client.put(
+                '/zones/example.com./records',
+                json={'records': {}},
+                headers=self.headers,
+            )
+            self.assertEqual(409, response.status_code)
+            self.assertFalse(replace.call_args.kwargs['force'])
+
+            replace.side_effect = None
+            replace.return_value = {'zone': 'example.com.', 'targets': []}
+            response = self.client.put(
+                '/zones/example.com./records?force=1',
+                json={'records': {'xn--bcher-kva': {}}},
+                headers=self.headers,
+            )
+            self.assertEqual(200, response.status_code)
+            self.assertTrue(replace.call_args.kwargs['force'])
+            # names are decoded
+            self.assertEqual({'bücher': {}}, replace.call_args.args[1])
+
+            # records validated in a planning process are invalid requests too
+            replace.side_effect = PlanningValidationError(
+                'www.example.com.', ['invalid IPv4 address "nope"']
+            )
+            response = self.client.put(
+                '/zones/example.com./records',
+                json={'records': {}},
+                headers=self.headers,
+            )
+            self.assertEqual(400, response.status_code)
+            self.assertIn('www.example.com.', response.get_json()['error'])
+
+            replace.side_effect = Exception('boom')
+            response = self.client.put(
+                '/zones/example.com./records',
+                json={'records': {}},
+                headers=self.headers,
+            )
+            self.assertEqual(500, response.status_code)
+
+    def test_sync_zone_unsafe(self):
+        with patch.object(self.app.manager, 'sync_zone') as sync_zone:
+            sync_zone.side_effect = UnsafePlan('Too many deletes')
+            response = self.client.post(
+                '/zones/example.com./sync',
+                json={'dry_run': True},
+                headers=self.headers,
+            )
+        self.assertEqual(409, response.status_code)
+        self.assertIn('Too many deletes', response.get_json()['error'])
+
+    def test_apply_plan(self):
+        # nothing to change so nothing is kept
+        response = self.client.post(
+            '/zones/example.com./sync',
+            json={'dry_run': True},
+            headers=self.headers,
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.get_json()['plan_id'])
+
+        response = self.client.post(
+            f'/plans/{"0" * 32}/apply', headers=self.headers
+        )
+        self.assertEqual(404, response.status_code)
+        self.assertIn('not found', response.get_json()['error'])
+
+        with patch.object(self.app.manager, 'apply_plan') as apply_plan:
+            apply_plan.return_value = {'zone': 'example.com.', 'result': 1}
+            response = self.client.post(
+                '/plans/abc/apply', headers=self.headers
+            )
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(1, response.get_json()['result'])
+            apply_plan.assert_called_once_with('abc')
+
+            apply_plan.side_effect = StalePlanException('changed')
+            response = self.client.post(
+                '/plans/abc/apply', headers=self.headers
+            )
+            self.assertEqual(409, response.status_code)
+
+            apply_plan.side_effect = Exception('boom')
+            response = self.client.post(
+                '/plans/abc/apply', headers=self.headers
+            )
+            self.assertEqual(500, response.status_code)
+
     def test_create_record_error(self):
         # Test API manager exception
         mock_manager = MagicMock()
@@ -299,6 +793,112 @@ zones:
             )
             self.assertEqual(response.status_code, 500)
 
+    def test_lookup_records(self):
+        with patch.object(
+            self.app.manager,
+            'get_snapshot',
+            wraps=self.app.manager.get_snapshot,
+        ) as get_snapshot:
+            response = self.client.post(
+                '/zones/example.com./records:lookup',
+                headers=self.headers,
+                json={
+                    'records': [
+                        {'name': 'www', 'type': 'A'},
+                        {'name': 'missing', 'type': 'A'},
+                        {'type': 'A'},
+                        {'name': 'WWW', 'type': 'AAAA'},
+                    ]
+                },
+            )
+            # a single snapshot for all of the lookups
+            get_snapshot.assert_called_once()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            {
+                'zone': 'example.com.',
+                'version': None,
+                'records': [
+                    {
+                        'name': 'www',
+                        'type': 'A',
+                        'ttl': 300,
+                        'value': '5.6.7.8',
+                    },
+                    {'name': '', 'type': 'A', 'ttl': 300, 'value': '1.2.3.4'},
+                ],
+                'misses': [
+                    {'name': 'missing', 'type': 'A'},
+                    {'name': 'www', 'type': 'AAAA'},
+                ],
+            },
+            response.get_json(),
+        )
+
+    def test_lookup_records_invalid(self):
+        for body in (
+            None,
+            {},
+            {'records': []},
+            {'records': ['www']},
+            {'records': [{'name': 'www'}]},
+            {'records': [{'name': 42, 'type': 'A'}]},
+        ):
+            response = self.client.post(
+                '/zones/example.com./records:lookup',
+                headers=self.headers,
+                json=body,
+            )
+            self.assertEqual(400, response.status_code, body)
+
+    def test_lookup_records_errors(self):
+        mock_manager = MagicMock()
+        mock_manager.manager.config = {
+            'api': {'keys': [{'key': 'test-key-123'}]}
+        }
+        body = {'records': [{'name': 'www', 'type': 'A'}]}
+        for exception, status in (
+            (ApiManagerException('Zone not configured'), 404),
+            (Exception('Unexpected'), 500),
+        ):
+            mock_manager.lookup_records.side_effect = exception
+            with patch.object(self.app, 'manager', mock_manager):
+                response = self.client.post(
+                    '/zones/example.com./records:lookup',
+                    headers=self.headers,
+                    json=body,
+                )
+                self.assertEqual(status, response.status_code)
+
+    def test_metrics(self):
+        response = self.client.get('/metrics', headers=self.headers)
+        self.assertEqual(200, response.status_code)
+        data = response.get_json()
+        # the yaml provider doesn't have any sessions
+        self.assertEqual({}, data['connection_pools'])
+        # requests are recorded once they're complete
+        self.assertEqual(0, data['keys']['test']['requests'])
+
+        self.client.get('/zones/notfound.com.', headers=self.headers)
+        response = self.client.get('/metrics', headers=self.headers)
+        usage = response.get_json()['keys']['test']
+        self.assertEqual(2, usage['requests'])
+        self.assertEqual(1, usage['errors'])
+        self.assertEqual({'GET': 2}, usage['methods'])
+
+        response = self.client.get('/metrics')
+        self.assertEqual(401, response.status_code)
+
+    def test_metrics_error(self):
+        mock_manager = MagicMock()
+        mock_manager.manager.config = {
+            'api': {'keys': [{'key': 'test-key-123'}]}
+        }
+        mock_manager.pools.stats.side_effect = Exception('Unexpected')
+        with patch.object(self.app, 'manager', mock_manager):
+            response = self.client.get('/metrics', headers=self.headers)
+            self.assertEqual(500, response.status_code)
+
     def test_delete_record_api_manager_error(self):
         mock_manager = MagicMock()
         mock_manager.manager.config = {
@@ -340,7 +940,7 @@ zones:
         mock_manager.manager.config = {
             'api': {'keys': [{'key': 'test-key-123'}]}
         }
-        mock_manager.get_zone.side_effect = ApiManagerException(
+        mock_manager.get_snapshot.side_effect = ApiManagerException(
             'Zone not configured'
         )
         with patch.object(self.app, 'manager', mock_manager):
@@ -354,7 +954,7 @@ zones:
         mock_manager.manager.config = {
             'api': {'keys': [{'key': 'test-key-123'}]}
         }
-        mock_manager.get_zone.side_effect = Exception('Unexpected')
+        mock_manager.get_snapshot.side_effect = Exception('Unexpected')
         with patch.object(self.app, 'manager', mock_manager):
             response = self.client.get(
                 '/zones/example.com.', headers=self.headers
@@ -396,7 +996,7 @@ zones:
         mock_manager.manager.config = {
             'api': {'keys': [{'key': 'test-key-123'}]}
         }
-        mock_manager.get_zone.side_effect = ApiManagerException(
+        mock_manager.get_snapshot.side_effect = ApiManagerException(
             'Zone not configured'
         )
         with patch.object(self.app, 'manager', mock_manager):
@@ -410,7 +1010,7 @@ zones:
         mock_manager.manager.config = {
             'api': {'keys': [{'key': 'test-key-123'}]}
         }
-        mock_manager.get_zone.side_effect = Exception('Unexpected')
+        mock_manager.get_snapshot.side_effect = Exception('Unexpected')
         with patch.object(self.app, 'manager', mock_manager):
             response = self.client.get(
                 '/zones/example.com./records', headers=self.headers
@@ -547,7 +1147,7 @@ zones:
         '''Test getting UTF-8 configured zone using UTF-8 name (café.com)'''
         response = self.client.get('/zones/café.com.', headers=self.headers)
         data = response.get_json()
-        self.assertEqual({'name': 'café.com.'}, data)
+        self.assertEqual({'name': 'café.com.', 'version': None}, data)
         self.assertEqual(response.status_code, 200)
 
     def test_get_utf8_zone_by_idna_name(self):
@@ -556,7 +1156,7 @@ zones:
             '/zones/xn--caf-dma.com.', headers=self.headers
         )
         data = response.get_json()
-        self.assertEqual({'name': 'café.com.'}, data)
+        self.assertEqual({'name': 'café.com.', 'version': None}, data)
         self.assertEqual(response.status_code, 200)
 
     def test_get_idna_zone_by_idna_name(self):
@@ -565,7 +1165,7 @@ zones:
             '/zones/xn--wgv71a.example.com.', headers=self.headers
         )
         data = response.get_json()
-        self.assertEqual({'name': '日本.example.com.'}, data)
+        self.assertEqual({'name': '日本.example.com.', 'version': None}, data)
         self.assertEqual(response.status_code, 200)
 
     def test_get_idna_zone_by_utf8_name(self):
@@ -574,7 +1174,7 @@ zones:
             '/zones/日本.example.com.', headers=self.headers
         )
         data = response.get_json()
-        self.assertEqual({'name': '日本.example.com.'}, data)
+        self.assertEqual({'name': '日本.example.com.', 'version': None}, data)
         self.assertEqual(response.status_code, 200)
 
     def test_list_records_mixed_encoding(self):
@@ -592,6 +1192,7 @@ zones:
                     'test': {'A': {'ttl': 300, 'value': '5.6.7.8'}},
                     'тест': {'A': {'ttl': 300, 'value': '10.0.0.2'}},
                 },
+                'version': None,
                 'zone': 'café.com.',
             },
             data,
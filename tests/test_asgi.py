@@ -0,0 +1,389 @@
+#
+#
+#
+
+from asyncio import run
+from json import dumps, loads
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest.mock import patch
+
+from octodns_api.asgi import AsgiApp, cached_reads, create_asgi_app
+
+
+def _request(app, method, path, body=b'', headers=None, chunks=1):
+    headers = headers or []
+    sent = []
+    messages = []
+    size = max(1, len(body) // chunks)
+    for i in range(0, max(len(body), 1), size):
+        messages.append(
+            {
+                'type': 'http.request',
+                'body': body[i : i + size],
+                'more_body': i + size < len(body),
+            }
+        )
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'root_path': '',
+        'query_string': b'',
+        'headers': headers,
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 1234),
+    }
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    run(app(scope, receive, send))
+
+    start = sent.pop(0)
+    # all but the last have more to come
+    assert [m.get('more_body', False) for m in sent] == [True] * (
+        len(sent) - 1
+    ) + [False]
+    return (
+        start['status'],
+        dict(start['headers']),
+        b''.join(m['body'] for m in sent),
+    )
+
+
+class TestAsgi(TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.config_dir = join(self.tmpdir, 'config')
+        makedirs(self.config_dir)
+
+        with open(join(self.config_dir, 'example.com.yaml'), 'w') as f:
+            f.write(
+                '''
+---
+'':
+  ttl: 300
+  type: A
+  values:
+    - 1.2.3.4
+www:
+  ttl: 300
+  type: A
+  values:
+    - 5.6.7.8
+'''
+            )
+
+        self.config_file = self._config()
+        self.app = create_asgi_app(self.config_file)
+        self.headers = [(b'authorization', b'Bearer test-key-123')]
+
+    def _config(self, api=''):
+        config_file = join(self.tmpdir, 'config.yaml')
+        with open(config_file, 'w') as f:
+            f.write(
+                f'''
+api:
+  asgi:
+    max_workers: 2
+  keys:
+    - name: test
+      key: test-key-123
+{api}
+
+providers:
+  config:
+    class: octodns.provider.yaml.YamlProvider
+    directory: {self.config_dir}
+
+zones:
+  example.com.:
+    sources:
+      - config
+    targets:
+      - config
+'''
+            )
+        return config_file
+
+    def tearDown(self):
+        self.app.executor.shutdown()
+        rmtree(self.tmpdir)
+
+    def test_create_asgi_app(self):
+        self.assertIsInstance(self.app, AsgiApp)
+        self.assertEqual(2, self.app.executor._max_workers)
+
+    def test_get(self):
+        status, headers, body = _request(
+            self.app, 'GET', '/zones/example.com./records', headers=self.headers
+        )
+        self.assertEqual(200, status)
+        self.assertEqual(b'application/json', headers[b'content-type'])
+        data = loads(body)
+        self.assertEqual('example.com.', data['zone'])
+        self.assertEqual({'', 'www'}, set(data['records'].keys()))
+
+        # apex record w/empty name
+        status, _, body = _request(
+            self.app,
+            'GET',
+            '/zones/example.com./records//A',
+            headers=self.headers,
+        )
+        self.assertEqual(200, status)
+        self.assertEqual('', loads(body)['name'])
+
+    def test_unauthorized(self):
+        status, _, body = _request(self.app, 'GET', '/zones')
+        self.assertEqual(401, status)
+        self.assertIn('Missing Authorization header', loads(body)['error'])
+
+    def test_post(self):
+        body = dumps({'ttl': 600, 'values': ['9.9.9.9']}).encode('utf-8')
+        headers = self.headers + [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('latin-1')),
+            (b'x-multi', b'a'),
+            (b'x-multi', b'b'),
+        ]
+        # body arrives in several chunks
+        status, _, body = _request(
+            self.app,
+            'POST',
+            '/zones/example.com./records/test/A',
+            body=body,
+            headers=headers,
+            chunks=3,
+        )
+        self.assertEqual(201, status)
+        self.assertEqual(
+            {'name': 'test', 'ttl': 600, 'type': 'A', 'value': '9.9.9.9'},
+            loads(body),
+        )
+
+    def test_cached_reads(self):
+        # without the cache everything goes to the pool
+        with patch.object(
+            self.app, '_call_wsgi', wraps=self.app._call_wsgi
+        ) as mock_call_wsgi:
+            for _ in range(2):
+                _request(
+                    self.app,
+                    'GET',
+                    '/zones/example.com./records',
+                    headers=self.headers,
+                )
+            self.assertEqual(2, mock_call_wsgi.call_count)
+
+        app = create_asgi_app(self._config('  cache:\n    ttl: 60'))
+        path = '/zones/example.com./records/www/A'
+        with patch.object(
+            app, '_call_wsgi', wraps=app._call_wsgi
+        ) as mock_call_wsgi:
+            # a miss populates the zone on the pool
+            status, _, body = _request(app, 'GET', path, headers=self.headers)
+            self.assertEqual(200, status)
+            mock_call_wsgi.assert_called_once()
+
+            # once it's cached reads are answered on the event loop
+            mock_call_wsgi.reset_mock()
+            for path in (
+                '/zones/example.com./records/www/A',
+                '/zones/example.com./records',
+                '/zones/example.com.',
+            ):
+                status, _, body = _request(
+                    app, 'GET', path, headers=self.headers
+                )
+                self.assertEqual(200, status, body)
+            mock_call_wsgi.assert_not_called()
+
+            # everything else still goes to the pool
+            for method, path in (
+                ('GET', '/zones/example.com./export'),
+                ('GET', '/zones/other.com./records'),
+                ('GET', '/zones/xn--zz.com./records'),
+                ('GET', '/nope'),
+                ('DELETE', '/zones/example.com./records/www/A'),
+            ):
+                _request(app, method, path, headers=self.headers)
+            self.assertEqual(5, mock_call_wsgi.call_count)
+        app.executor.shutdown()
+
+        # apps that can block before getting to the zone
+        for api in (
+            '  rate_limits:\n    path: ' + join(self.tmpdir, 'buckets.db'),
+            '  admission:\n    reads:\n      max_in_flight: 1\n'
+            '      max_queue: 1',
+            '  profiling:\n    keys: [test]',
+        ):
+            app = create_asgi_app(self._config(api))
+            self.assertIsNone(app.inline)
+            app.executor.shutdown()
+        # admission that turns requests away rather than queueing them doesn't
+        app = create_asgi_app(
+            self._config('  admission:\n    reads:\n      max_in_flight: 1')
+        )
+        self.assertIsNotNone(cached_reads(app.wsgi_app))
+        app.executor.shutdown()
+
+    def test_wsgi_environ(self):
+        captured = {}
+
+        def wsgi_app(environ, start_response):
+            captured.update(environ)
+            start_response('204 No Content', [('X-Thing', 'yes')])
+            return [b'']
+
+        app = AsgiApp(wsgi_app)
+        status, headers, body = _request(
+            app,
+            'GET',
+            '/zones/ä',
+            headers=[(b'x-multi', b'a'), (b'x-multi', b'b')],
+        )
+        app.executor.shutdown()
+        self.assertEqual(204, status)
+        self.assertEqual({b'x-thing': b'yes'}, headers)
+        self.assertEqual(b'', body)
+        self.assertEqual('a,b', captured['HTTP_X_MULTI'])
+        self.assertEqual('/zones/Ã¤', captured['PATH_INFO'])
+        self.assertEqual('testserver', captured['SERVER_NAME'])
+        self.assertEqual('80', captured['SERVER_PORT'])
+        self.assertEqual('127.0.0.1', captured['REMOTE_ADDR'])
+
+    def test_streaming(self):
+        read = []
+
+        def wsgi_app(environ, start_response):
+            body = environ['wsgi.input']
+            # read a bit at a time, as the chunks arrive
+            read.append(body.readline())
+            buffer = bytearray(2)
+            read.append(body.readinto(buffer))
+            read.append(bytes(buffer))
+            read.append(body.read(1))
+            read.append(body.readline(2))
+            read.extend(body)
+            read.append(body.read())
+            read.append(body.readline())
+
+            def generate():
+                start_response('200 OK', [('Content-Type', 'text/plain')])
+                yield b'first,'
+                yield b''
+                yield b'second'
+
+            return generate()
+
+        app = AsgiApp(wsgi_app)
+        sent = []
+        messages = [
+            {'type': 'http.request', 'body': b'one\ntw', 'more_body': True},
+            {
+                'type': 'http.request',
+                'body': b'o\nthree\nfo',
+                'more_body': True,
+            },
+            {'type': 'http.request', 'body': b'ur', 'more_body': False},
+        ]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        run(app({'type': 'http', 'method': 'PUT', 'path': '/'}, receive, send))
+        app.executor.shutdown()
+        self.assertEqual(
+            [b'one\n', 2, b'tw', b'o', b'\n', b'three\n', b'four', b'', b''],
+            read,
+        )
+        # the response is sent as it's produced, the empty chunk is skipped
+        self.assertEqual(
+            [
+                {
+                    'type': 'http.response.start',
+                    'status': 200,
+                    'headers': [(b'content-type', b'text/plain')],
+                },
+                {
+                    'type': 'http.response.body',
+                    'body': b'first,',
+                    'more_body': True,
+                },
+                {
+                    'type': 'http.response.body',
+                    'body': b'second',
+                    'more_body': True,
+                },
+                {'type': 'http.response.body', 'body': b''},
+            ],
+            sent,
+        )
+
+    def test_export_streamed(self):
+        status, headers, body = _request(
+            self.app, 'GET', '/zones/example.com./export', headers=self.headers
+        )
+        self.assertEqual(200, status)
+        self.assertIn(b'5.6.7.8', body)
+
+    def test_import_streamed(self):
+        body = b'''---
+www:
+  ttl: 300
+  type: A
+  value: 9.9.9.9
+'''
+        status, _, response = _request(
+            self.app,
+            'PUT',
+            '/zones/example.com./import',
+            body=body,
+            headers=self.headers + [(b'content-type', b'application/x-yaml')],
+            chunks=4,
+        )
+        self.assertEqual(200, status, response)
+        status, _, body = _request(
+            self.app,
+            'GET',
+            '/zones/example.com./records/www/A',
+            headers=self.headers,
+        )
+        self.assertEqual('9.9.9.9', loads(body)['value'])
+
+    def test_lifespan(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        run(self.app({'type': 'lifespan'}, receive, send))
+        self.assertEqual(
+            [
+                {'type': 'lifespan.startup.complete'},
+                {'type': 'lifespan.shutdown.complete'},
+            ],
+            sent,
+        )
+
+    def test_unsupported_scope(self):
+        with self.assertRaises(ValueError) as ctx:
+            run(self.app({'type': 'websocket'}, None, None))
+        self.assertEqual('Unsupported scope type websocket', str(ctx.exception))
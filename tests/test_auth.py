@@ -2,43 +2,50 @@
 #
 #
 
-from tempfile import NamedTemporaryFile
+from os.path import join
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 from unittest import TestCase
-from unittest.mock import patch
 
-from flask import Flask
+from flask import Flask, g
 
 from octodns_api.app import create_app
-from octodns_api.auth import _get_api_keys, require_api_key
+from octodns_api.auth import ApiKey, ApiKeys, require_api_key
+from octodns_api.ratelimit import SqliteTokenBuckets
 
 
 class TestAuth(TestCase):
     def setUp(self):
+        self._app([('valid', 'valid-key-123', {}), ('other', 'other-key', {})])
+
+    def _app(self, keys):
         self.app = Flask(__name__)
         self.app.config['TESTING'] = True
-        self.app.config['OCTODNS_CONFIG_FILE'] = '/tmp/test-config.yaml'
+        self.app.api_keys = ApiKeys(keys)
+        self.app.after_request(self.app.api_keys.after_request)
+        self.app.teardown_request(self.app.api_keys.teardown_request)
+        self.app.admission = None
+        self.app.profiler = None
 
-        @self.app.route('/test')
+        @self.app.route('/test', methods=['GET', 'POST'])
         @require_api_key
         def test_endpoint():
-            return {'success': True}
+            return {'success': True, 'key': g.api_key.name}
 
-        self.client = self.app.test_client()
+        @self.app.route('/fail')
+        @require_api_key
+        def fail_endpoint():
+            return {'error': 'nope'}, 404
 
-    @patch('octodns_api.auth._get_api_keys')
-    def test_missing_authorization_header(self, mock_get_keys):
-        mock_get_keys.return_value = ['test-key-123']
+        self.client = self.app.test_client()
 
+    def test_missing_authorization_header(self):
         response = self.client.get('/test')
         self.assertEqual(response.status_code, 401)
         self.assertIn(
             'Missing Authorization header', response.get_json()['error']
         )
 
-    @patch('octodns_api.auth._get_api_keys')
-    def test_invalid_authorization_format(self, mock_get_keys):
-        mock_get_keys.return_value = ['test-key-123']
-
+    def test_invalid_authorization_format(self):
         response = self.client.get(
             '/test', headers={'Authorization': 'InvalidFormat'}
         )
@@ -47,28 +54,138 @@ class TestAuth(TestCase):
             'Invalid Authorization header format', response.get_json()['error']
         )
 
-    @patch('octodns_api.auth._get_api_keys')
-    def test_invalid_api_key(self, mock_get_keys):
-        mock_get_keys.return_value = ['valid-key-123']
-
+    def test_invalid_api_key(self):
         response = self.client.get(
             '/test', headers={'Authorization': 'Bearer invalid-key'}
         )
         self.assertEqual(response.status_code, 401)
         self.assertIn('Invalid API key', response.get_json()['error'])
+        # nothing is recorded for requests that aren't authenticated
+        self.assertEqual(
+            [0, 0], [s['requests'] for s in self.app.api_keys.stats().values()]
+        )
 
-    @patch('octodns_api.auth._get_api_keys')
-    def test_valid_api_key(self, mock_get_keys):
-        mock_get_keys.return_value = ['valid-key-123']
-
+    def test_valid_api_key(self):
         response = self.client.get(
             '/test', headers={'Authorization': 'Bearer valid-key-123'}
         )
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.get_json(), {'success': True})
+        # resolved to the key's identity
+        self.assertEqual(response.get_json(), {'success': True, 'key': 'valid'})
+
+    def test_usage(self):
+        headers = {'Authorization': 'Bearer valid-key-123'}
+        self.client.get('/test', headers=headers)
+        self.client.post('/test', headers=headers)
+        self.client.get('/fail', headers=headers)
+
+        stats = self.app.api_keys.stats()
+        self.assertEqual(['other', 'valid'], list(stats.keys()))
+        self.assertEqual(0, stats['other']['requests'])
+        valid = stats['valid']
+        self.assertEqual(3, valid['requests'])
+        self.assertEqual(1, valid['errors'])
+        self.assertEqual({'GET': 2, 'POST': 1}, valid['methods'])
+        # there's no request timer outside of the app
+        self.assertEqual(0, valid['max_ms'])
+
+    def test_limits(self):
+        self._app([('limited', 'limited-key', {'rate': 0.5, 'concurrency': 1})])
+        headers = {'Authorization': 'Bearer limited-key'}
+
+        response = self.client.get('/test', headers=headers)
+        self.assertEqual(200, response.status_code)
+        # the request's slot was released
+        limits = self.app.api_keys.resolve('limited-key').limits
+        self.assertEqual(0, limits.in_flight)
+
+        response = self.client.get('/test', headers=headers)
+        self.assertEqual(429, response.status_code)
+        self.assertEqual('2', response.headers['Retry-After'])
+        self.assertEqual(
+            'Too many requests for key limited, retry later',
+            response.get_json()['error'],
+        )
 
-    def test_get_api_keys_with_missing_key_value(self):
-        # Test coverage for when a key config has no 'key' field
+        stats = self.app.api_keys.stats()['limited']
+        # turned away requests are recorded against the key
+        self.assertEqual((2, 1), (stats['requests'], stats['errors']))
+        self.assertEqual(1, stats['limits']['rate_limited'])
+        self.assertEqual(0, stats['limits']['in_flight'])
+
+    def test_api_key(self):
+        key = ApiKey('test')
+        self.assertEqual('ApiKey<test>', repr(key))
+        self.assertEqual(
+            {
+                'requests': 0,
+                'errors': 0,
+                'methods': {},
+                'total_ms': 0,
+                'mean_ms': 0,
+                'max_ms': 0,
+            },
+            key.stats(),
+        )
+        key.record('GET', 200, 0.002)
+        key.record('DELETE', 500, 0.004)
+        key.record('GET', 201, 0.003)
+        self.assertEqual(
+            {
+                'requests': 3,
+                'errors': 1,
+                'methods': {'GET': 2, 'DELETE': 1},
+                'total_ms': 9,
+                'mean_ms': 3,
+                'max_ms': 4,
+            },
+            key.stats(),
+        )
+
+    def test_from_config(self):
+        keys = ApiKeys.from_config(
+            {
+                'keys': [
+                    {'name': 'test1', 'key': 'valid-key'},
+                    # no key, skipped
+                    {'name': 'test2'},
+                    # no name
+                    {'key': 'unnamed'},
+                    # shares its name, and usage, with the first
+                    {'name': 'test1', 'key': 'rotated-key', 'rate': 5},
+                    {'name': 'test3', 'key': 'limited', 'concurrency': 2},
+                ]
+            }
+        )
+        self.assertEqual(4, len(keys))
+        self.assertEqual('test1', keys.resolve('valid-key').name)
+        # the first key's limits, none, apply
+        self.assertIsNone(keys.resolve('rotated-key').limits)
+        limits = keys.resolve('limited').limits
+        self.assertEqual((None, 2), (limits.rate, limits.concurrency))
+        self.assertIs(keys.resolve('valid-key'), keys.resolve('rotated-key'))
+        self.assertEqual('keys[2]', keys.resolve('unnamed').name)
+        self.assertIsNone(keys.resolve('test2'))
+        self.assertEqual(
+            ['keys[2]', 'test1', 'test3'], list(keys.stats().keys())
+        )
+
+        self.assertEqual(0, len(ApiKeys.from_config({})))
+
+        # rate limits shared through a store
+        with TemporaryDirectory() as tmpdir:
+            keys = ApiKeys.from_config(
+                {
+                    'keys': [{'name': 'test', 'key': 'k', 'rate': 1}],
+                    'rate_limits': {'path': join(tmpdir, 'limits.db')},
+                }
+            )
+            limits = keys.resolve('k').limits
+            self.assertIsInstance(limits.store, SqliteTokenBuckets)
+            self.assertIsNone(limits.acquire())
+            self.assertEqual(1, limits.acquire())
+
+    def test_app(self):
         with NamedTemporaryFile(mode='w', suffix='.yaml') as f:
             f.write(
                 '''
@@ -93,7 +210,13 @@ zones:
             f.flush()
             test_app = create_app(f.name)
 
-        with test_app.app_context():
-            keys = _get_api_keys()
-            # Should only include the valid key, skip the one without 'key' field
-            self.assertEqual(keys, ['valid-key'])
+        client = test_app.test_client()
+        response = client.get(
+            '/zones', headers={'Authorization': 'Bearer valid-key'}
+        )
+        self.assertEqual(200, response.status_code)
+        usage = test_app.api_keys.stats()['test1']
+        self.assertEqual(1, usage['requests'])
+        # timed by the app's request timer
+        self.assertGreater(usage['total_ms'], 0)
+        self.assertEqual(usage['total_ms'], usage['max_ms'])
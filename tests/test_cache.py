@@ -0,0 +1,618 @@
+#
+#
+#
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import monotonic
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from octodns.record import Record
+from octodns.zone import Zone
+
+from octodns_api.cache import KeyValueZoneStore, SqliteZoneStore, ZoneCache
+from octodns_api.snapshot import ZoneSnapshot
+
+
+def _snapshot():
+    zone = Zone('example.com.', [])
+    zone.add_record(
+        Record.new(zone, '', {'type': 'A', 'ttl': 300, 'values': ['1.2.3.4']})
+    )
+    zone.add_record(
+        Record.new(
+            zone,
+            'mail',
+            {
+                'type': 'MX',
+                'ttl': 600,
+                'value': {'preference': 10, 'exchange': 'mx.example.com.'},
+                'octodns': {'ignored': True},
+            },
+        )
+    )
+    return ZoneSnapshot.from_zone(zone)
+
+
+class _KeyValue:
+    '''
+    Local stand-in for a Redis client
+    '''
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def get(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= monotonic():
+            self.delete(key)
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and self.get(key) is not None:
+            return None
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if px is not None:
+            self.expires[key] = monotonic() + px / 1000
+        return True
+
+    def getdel(self, key):
+        value = self.get(key)
+        self.delete(key)
+        return value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        self.expires.pop(key, None)
+
+    def eval(self, script, numkeys, key, owner):
+        # only KeyValueZoneStore's compare and delete release is run
+        if self.get(key) == owner.encode('utf-8'):
+            self.delete(key)
+            return 1
+        return 0
+
+
+class TestSqliteZoneStore(TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.path = join(self.tmpdir, 'snapshots.db')
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        store = SqliteZoneStore(self.path)
+        self.assertIsNone(store.load('example.com.'))
+
+        snapshot = _snapshot()
+        store.save('example.com.', snapshot, 42.0)
+
+        # a new store, e.g. after a restart, sees what was saved
+        store = SqliteZoneStore(self.path)
+        loaded, fetched_at = store.load('example.com.')
+        self.assertEqual(42.0, fetched_at)
+        self.assertEqual('example.com.', loaded.name)
+        self.assertEqual(list(snapshot.records()), list(loaded.records()))
+
+        store.delete('example.com.')
+        self.assertIsNone(store.load('example.com.'))
+
+    def test_invalid_snapshots_discarded(self):
+        store = SqliteZoneStore(self.path)
+
+        # unknown format version
+        store.save('example.com.', _snapshot(), 42.0)
+        store._conn.execute('UPDATE snapshots SET format = 0')
+        self.assertIsNone(store.load('example.com.'))
+        # and it's been removed
+        self.assertIsNone(
+            store._conn.execute('SELECT * FROM snapshots').fetchone()
+        )
+
+        # corrupt data
+        store.save('example.com.', _snapshot(), 42.0)
+        store._conn.execute("UPDATE snapshots SET data = X'00'")
+        self.assertIsNone(store.load('example.com.'))
+        self.assertIsNone(
+            store._conn.execute('SELECT * FROM snapshots').fetchone()
+        )
+
+    @patch('octodns_api.cache.time')
+    def test_claim(self, mock_time):
+        mock_time.return_value = 100
+        store = SqliteZoneStore(self.path)
+        # another process' connection
+        other = SqliteZoneStore(self.path)
+        self.assertTrue(store.claim('example.com.', 'a', 30))
+        # held, by the owner
+        self.assertTrue(store.claim('example.com.', 'a', 30))
+        self.assertFalse(other.claim('example.com.', 'b', 30))
+        # leases are per zone
+        self.assertTrue(other.claim('other.com.', 'b', 30))
+
+        # only the owner can release
+        other.release('example.com.', 'b')
+        self.assertFalse(other.claim('example.com.', 'b', 30))
+        store.release('example.com.', 'a')
+        self.assertTrue(other.claim('example.com.', 'b', 30))
+
+        # leases that aren't released expire
+        mock_time.return_value = 130
+        self.assertTrue(store.claim('example.com.', 'a', 30))
+
+    @patch('octodns_api.cache.time')
+    def test_plans(self, mock_time):
+        mock_time.return_value = 100
+        store = SqliteZoneStore(self.path)
+        # another process' connection
+        other = SqliteZoneStore(self.path)
+        store.save_plan('a', b'plan a', 130)
+        store.save_plan('b', b'plan b', 160)
+
+        # plans can only be taken once, by any of the processes
+        self.assertEqual(b'plan a', other.take_plan('a'))
+        self.assertIsNone(store.take_plan('a'))
+        self.assertIsNone(store.take_plan('unknown'))
+
+        # expired plans can't be taken
+        mock_time.return_value = 160
+        self.assertIsNone(store.take_plan('b'))
+        # and are dropped when others are saved
+        store.save_plan('c', b'plan c', 190)
+        self.assertEqual(
+            [('c',)], store._conn.execute('SELECT id FROM plans').fetchall()
+        )
+
+
+class TestKeyValueZoneStore(TestCase):
+    def test_round_trip(self):
+        client = _KeyValue()
+        store = KeyValueZoneStore(client, prefix='test')
+        self.assertIsNone(store.load('example.com.'))
+
+        snapshot = _snapshot()
+        store.save('example.com.', snapshot, 42.0)
+        self.assertEqual(['test:snapshot:example.com.'], list(client.data))
+
+        # another process using the same store sees what was saved
+        loaded, fetched_at = KeyValueZoneStore(client, prefix='test').load(
+            'example.com.'
+        )
+        self.assertEqual(42.0, fetched_at)
+        self.assertEqual(list(snapshot.records()), list(loaded.records()))
+
+        store.delete('example.com.')
+        self.assertIsNone(store.load('example.com.'))
+
+    def test_invalid_snapshots_discarded(self):
+        client = _KeyValue()
+        store = KeyValueZoneStore(client)
+        key = 'octodns-api:snapshot:example.com.'
+
+        # unknown format version
+        store.save('example.com.', _snapshot(), 42.0)
+        client.data[key] = b'\x00' + client.data[key][1:]
+        self.assertIsNone(store.load('example.com.'))
+        # and it's been removed
+        self.assertEqual({}, client.data)
+
+        # corrupt data
+        client.data[key] = b'\x01'
+        self.assertIsNone(store.load('example.com.'))
+        self.assertEqual({}, client.data)
+
+    def test_claim(self):
+        client = _KeyValue()
+        store = KeyValueZoneStore(client)
+        self.assertTrue(store.claim('example.com.', 'a', 30))
+        self.assertTrue(store.claim('example.com.', 'a', 30))
+        self.assertFalse(store.claim('example.com.', 'b', 30))
+
+        store.release('example.com.', 'b')
+        self.assertFalse(store.claim('example.com.', 'b', 30))
+        store.release('example.com.', 'a')
+        self.assertTrue(store.claim('example.com.', 'b', 30))
+
+        # leases that aren't released expire
+        self.assertTrue(store.claim('other.com.', 'a', 0.001))
+        client.expires['octodns-api:lease:other.com.'] = 0
+        self.assertTrue(store.claim('other.com.', 'b', 30))
+        # and releasing them late doesn't release whoever claimed it since
+        store.release('other.com.', 'a')
+        self.assertFalse(store.claim('other.com.', 'a', 30))
+
+        # clients that decode responses
+        client = MagicMock()
+        client.set.return_value = None
+        client.get.return_value = 'a'
+        store = KeyValueZoneStore(client)
+        self.assertTrue(store.claim('example.com.', 'a', 30))
+        # released in a single compare and delete
+        store.release('example.com.', 'a')
+        client.eval.assert_called_once_with(
+            KeyValueZoneStore._release, 1, 'octodns-api:lease:example.com.', 'a'
+        )
+        client.get.assert_called_once()
+        client.delete.assert_not_called()
+
+    @patch('octodns_api.cache.time')
+    def test_plans(self, mock_time):
+        mock_time.return_value = 100
+        client = _KeyValue()
+        store = KeyValueZoneStore(client, prefix='test')
+        store.save_plan('a', b'plan a', 130)
+        key = 'test:plan:a'
+        self.assertEqual([key], list(client.data))
+        # left for the client to expire
+        self.assertAlmostEqual(monotonic() + 30, client.expires[key], 0)
+
+        self.assertEqual(b'plan a', store.take_plan('a'))
+        self.assertIsNone(store.take_plan('a'))
+
+        # plans that are already due to expire are kept for at least a ms
+        store.save_plan('b', b'plan b', 100)
+        self.assertLessEqual(client.expires['test:plan:b'], monotonic() + 0.001)
+
+    def test_from_url(self):
+        redis = MagicMock()
+        with patch.dict('sys.modules', {'redis': redis}):
+            store = KeyValueZoneStore.from_url(
+                'redis://cache:6379/0', prefix='test'
+            )
+        redis.Redis.from_url.assert_called_once_with('redis://cache:6379/0')
+        self.assertIs(redis.Redis.from_url.return_value, store.client)
+        self.assertEqual('test', store.prefix)
+
+
+class TestZoneCache(TestCase):
+    def setUp(self):
+        # versions are offset by a random epoch, zero it so that they're
+        # predictable
+        patcher = patch('octodns_api.cache.getrandbits', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_disabled(self):
+        cache = ZoneCache()
+        self.assertFalse(cache.enabled)
+        snapshot = _snapshot()
+        # returned as-is, without a version
+        self.assertIs(snapshot, cache.set('example.com.', snapshot))
+        self.assertIsNone(cache.get('example.com.'))
+        self.assertIsNone(cache.version('example.com.', 1))
+        # noop
+        cache.invalidate('example.com.')
+
+    @patch('octodns_api.cache.time')
+    def test_ttl(self, mock_time):
+        cache = ZoneCache(ttl=60)
+        self.assertTrue(cache.enabled)
+        self.assertIsNone(cache.get('example.com.'))
+
+        snapshot = _snapshot()
+        mock_time.return_value = 100
+        cache.set('example.com.', snapshot)
+
+        mock_time.return_value = 159
+        entry = cache.get('example.com.')
+        self.assertEqual(1, entry.snapshot.version)
+        self.assertEqual(snapshot.pack(), entry.snapshot.pack())
+        self.assertEqual(100, entry.fetched_at)
+        self.assertTrue(entry.verified)
+
+        mock_time.return_value = 160
+        self.assertIsNone(cache.get('example.com.'))
+
+        mock_time.return_value = 200
+        cache.set('example.com.', snapshot)
+        self.assertTrue(cache.get('example.com.'))
+        cache.invalidate('example.com.')
+        self.assertIsNone(cache.get('example.com.'))
+
+    @patch('octodns_api.cache.time')
+    def test_store(self, mock_time):
+        tmpdir = mkdtemp()
+        try:
+            path = join(tmpdir, 'snapshots.db')
+            cache = ZoneCache(ttl=60, store=SqliteZoneStore(path))
+            mock_time.return_value = 100
+            cache.set('example.com.', _snapshot())
+
+            # restart, long after the ttl
+            mock_time.return_value = 10000
+            cache = ZoneCache(ttl=60, store=SqliteZoneStore(path))
+            self.assertIsNone(cache.get('other.com.'))
+            entry = cache.get('example.com.')
+            self.assertFalse(entry.verified)
+            self.assertEqual(100, entry.fetched_at)
+            self.assertEqual(2, len(entry.snapshot))
+            # restored snapshots are versioned too
+            self.assertEqual(1, entry.snapshot.version)
+            # unverified entries are served until they're refreshed
+            self.assertEqual(entry, cache.get('example.com.'))
+
+            cache.set('example.com.', entry.snapshot)
+            self.assertTrue(cache.get('example.com.').verified)
+            self.assertEqual(2, cache.get('example.com.').snapshot.version)
+
+            cache.invalidate('example.com.')
+            self.assertIsNone(cache.get('example.com.'))
+            self.assertIsNone(cache.store.load('example.com.'))
+        finally:
+            rmtree(tmpdir)
+
+    def test_versions(self):
+        cache = ZoneCache(ttl=60, versions=2)
+        snapshot = _snapshot()
+        first = cache.set('example.com.', snapshot)
+        self.assertEqual(1, first.version)
+        self.assertIsNone(snapshot.version)
+        second = cache.set('example.com.', _snapshot())
+        self.assertEqual(2, second.version)
+        # the same records, so they're shared with the previous version
+        self.assertIs(first, second._base)
+        self.assertIs(second, cache.get('example.com.').snapshot)
+
+        self.assertIs(first, cache.version('example.com.', 1))
+        self.assertIs(second, cache.version('example.com.', 2))
+        self.assertIsNone(cache.version('example.com.', 3))
+        self.assertIsNone(cache.version('other.com.', 1))
+        # the most recent
+        self.assertIs(second, cache.version('example.com.'))
+        self.assertIsNone(cache.version('other.com.'))
+
+        # only the most recent are retained
+        third = cache.set('example.com.', _snapshot())
+        self.assertEqual(3, third.version)
+        self.assertIsNone(cache.version('example.com.', 1))
+        self.assertIs(second, cache.version('example.com.', 2))
+
+        # invalidating drops the entry, but versions are kept and carry on
+        cache.invalidate('example.com.')
+        self.assertIsNone(cache.get('example.com.'))
+        self.assertIs(third, cache.version('example.com.', 3))
+        self.assertEqual(4, cache.set('example.com.', _snapshot()).version)
+
+        # each zone has its own versions
+        self.assertEqual(1, cache.set('other.com.', _snapshot()).version)
+
+    @patch('octodns_api.cache.getpid')
+    @patch('octodns_api.cache.getrandbits')
+    def test_version_epochs(self, mock_getrandbits, mock_getpid):
+        mock_getpid.return_value = 1
+        mock_getrandbits.side_effect = [3, 5, 7]
+        # two workers, numbering the zone's versions from different epochs
+        first = ZoneCache(ttl=60)
+        second = ZoneCache(ttl=60)
+        self.assertEqual(
+            (3 << 32) + 1, first.set('example.com.', _snapshot()).version
+        )
+        self.assertEqual(
+            (5 << 32) + 1, second.set('example.com.', _snapshot()).version
+        )
+        # so neither finds the other's
+        self.assertIsNone(second.version('example.com.', (3 << 32) + 1))
+        mock_getrandbits.assert_called_with(21)
+
+        # the epoch is kept while the process is
+        self.assertEqual(
+            (3 << 32) + 2, first.set('example.com.', _snapshot()).version
+        )
+        # and picked again in a process forked from it
+        mock_getpid.return_value = 2
+        self.assertEqual(
+            (7 << 32) + 3, first.set('example.com.', _snapshot()).version
+        )
+
+    def test_generations(self):
+        cache = ZoneCache(ttl=60)
+        since = cache.generation('example.com.')
+        self.assertEqual(0, since)
+        # cached, e.g. written through, while we were populating
+        written = cache.set('example.com.', _snapshot(), verified=False)
+        self.assertNotEqual(since, cache.generation('example.com.'))
+        self.assertIsNone(cache.set('example.com.', _snapshot(), since=since))
+        self.assertIs(written, cache.get('example.com.').snapshot)
+
+        # invalidated while we were populating
+        since = cache.generation('example.com.')
+        cache.invalidate('example.com.')
+        self.assertIsNone(cache.set('example.com.', _snapshot(), since=since))
+        self.assertIsNone(cache.get('example.com.'))
+
+        # unchanged
+        since = cache.generation('example.com.')
+        snapshot = cache.set('example.com.', _snapshot(), since=since)
+        self.assertIs(snapshot, cache.get('example.com.').snapshot)
+        # each zone has its own
+        self.assertEqual(0, cache.generation('other.com.'))
+
+    @patch('octodns_api.cache.time')
+    def test_update(self, mock_time):
+        mock_time.return_value = 100
+        self.assertIsNone(ZoneCache().update('example.com.', None))
+
+        store = SqliteZoneStore(':memory:')
+        cache = ZoneCache(ttl=60, store=store)
+        change = MagicMock()
+        # nothing cached, nothing to change
+        self.assertIsNone(cache.update('example.com.', change))
+        change.assert_not_called()
+
+        cache.set('example.com.', _snapshot())
+        change.side_effect = lambda snapshot: snapshot.apply_packed(
+            {('www', 'A'): b'{"ttl":300,"value":"1.2.3.4"}'}
+        )
+        updated = cache.update('example.com.', change)
+        self.assertEqual(2, updated.version)
+        self.assertEqual(3, len(updated))
+        entry = cache.get('example.com.')
+        self.assertIs(updated, entry.snapshot)
+        self.assertFalse(entry.verified)
+        # stored as stale
+        self.assertEqual(0, store.load('example.com.')[1])
+
+        # expired, so the stored copy is dropped instead
+        mock_time.return_value = 1000
+        cache.set('example.com.', _snapshot())
+        mock_time.return_value = 2000
+        self.assertIsNone(cache.update('example.com.', change))
+        self.assertIsNone(store.load('example.com.'))
+
+    @patch('octodns_api.cache.time')
+    def test_store_race(self, mock_time):
+        mock_time.return_value = 100
+        store = SqliteZoneStore(':memory:')
+        store.save('example.com.', _snapshot(), 100)
+        cache = ZoneCache(ttl=60, store=store)
+        loaded = store.load
+
+        def load(zone_name):
+            # populated by someone else while we were loading
+            cache.set(zone_name, _snapshot())
+            return loaded(zone_name)
+
+        with patch.object(store, 'load', side_effect=load):
+            entry = cache.get('example.com.')
+        self.assertTrue(entry.verified)
+        self.assertEqual(1, entry.snapshot.version)
+
+    @patch('octodns_api.cache.time')
+    def test_shared(self, mock_time):
+        mock_time.return_value = 100
+        client = _KeyValue()
+        # two processes sharing a store
+        first = ZoneCache(ttl=60, store=KeyValueZoneStore(client), shared=True)
+        second = ZoneCache(ttl=60, store=KeyValueZoneStore(client), shared=True)
+        self.assertTrue(first.shared)
+        # there's nothing to share without a store
+        self.assertFalse(ZoneCache(ttl=60, shared=True).shared)
+
+        self.assertIsNone(second.get('example.com.'))
+        first.set('example.com.', _snapshot())
+
+        # fetched within the ttl by the first, used as-is
+        mock_time.return_value = 110
+        entry = second.get('example.com.')
+        self.assertTrue(entry.verified)
+        self.assertEqual(100, entry.fetched_at)
+        # versions are per process, shared snapshots don't have one
+        self.assertIsNone(entry.snapshot.version)
+
+        # expired, the first refreshes it and the second picks that up
+        mock_time.return_value = 170
+        self.assertIsNone(second.get('example.com.'))
+        first.set('example.com.', _snapshot())
+        entry = second.get('example.com.')
+        self.assertTrue(entry.verified)
+        self.assertEqual(170, entry.fetched_at)
+        self.assertIsNone(entry.snapshot.version)
+        # only the most recent is retained, specific versions aren't found
+        self.assertIs(entry.snapshot, second.version('example.com.'))
+        self.assertEqual(1, len(second._retained['example.com.']))
+        self.assertIsNone(second.version('example.com.', 1))
+
+        # writes through aren't shared as fresh
+        first.set('example.com.', _snapshot(), verified=False)
+        self.assertEqual(0, first.store.load('example.com.')[1])
+
+        # nothing stored, e.g. invalidated
+        mock_time.return_value = 300
+        first.invalidate('example.com.')
+        self.assertIsNone(second.get('example.com.'))
+
+        # after a restart stale snapshots are restored unverified
+        second = ZoneCache(ttl=60, store=KeyValueZoneStore(client), shared=True)
+        first.set('other.com.', _snapshot())
+        mock_time.return_value = 1000
+        self.assertFalse(second.get('other.com.').verified)
+
+    def test_populating(self):
+        # not shared, the caller always populates
+        cache = ZoneCache(ttl=60)
+        with cache.populating('example.com.') as entry:
+            self.assertIsNone(entry)
+
+        client = _KeyValue()
+        first = ZoneCache(ttl=60, store=KeyValueZoneStore(client), shared=True)
+        second = ZoneCache(ttl=60, store=KeyValueZoneStore(client), shared=True)
+
+        with first.populating('example.com.') as entry:
+            self.assertIsNone(entry)
+            # the lease is held while populating
+            self.assertFalse(
+                second.store.claim('example.com.', second._owner, 30)
+            )
+            first.set('example.com.', _snapshot())
+        # and released after
+        self.assertTrue(second.store.claim('example.com.', second._owner, 30))
+        second.store.release('example.com.', second._owner)
+
+        # populated before the lease was claimed
+        with second.populating('example.com.') as entry:
+            self.assertTrue(entry.verified)
+        self.assertTrue(second.get('example.com.'))
+
+        # errors populating release the lease
+        with self.assertRaises(ValueError):
+            with first.populating('other.com.'):
+                raise ValueError('nope')
+        self.assertTrue(second.store.claim('other.com.', second._owner, 30))
+        second.store.release('other.com.', second._owner)
+
+    @patch('octodns_api.cache.sleep')
+    def test_populating_waits(self, mock_sleep):
+        client = _KeyValue()
+        first = ZoneCache(ttl=60, store=KeyValueZoneStore(client), shared=True)
+        second = ZoneCache(ttl=60, store=KeyValueZoneStore(client), shared=True)
+
+        self.assertTrue(first.store.claim('example.com.', first._owner, 30))
+        sleeps = []
+
+        def sleep(delay):
+            sleeps.append(delay)
+            if len(sleeps) == 3:
+                # the first finishes populating
+                first.set('example.com.', _snapshot())
+
+        mock_sleep.side_effect = sleep
+        with second.populating('example.com.') as entry:
+            self.assertTrue(entry.verified)
+        # backing off
+        self.assertEqual([0.01, 0.02, 0.04], sleeps)
+        # the lease wasn't the second's to release
+        self.assertFalse(second.store.claim('example.com.', second._owner, 30))
+
+        # the first gives up, without populating, the second gets the lease
+        mock_sleep.side_effect = lambda _: first.store.release(
+            'other.com.', first._owner
+        )
+        self.assertTrue(first.store.claim('other.com.', first._owner, 30))
+        with second.populating('other.com.') as entry:
+            self.assertIsNone(entry)
+            self.assertFalse(first.store.claim('other.com.', first._owner, 30))
+
+    @patch('octodns_api.cache.monotonic')
+    @patch('octodns_api.cache.sleep')
+    def test_populating_timeout(self, mock_sleep, mock_monotonic):
+        client = _KeyValue()
+        first = ZoneCache(ttl=60, store=KeyValueZoneStore(client), shared=True)
+        second = ZoneCache(
+            ttl=60, store=KeyValueZoneStore(client), shared=True, lease=5
+        )
+        self.assertTrue(first.store.claim('example.com.', first._owner, 30))
+
+        mock_monotonic.side_effect = [100, 103, 105]
+        # the first never finishes, the second populates without the lease
+        with second.populating('example.com.') as entry:
+            self.assertIsNone(entry)
+        self.assertEqual(2, mock_sleep.call_count)
+        # which is still the first's
+        self.assertFalse(second.store.claim('example.com.', second._owner, 30))
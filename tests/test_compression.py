@@ -0,0 +1,133 @@
+#
+#
+#
+
+from gzip import decompress
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from flask import Flask, jsonify
+
+from octodns_api.compression import Compression, parse_accept_encoding
+
+
+class TestParseAcceptEncoding(TestCase):
+    def test_parse(self):
+        self.assertEqual({}, parse_accept_encoding(None))
+        self.assertEqual({}, parse_accept_encoding(''))
+        self.assertEqual({'gzip': 1.0}, parse_accept_encoding('gzip'))
+        self.assertEqual(
+            {'gzip': 1.0, 'br': 0.5, 'deflate': 0.0, '*': 0.1},
+            parse_accept_encoding(
+                'GZip, br;q=0.5, deflate; Q=0 ,, *;level=1;q=0.1'
+            ),
+        )
+        # garbage q-values are treated as not acceptable
+        self.assertEqual({'br': 0.0}, parse_accept_encoding('br;q=lots'))
+
+
+class TestCompression(TestCase):
+    def test_negotiate(self):
+        compression = Compression()
+        with patch('octodns_api.compression.brotli', None):
+            self.assertEqual(('gzip',), compression.encodings)
+            self.assertIsNone(compression.negotiate(None))
+            self.assertIsNone(compression.negotiate('deflate'))
+            self.assertIsNone(compression.negotiate('gzip;q=0'))
+            self.assertEqual('gzip', compression.negotiate('gzip, br'))
+            self.assertEqual('gzip', compression.negotiate('*'))
+
+        with patch('octodns_api.compression.brotli', MagicMock()):
+            self.assertEqual(('br', 'gzip'), compression.encodings)
+            self.assertEqual('br', compression.negotiate('gzip, br'))
+            self.assertEqual('gzip', compression.negotiate('gzip, br;q=0.5'))
+            self.assertEqual('br', compression.negotiate('*'))
+            self.assertEqual('gzip', compression.negotiate('*, br;q=0'))
+
+    def test_compress(self):
+        compression = Compression(level=9, brotli_quality=11)
+        body = b'{"hello":"world"}' * 100
+        compressed = compression.compress(body, 'gzip')
+        self.assertEqual(body, decompress(compressed))
+        # deterministic
+        self.assertEqual(compressed, compression.compress(body, 'gzip'))
+
+        with patch('octodns_api.compression.brotli') as mock_brotli:
+            mock_brotli.compress.return_value = b'brotli'
+            self.assertEqual(b'brotli', compression.compress(body, 'br'))
+            mock_brotli.compress.assert_called_once_with(body, quality=11)
+
+    def test_response(self):
+        compression = Compression(min_size=100)
+        app = Flask(__name__)
+        with app.app_context():
+            # too small
+            response = compression.response(b'{}', 'gzip', 'application/json')
+            self.assertEqual(b'{}', response.get_data())
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertNotIn('Vary', response.headers)
+
+            body = b'{"hello":"world"}' * 10
+            # not accepted
+            response = compression.response(body, None, 'application/json')
+            self.assertEqual(body, response.get_data())
+            self.assertEqual('application/json', response.mimetype)
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual('Accept-Encoding', response.headers['Vary'])
+
+            cache = {}
+            response = compression.response(
+                body, 'gzip', 'application/json', cache=cache
+            )
+            self.assertEqual('gzip', response.headers['Content-Encoding'])
+            self.assertEqual(body, decompress(response.get_data()))
+            self.assertEqual(['gzip'], list(cache.keys()))
+
+            # subsequent responses use what's in the cache
+            cache['gzip'] = b'cached'
+            response = compression.response(
+                body, 'gzip', 'application/json', cache=cache
+            )
+            self.assertEqual(b'cached', response.get_data())
+
+    def test_after_request(self):
+        compression = Compression(min_size=100)
+        app = Flask(__name__)
+        app.after_request(compression.after_request)
+
+        @app.route('/big')
+        def big():
+            return jsonify({'hello': 'world' * 100})
+
+        @app.route('/small')
+        def small():
+            return jsonify({'hello': 'world'})
+
+        @app.route('/streamed')
+        def streamed():
+            return app.response_class((b'x' * 100 for _ in range(3)))
+
+        client = app.test_client()
+        headers = {'Accept-Encoding': 'gzip'}
+
+        response = client.get('/big', headers=headers)
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertIn(b'worldworld', decompress(response.get_data()))
+
+        response = client.get('/big')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+
+        response = client.get('/small', headers=headers)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+        response = client.get('/streamed', headers=headers)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(b'x' * 300, response.get_data())
+
+        # already encoded responses are left alone
+        with app.test_request_context(headers=headers):
+            response = compression.response(
+                b'x' * 200, 'gzip', 'application/json'
+            )
+            self.assertIs(response, compression.after_request(response))
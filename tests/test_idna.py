@@ -0,0 +1,40 @@
+#
+#
+#
+
+from unittest import TestCase
+
+from octodns.idna import IdnaError
+
+from octodns_api.idna import idna_decode, idna_encode, zone_name
+
+
+class TestIdna(TestCase):
+    def test_decode_encode(self):
+        self.assertEqual('café.com.', idna_decode('xn--caf-dma.com.'))
+        self.assertEqual('café.com.', idna_decode('CAFÉ.com.'))
+        self.assertEqual('xn--caf-dma.com.', idna_encode('café.com.'))
+        self.assertEqual('www', idna_decode('WWW'))
+        self.assertEqual('', idna_decode(''))
+
+    def test_memoized(self):
+        idna_decode.cache_clear()
+        idna_decode('xn--e1aybc')
+        idna_decode('xn--e1aybc')
+        info = idna_decode.cache_info()
+        self.assertEqual(1, info.misses)
+        self.assertEqual(1, info.hits)
+        # bounded
+        self.assertTrue(info.maxsize)
+
+    def test_zone_name(self):
+        self.assertEqual('example.com.', zone_name('example.com'))
+        self.assertEqual('example.com.', zone_name('Example.com.'))
+        self.assertEqual('café.com.', zone_name('xn--caf-dma.com'))
+        self.assertEqual('café.com.', zone_name('café.com.'))
+
+    def test_errors(self):
+        # errors aren't cached, they're raised every time
+        for _ in range(2):
+            with self.assertRaises(IdnaError):
+                idna_decode('xn--a.com.')
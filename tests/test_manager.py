@@ -2,17 +2,37 @@
 #
 #
 
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from tempfile import NamedTemporaryFile
+from io import StringIO
+from shutil import rmtree
+from tempfile import NamedTemporaryFile, mkdtemp
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 
 from octodns.manager import ManagerException
+from octodns.provider.plan import Plan, UnsafePlan
+from octodns.record import Delete, Record
+from octodns.zone import Zone
 
-from octodns_api.manager import ApiManager, ApiManagerException
+from octodns_api.cache import KeyValueZoneStore
+from octodns_api.manager import (
+    ApiManager,
+    ApiManagerException,
+    StalePlanException,
+)
+from octodns_api.planning import build_zone
+from octodns_api.snapshot import ZoneSnapshot
 
 
 class TestApiManager(TestCase):
+    def setUp(self):
+        # versions are offset by a random epoch, zero it so that they're
+        # predictable
+        patcher = patch('octodns_api.cache.getrandbits', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @contextmanager
     def _get_config_file(self, config_content=None):
         if config_content is None:
@@ -58,6 +78,42 @@ zones:
             args = mock_populate.call_args[0]
             self.assertEqual(args[0].name, 'example.com.')
 
+    def test_connection_pools(self):
+        with self._get_config_file() as config_file:
+            manager = ApiManager(config_file)
+        self.assertEqual(10, manager.pools.pool_maxsize)
+        self.assertIsNone(manager.pools.keep_alive)
+
+        with self._get_config_file(
+            '''
+api:
+  connection_pools:
+    pool_maxsize: 32
+    keep_alive: 30
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+
+zones: {}
+'''
+        ) as config_file:
+            manager = ApiManager(config_file)
+        self.assertEqual(32, manager.pools.pool_maxsize)
+        self.assertEqual(30, manager.pools.keep_alive)
+
+    def test_zone_name(self):
+        with self._get_config_file() as config_file:
+            manager = ApiManager(config_file)
+
+        # names are canonicalized, decoded, lowercased, and w/a trailing dot
+        self.assertEqual('example.com.', manager._zone_name('example.com'))
+        self.assertEqual('example.com.', manager._zone_name('EXAMPLE.com.'))
+        with self.assertRaises(ApiManagerException) as ctx:
+            manager._zone_name('xn--caf-dma.com')
+        self.assertEqual('Zone café.com. not configured', str(ctx.exception))
+
     def test_get_zone_not_configured(self):
         with self._get_config_file() as config_file:
             manager = ApiManager(config_file)
@@ -193,11 +249,11 @@ zones:
         with self._get_config_file(config_content) as config_file:
             manager = ApiManager(config_file)
 
-        # Mock get_zone to return a zone with no matching record
-        with patch.object(manager, 'get_zone') as mock_get_zone:
+        # Mock the populated zone, one with no matching record
+        with patch.object(manager, '_populate_fresh') as mock_get_zone:
             mock_zone = MagicMock()
             mock_zone.name = 'example.com.'
-            mock_zone.records = []
+            mock_zone.get_type.return_value = None
             mock_get_zone.return_value = mock_zone
 
             result = manager.delete_record('example.com.', 'test', 'A')
@@ -231,9 +287,10 @@ zones:
             manager = ApiManager(config_file)
 
         # Mock to test without trailing dot handling
-        with patch.object(manager, 'get_zone') as mock_get_zone:
+        with patch.object(manager, '_populate_fresh') as mock_get_zone:
             mock_zone = MagicMock()
             mock_zone.name = 'example.com.'
+            mock_zone.get_type.return_value = None
             mock_get_zone.return_value = mock_zone
 
             with patch.object(
@@ -255,10 +312,10 @@ zones:
             manager = ApiManager(config_file)
 
         # Mock to test without trailing dot handling
-        with patch.object(manager, 'get_zone') as mock_get_zone:
+        with patch.object(manager, '_populate_fresh') as mock_get_zone:
             mock_zone = MagicMock()
             mock_zone.name = 'example.com.'
-            mock_zone.records = []
+            mock_zone.get_type.return_value = None
             mock_get_zone.return_value = mock_zone
 
             result = manager.delete_record('example.com', 'test', 'A')
@@ -268,22 +325,26 @@ zones:
         with self._get_config_file() as config_file:
             manager = ApiManager(config_file)
 
-        with patch.object(manager.manager, 'sync') as mock_sync:
-            mock_sync.return_value = 0
+        provider = manager.manager.providers['yaml']
+        with patch.object(provider, 'populate') as mock_populate:
+            mock_populate.return_value = False
 
             result = manager.sync_zone('example.com', dry_run=True)
 
             self.assertEqual(result['zone'], 'example.com.')
             self.assertTrue(result['dry_run'])
+            # nothing to do, nothing to keep
+            self.assertIsNone(result['plan_id'])
 
     def test_create_or_update_record_with_plan(self):
         with self._get_config_file() as config_file:
             manager = ApiManager(config_file)
 
         # Mock to test when plan returns changes
-        with patch.object(manager, 'get_zone') as mock_get_zone:
+        with patch.object(manager, '_populate_fresh') as mock_get_zone:
             mock_zone = MagicMock()
             mock_zone.name = 'example.com.'
+            mock_zone.get_type.return_value = None
             mock_get_zone.return_value = mock_zone
 
             with patch.object(
@@ -309,13 +370,10 @@ zones:
             manager = ApiManager(config_file)
 
         # Mock to test when plan returns changes
-        with patch.object(manager, 'get_zone') as mock_get_zone:
+        with patch.object(manager, '_populate_fresh') as mock_get_zone:
             mock_zone = MagicMock()
             mock_zone.name = 'example.com.'
-            mock_record = MagicMock()
-            mock_record.decoded_name = 'test'
-            mock_record._type = 'A'
-            mock_zone.records = [mock_record]
+            mock_zone.get_type.return_value = MagicMock()
             mock_get_zone.return_value = mock_zone
 
             with patch.object(
@@ -349,14 +407,11 @@ zones:
         with self._get_config_file(config_content) as config_file:
             manager = ApiManager(config_file)
 
-        # Mock get_zone to return a zone with a record
-        with patch.object(manager, 'get_zone') as mock_get_zone:
+        # Mock the populated zone, one with a record
+        with patch.object(manager, '_populate_fresh') as mock_get_zone:
             mock_zone = MagicMock()
             mock_zone.name = 'example.com.'
-            mock_record = MagicMock()
-            mock_record.decoded_name = 'test'
-            mock_record._type = 'A'
-            mock_zone.records = [mock_record]
+            mock_zone.get_type.return_value = MagicMock()
             mock_get_zone.return_value = mock_zone
 
             with self.assertRaises(ApiManagerException) as cm:
@@ -369,13 +424,10 @@ zones:
             manager = ApiManager(config_file)
 
         # Mock to test when plan returns None (no changes)
-        with patch.object(manager, 'get_zone') as mock_get_zone:
+        with patch.object(manager, '_populate_fresh') as mock_get_zone:
             mock_zone = MagicMock()
             mock_zone.name = 'example.com.'
-            mock_record = MagicMock()
-            mock_record.decoded_name = 'test'
-            mock_record._type = 'A'
-            mock_zone.records = [mock_record]
+            mock_zone.get_type.return_value = MagicMock()
             mock_get_zone.return_value = mock_zone
 
             with patch.object(
@@ -490,3 +542,1185 @@ zones:
         # Zones without targets should remain unchanged
         self.assertEqual(result['zones']['example.com.']['sources'], ['yaml'])
         self.assertNotIn('sources', result['zones']['no-targets.com.'])
+
+    def test_get_zone_cached(self):
+        config_content = '''
+api:
+  cache:
+    ttl: 60
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+'''
+        with self._get_config_file(config_content) as config_file:
+            manager = ApiManager(config_file)
+        self.assertTrue(manager.cache.enabled)
+        self.assertIsNone(manager.cache.store)
+
+        def populate(zone, *args, **kwargs):
+            zone.add_record(
+                Record.new(
+                    zone, 'www', {'type': 'A', 'ttl': 30, 'value': '1.2.3.4'}
+                )
+            )
+
+        provider = manager.manager.providers['yaml']
+        with patch.object(provider, 'populate') as mock_populate:
+            mock_populate.side_effect = populate
+            zone = manager.get_zone('example.com')
+            self.assertEqual(['www'], [r.name for r in zone.records])
+            mock_populate.assert_called_once()
+
+            # subsequent reads come from the cached snapshot
+            zone = manager.get_zone('example.com.')
+            self.assertEqual(['www'], [r.name for r in zone.records])
+            # which is only rebuilt into a zone once
+            other = manager.get_zone('example.com.')
+            self.assertIs(zone._base, other._base)
+            # changes to one of the zones don't show up in the others
+            zone.remove_record(zone.get_type('www', 'A'))
+            self.assertEqual([], list(zone.records))
+            self.assertEqual(['www'], [r.name for r in other.records])
+            snapshot = manager.get_snapshot('example.com.')
+            self.assertEqual(
+                [('www', 'A', {'ttl': 30, 'value': '1.2.3.4'})],
+                list(snapshot.records()),
+            )
+            record = manager.get_record('example.com.', 'www', 'A')
+            self.assertEqual('1.2.3.4', record.values[0])
+            self.assertIsNone(manager.get_record('example.com.', 'www', 'AAAA'))
+            mock_populate.assert_called_once()
+
+            # writes are written through to the cached copy
+            with patch.object(provider, 'plan') as mock_plan, patch.object(
+                provider, 'apply'
+            ):
+                mock_plan.return_value = MagicMock()
+                manager.create_or_update_record(
+                    'example.com.', 'test', 'A', {'ttl': 30, 'value': '1.2.3.4'}
+                )
+            # planned against a freshly populated zone, not the cached copy
+            self.assertEqual(2, mock_populate.call_count)
+            entry = manager.cache.get('example.com.')
+            self.assertFalse(entry.verified)
+
+        with patch.object(manager.manager, 'sync') as mock_sync:
+            mock_sync.return_value = 0
+            self.assertTrue(manager.cache.get('example.com.'))
+            manager.sync_zone('example.com.', dry_run=False)
+            self.assertIsNone(manager.cache.get('example.com.'))
+
+    def test_versions(self):
+        config_content = '''
+api:
+  cache:
+    ttl: 60
+    versions: 3
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+'''
+        with self._get_config_file(config_content) as config_file:
+            manager = ApiManager(config_file)
+        self.assertEqual(3, manager.cache.versions)
+
+        values = ['1.2.3.4']
+
+        def populate(zone, *args, **kwargs):
+            zone.add_record(
+                Record.new(
+                    zone, 'www', {'type': 'A', 'ttl': 30, 'value': values[0]}
+                )
+            )
+
+        provider = manager.manager.providers['yaml']
+        with patch.object(provider, 'populate') as mock_populate:
+            mock_populate.side_effect = populate
+            self.assertEqual(1, manager.get_snapshot('example.com.').version)
+
+            values[0] = '2.3.4.5'
+            manager.cache.invalidate('example.com.')
+            self.assertEqual(2, manager.get_snapshot('example.com').version)
+            self.assertEqual(2, mock_populate.call_count)
+
+            # earlier versions are read without going to the provider
+            record = manager.get_record('example.com.', 'www', 'A', version=1)
+            self.assertEqual('1.2.3.4', record.values[0])
+            zone = manager.get_zone('example.com.', version=1)
+            self.assertEqual('1.2.3.4', zone.records.pop().values[0])
+            snapshot, found, misses = manager.lookup_records(
+                'example.com.', [('www', 'A'), ('www', 'AAAA')], version=2
+            )
+            self.assertEqual(2, snapshot.version)
+            self.assertEqual(
+                [('www', 'A', {'ttl': 30, 'value': '2.3.4.5'})], found
+            )
+            self.assertEqual([('www', 'AAAA')], misses)
+            version, chunks = manager.export_zone(
+                'example.com.', 'bind', version=1
+            )
+            self.assertEqual(1, version)
+            self.assertIn('1.2.3.4', ''.join(chunks))
+            self.assertEqual(2, mock_populate.call_count)
+
+            with self.assertRaises(ApiManagerException) as ctx:
+                manager.get_snapshot('example.com.', version=3)
+            self.assertEqual(
+                'Version 3 of zone example.com. not available',
+                str(ctx.exception),
+            )
+
+            before, after, changes = manager.diff_zone('example.com', 1)
+            self.assertEqual((1, 2), (before.version, after.version))
+            self.assertEqual(
+                [
+                    (
+                        'www',
+                        'A',
+                        {'ttl': 30, 'value': '1.2.3.4'},
+                        {'ttl': 30, 'value': '2.3.4.5'},
+                    )
+                ],
+                changes,
+            )
+            _, _, changes = manager.diff_zone('example.com.', 2, 1)
+            self.assertEqual('2.3.4.5', changes[0][2]['value'])
+            self.assertEqual([], manager.diff_zone('example.com.', 1, 1)[2])
+            with self.assertRaises(ApiManagerException):
+                manager.diff_zone('example.com.', 1, 3)
+            # the provider is never consulted
+            self.assertEqual(2, mock_populate.call_count)
+
+        manager.cache.invalidate('example.com.')
+        manager.cache._retained.clear()
+        with self.assertRaises(ApiManagerException) as ctx:
+            manager.diff_zone('example.com.', 1)
+        self.assertEqual(
+            'Version 1 of zone example.com. not available', str(ctx.exception)
+        )
+        with self.assertRaises(ApiManagerException) as ctx:
+            manager._version('example.com.')
+        self.assertEqual(
+            'No versions of zone example.com. available', str(ctx.exception)
+        )
+
+    def test_write_through(self):
+        config_content = '''
+api:
+  cache:
+    ttl: 60
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+  other:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+      - other
+'''
+        with self._get_config_file(config_content) as config_file:
+            manager = ApiManager(config_file)
+
+        records = {
+            'www': {'type': 'A', 'ttl': 30, 'value': '1.2.3.4'},
+            'mail': {'type': 'A', 'ttl': 30, 'value': '2.3.4.5'},
+        }
+
+        def populate(zone, *args, **kwargs):
+            # what the providers have, writes to them are mocked out below
+            for name, data in records.items():
+                zone.add_record(Record.new(zone, name, data))
+            return True
+
+        yaml = manager.manager.providers['yaml']
+        other = manager.manager.providers['other']
+        with patch.object(
+            yaml, 'populate', side_effect=populate
+        ) as yaml_populate, patch.object(
+            other, 'populate', side_effect=populate
+        ), patch.object(
+            yaml, 'apply'
+        ) as yaml_apply, patch.object(
+            other, 'apply'
+        ) as other_apply, patch.object(
+            manager, '_schedule_refresh'
+        ) as schedule_refresh:
+            before = manager.get_snapshot('example.com.')
+            self.assertEqual(1, yaml_populate.call_count)
+
+            # an update
+            record, changed = manager.create_or_update_record(
+                'example.com.', 'www', 'A', {'ttl': 30, 'value': '9.9.9.9'}
+            )
+            self.assertTrue(changed)
+            yaml_apply.assert_called_once()
+            # the write plans against a freshly populated zone, and the
+            # target's plan populates it once more
+            self.assertEqual(3, yaml_populate.call_count)
+
+            # reads see the change w/o going back to the provider, but it'll
+            # be verified in the background
+            snapshot = manager.get_snapshot('example.com.')
+            self.assertEqual(
+                {'ttl': 30, 'value': '9.9.9.9'}, snapshot.get('www', 'A')
+            )
+            self.assertEqual(3, yaml_populate.call_count)
+            schedule_refresh.assert_called_once_with('example.com.')
+            self.assertFalse(manager.cache.get('example.com.').verified)
+            # the previous snapshot is untouched
+            self.assertEqual(
+                {'ttl': 30, 'value': '1.2.3.4'}, before.get('www', 'A')
+            )
+
+            # a delete, applied to both targets, the cache reflects the
+            # first, which is what it's populated from
+            self.assertTrue(manager.delete_record('example.com.', 'mail', 'A'))
+            self.assertEqual(2, yaml_apply.call_count)
+            other_apply.assert_called_once()
+            snapshot = manager.get_snapshot('example.com.')
+            self.assertIsNone(snapshot.get('mail', 'A'))
+            self.assertEqual(
+                [('www', 'A')], [(n, t) for n, t, _ in snapshot.records()]
+            )
+
+            # a refresh that was populating when a write was made doesn't
+            # replace what the write cached
+            def racing_populate(zone, *args, **kwargs):
+                populate(zone)
+                yaml_populate.side_effect = populate
+                manager.create_or_update_record(
+                    'example.com.', 'new', 'A', {'ttl': 30, 'value': '3.3.3.3'}
+                )
+                return True
+
+            yaml_populate.side_effect = racing_populate
+            manager._refresh('example.com.')
+            entry = manager.cache.get('example.com.')
+            self.assertFalse(entry.verified)
+            self.assertEqual(
+                {'ttl': 30, 'value': '3.3.3.3'}, entry.snapshot.get('new', 'A')
+            )
+
+    def test_writes_plan_against_provider(self):
+        tmpdir = mkdtemp()
+        with open(f'{tmpdir}/example.com.yaml', 'w') as fh:
+            fh.write("---\n'':\n  type: A\n  value: 1.1.1.1\n")
+        config_content = f'''
+api:
+  cache:
+    ttl: 300
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: {tmpdir}
+    supports_root_ns: false
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+'''
+
+        def names(manager):
+            zone = manager._populate_zone('example.com.')
+            return sorted(r.name for r in zone.records)
+
+        try:
+            with self._get_config_file(config_content) as config_file:
+                # two workers, both with the zone cached
+                first = ApiManager(config_file)
+                second = ApiManager(config_file)
+            first.get_zone('example.com.')
+            second.get_zone('example.com.')
+
+            data = {'ttl': 60, 'value': '2.2.2.2'}
+            self.assertTrue(
+                first.create_or_update_record('example.com.', 'x', 'A', data)[1]
+            )
+            # the second's cached copy doesn't have x, its write mustn't
+            # remove it
+            self.assertTrue(
+                second.create_or_update_record(
+                    'example.com.', 'y', 'A', dict(data)
+                )[1]
+            )
+            self.assertEqual(['', 'x', 'y'], names(first))
+            self.assertTrue(second.delete_record('example.com.', 'x', 'A'))
+            self.assertEqual(['', 'y'], names(first))
+
+            def value(manager):
+                zone = manager._populate_zone('example.com.')
+                return zone.get_type('y', 'A').values[0]
+
+            # the second writes y, the first's cached copy still has the old
+            # value, writing that back isn't a no-op, it's planned and applied.
+            # its copy is freshly populated, rather than written through and
+            # unverified, so that no refresh races the second's write
+            first.cache.invalidate('example.com.')
+            first.get_zone('example.com.')
+            data = {'ttl': 60, 'value': '9.9.9.9'}
+            self.assertTrue(
+                second.create_or_update_record('example.com.', 'y', 'A', data)[
+                    1
+                ]
+            )
+            self.assertEqual('9.9.9.9', value(first))
+            self.assertEqual(
+                '2.2.2.2', first.get_record('example.com.', 'y', 'A').values[0]
+            )
+            data = {'ttl': 60, 'value': '2.2.2.2'}
+            record, changed = first.create_or_update_record(
+                'example.com.', 'y', 'A', dict(data)
+            )
+            self.assertTrue(changed)
+            self.assertEqual('2.2.2.2', value(second))
+            # while writing what the provider already has is
+            self.assertFalse(
+                second.create_or_update_record('example.com.', 'y', 'A', data)[
+                    1
+                ]
+            )
+
+            # concurrent writes in a process are made one at a time, none of
+            # them are lost
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                for future in [
+                    executor.submit(
+                        first.create_or_update_record,
+                        'example.com.',
+                        f'c{i}',
+                        'A',
+                        dict(data),
+                    )
+                    for i in range(8)
+                ]:
+                    self.assertTrue(future.result()[1])
+            self.assertEqual(
+                ['', 'c0', 'c1', 'c2', 'c3', 'c4', 'c5', 'c6', 'c7', 'y'],
+                names(first),
+            )
+        finally:
+            rmtree(tmpdir)
+
+    def test_create_or_update_unchanged(self):
+        def populate(zone, *args, **kwargs):
+            zone.add_record(
+                Record.new(
+                    zone,
+                    'www',
+                    {
+                        'type': 'A',
+                        'ttl': 30,
+                        'values': ['1.2.3.4', '2.3.4.5'],
+                        'octodns': {'healthcheck': {'path': '/_ok'}},
+                    },
+                )
+            )
+            return True
+
+        for config_content in (
+            None,
+            '''
+api:
+  cache:
+    ttl: 60
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+''',
+        ):
+            with self._get_config_file(config_content) as config_file:
+                manager = ApiManager(config_file)
+            provider = manager.manager.providers['yaml']
+            with patch.object(
+                provider, 'populate', side_effect=populate
+            ), patch.object(provider, 'plan') as mock_plan:
+                mock_plan.return_value = None
+
+                # the same record, values in a different order, is a no-op
+                # w/o planning
+                record, changed = manager.create_or_update_record(
+                    'example.com.',
+                    'www',
+                    'A',
+                    {
+                        'ttl': 30,
+                        'values': ['2.3.4.5', '1.2.3.4'],
+                        'octodns': {'healthcheck': {'path': '/_ok'}},
+                    },
+                )
+                self.assertFalse(changed)
+                self.assertEqual(['1.2.3.4', '2.3.4.5'], record.values)
+                mock_plan.assert_not_called()
+
+                # changes to values, ttl, or octodns settings are planned
+                for data in (
+                    {'ttl': 30, 'values': ['1.2.3.4']},
+                    {'ttl': 60, 'values': ['1.2.3.4', '2.3.4.5']},
+                    {'ttl': 30, 'values': ['1.2.3.4', '2.3.4.5']},
+                ):
+                    mock_plan.reset_mock()
+                    manager.create_or_update_record(
+                        'example.com.', 'www', 'A', data
+                    )
+                    mock_plan.assert_called_once()
+
+                # as are new records
+                mock_plan.reset_mock()
+                manager.create_or_update_record(
+                    'example.com.', 'new', 'A', {'ttl': 30, 'value': '1.2.3.4'}
+                )
+                mock_plan.assert_called_once()
+
+    def test_get_zone_restored_from_store(self):
+        tmpdir = mkdtemp()
+        config_content = f'''
+api:
+  cache:
+    ttl: 60
+    path: {tmpdir}/snapshots.db
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+'''
+        try:
+            with self._get_config_file(config_content) as config_file:
+                manager = ApiManager(config_file)
+                zone = Zone('example.com.', [])
+                zone.add_record(
+                    Record.new(
+                        zone,
+                        'www',
+                        {'type': 'A', 'ttl': 30, 'value': '1.2.3.4'},
+                    )
+                )
+                manager.cache.set('example.com.', ZoneSnapshot.from_zone(zone))
+
+                # a fresh manager, i.e. after a restart
+                manager = ApiManager(config_file)
+
+            provider = manager.manager.providers['yaml']
+            with patch.object(provider, 'populate') as mock_populate:
+                with patch.object(manager, '_schedule_refresh') as mock_refresh:
+                    restored = manager.get_zone('example.com.')
+                    self.assertEqual(
+                        ['www'], [r.name for r in restored.records]
+                    )
+                    # served without going to the provider
+                    mock_populate.assert_not_called()
+                    mock_refresh.assert_called_once_with('example.com.')
+
+                # the background refresh replaces the restored entry
+                future = manager._schedule_refresh('example.com.')
+                # a second request while it's pending is a noop
+                self.assertIsNone(manager._schedule_refresh('example.com.'))
+                future.result()
+                mock_populate.assert_called_once()
+                entry = manager.cache.get('example.com.')
+                self.assertTrue(entry.verified)
+                self.assertEqual(0, len(entry.snapshot))
+
+                # failures are logged and leave things as they were
+                mock_populate.side_effect = Exception('boom')
+                manager.cache._entries['example.com.'].verified = False
+                manager._schedule_refresh('example.com.').result()
+                self.assertFalse(manager.cache.get('example.com.').verified)
+                self.assertEqual(set(), manager._refreshing)
+        finally:
+            rmtree(tmpdir)
+
+    @patch('octodns_api.cache.sleep')
+    def test_shared_cache(self, mock_sleep):
+        tmpdir = mkdtemp()
+        config_content = f'''
+api:
+  cache:
+    ttl: 60
+    path: {tmpdir}/snapshots.db
+    shared: true
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+'''
+
+        def populate(zone, *args, **kwargs):
+            zone.add_record(
+                Record.new(
+                    zone, 'www', {'type': 'A', 'ttl': 30, 'value': '1.2.3.4'}
+                )
+            )
+
+        try:
+            with self._get_config_file(config_content) as config_file:
+                # two workers on a host
+                first = ApiManager(config_file)
+                second = ApiManager(config_file)
+            self.assertTrue(first.cache.shared)
+
+            with patch.object(
+                first.manager.providers['yaml'], 'populate'
+            ) as mock_first, patch.object(
+                second.manager.providers['yaml'], 'populate'
+            ) as mock_second:
+                mock_first.side_effect = populate
+
+                # the first is populating the zone when the second needs it
+                first.cache.store.claim('example.com.', first.cache._owner, 30)
+                mock_sleep.side_effect = lambda _: first.get_snapshot(
+                    'example.com.'
+                )
+                snapshot = second.get_snapshot('example.com.')
+                self.assertEqual(1, len(snapshot))
+                mock_first.assert_called_once()
+                mock_second.assert_not_called()
+
+                # refreshes use what another worker has fetched since
+                second.cache._entries['example.com.'].verified = False
+                second._schedule_refresh('example.com.').result()
+                self.assertTrue(second.cache.get('example.com.').verified)
+                mock_second.assert_not_called()
+
+                # versions are per process so they can't be read when shared
+                self.assertIsNone(snapshot.version)
+                with self.assertRaises(ApiManagerException) as ctx:
+                    second.get_snapshot('example.com.', version=1)
+                self.assertEqual(
+                    'Versions of zone example.com. are not available when '
+                    'the cache is shared',
+                    str(ctx.exception),
+                )
+                with self.assertRaises(ApiManagerException):
+                    second.diff_zone('example.com.', 1)
+        finally:
+            rmtree(tmpdir)
+
+        config_content = '''
+api:
+  cache:
+    ttl: 60
+    url: redis://cache:6379/0
+    shared: true
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+
+zones: {}
+'''
+        redis = MagicMock()
+        with self._get_config_file(config_content) as config_file, patch.dict(
+            'sys.modules', {'redis': redis}
+        ):
+            manager = ApiManager(config_file)
+        self.assertIsInstance(manager.cache.store, KeyValueZoneStore)
+        self.assertEqual('octodns-api', manager.cache.store.prefix)
+        redis.Redis.from_url.assert_called_once_with('redis://cache:6379/0')
+
+    def test_import_export_zone(self):
+        tmpdir = mkdtemp()
+        config_content = f'''
+api:
+  cache:
+    ttl: 60
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: {tmpdir}/yaml
+  other:
+    class: octodns.provider.yaml.YamlProvider
+    directory: {tmpdir}/other
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+      - other
+'''
+        try:
+            with self._get_config_file(config_content) as config_file:
+                manager = ApiManager(config_file)
+
+            result = manager.import_zone(
+                'example.com',
+                StringIO(
+                    '''
+www:
+  type: A
+  value: 1.2.3.4
+'':
+  - type: A
+    values:
+      - 2.3.4.5
+  - type: TXT
+    value: hello
+'''
+                ),
+            )
+            self.assertEqual(
+                {
+                    'zone': 'example.com.',
+                    'targets': [
+                        {
+                            'target': 'yaml',
+                            'creates': 3,
+                            'updates': 0,
+                            'deletes': 0,
+                            'applied': True,
+                        },
+                        {
+                            'target': 'other',
+                            'creates': 3,
+                            'updates': 0,
+                            'deletes': 0,
+                            'applied': True,
+                        },
+                    ],
+                },
+                result,
+            )
+            self.assertEqual(3, len(manager.get_zone('example.com.').records))
+            other = Zone('example.com.', [])
+            manager.manager.providers['other'].populate(other)
+            self.assertEqual(3, len(other.records))
+
+            # exporting it gives back what was imported, with ttls
+            version, chunks = manager.export_zone('example.com.', 'yaml')
+            self.assertEqual(1, version)
+            exported = ''.join(chunks)
+            self.assertIn('ttl: 3600', exported)
+
+            # importing the export again is a no-op
+            result = manager.import_zone(
+                'example.com.', StringIO(exported), 'yaml'
+            )
+            self.assertEqual(
+                [False, False], [t['applied'] for t in result['targets']]
+            )
+
+            # bind replaces everything, an update and a delete
+            result = manager.import_zone(
+                'example.com.',
+                StringIO(
+                    'example.com. 3600 IN A 2.3.4.5\n'
+                    'www.example.com. 60 IN A 1.2.3.4\n'
+                ),
+                'bind',
+            )
+            self.assertEqual(
+                {
+                    'target': 'yaml',
+                    'creates': 0,
+                    'updates': 1,
+                    'deletes': 1,
+                    'applied': True,
+                },
+                result['targets'][0],
+            )
+            snapshot = manager.get_snapshot('example.com.')
+            self.assertEqual(
+                {'ttl': 60, 'value': '1.2.3.4'}, snapshot.get('www', 'A')
+            )
+            self.assertIsNone(snapshot.get('', 'TXT'))
+        finally:
+            rmtree(tmpdir)
+
+    def test_replace_zone_unsafe(self):
+        with self._get_config_file() as config_file:
+            manager = ApiManager(config_file)
+
+        desired = Zone('example.com.', [])
+        plan = MagicMock()
+        plan.raise_if_unsafe.side_effect = UnsafePlan('Too many deletes')
+        provider = manager.manager.providers['yaml']
+        with patch.object(provider, 'plan') as mock_plan, patch.object(
+            provider, 'apply'
+        ) as mock_apply:
+            mock_plan.return_value = plan
+            with self.assertRaises(UnsafePlan):
+                manager.replace_zone('example.com.', desired)
+            mock_apply.assert_not_called()
+
+            # forced
+            plan.changes = [MagicMock(spec=Delete)] * 2
+            result = manager.replace_zone('example.com.', desired, force=True)
+            mock_apply.assert_called_once_with(plan)
+            self.assertEqual(2, result['targets'][0]['deletes'])
+
+    def test_planning_offload(self):
+        config_content = '''
+api:
+  cache:
+    ttl: 60
+  planning:
+    processes: 1
+    min_records: 2
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+'''
+        with self._get_config_file(config_content) as config_file:
+            manager = ApiManager(config_file)
+        self.assertEqual(config_file, manager.planning.config_file)
+        self.assertEqual(2, manager.planning.min_records)
+
+        provider = manager.manager.providers['yaml']
+        summary = {
+            'target': 'yaml',
+            'creates': 1,
+            'updates': 0,
+            'deletes': 0,
+            'applied': True,
+        }
+        www = {'A': {'ttl': 30, 'value': '1.2.3.4'}}
+        with patch.object(provider, 'plan') as mock_plan, patch.object(
+            manager.planning, 'replace_zone'
+        ) as mock_replace:
+            # small zones are planned in-process
+            mock_plan.return_value = None
+            manager.replace_records('example.com.', {'www': www})
+            mock_plan.assert_called_once()
+            mock_replace.assert_not_called()
+
+            # large ones in a worker
+            mock_replace.return_value = ([summary], None)
+            result = manager.replace_records(
+                'example.com.', {'www': www, 'mail': www}, force=True
+            )
+            self.assertEqual(
+                {'zone': 'example.com.', 'targets': [summary]}, result
+            )
+            mock_plan.assert_called_once()
+            # the records are sent as-is, to be built and validated there
+            self.assertEqual(
+                (
+                    'example.com.',
+                    ['yaml'],
+                    'records',
+                    {'www': www, 'mail': www},
+                ),
+                mock_replace.call_args[0],
+            )
+            self.assertEqual({'force': True}, mock_replace.call_args[1])
+
+            # as are zone files, whose size isn't known until they're parsed
+            result = manager.import_zone(
+                'example.com.', StringIO('www: [\n'), 'yaml'
+            )
+            self.assertEqual(
+                {'zone': 'example.com.', 'targets': [summary]}, result
+            )
+            self.assertEqual(
+                ('example.com.', ['yaml'], 'zonefile', ('www: [\n', 'yaml')),
+                mock_replace.call_args[0],
+            )
+            mock_plan.assert_called_once()
+
+            # zones that are already built are sent as a packed snapshot
+            desired = build_zone('example.com.', {'www': www, 'mail': www})
+            manager.replace_zone('example.com.', desired)
+            zone_name, target_names, kind, packed = mock_replace.call_args[0]
+            self.assertEqual('snapshot', kind)
+            snapshot = ZoneSnapshot.unpack('example.com.', packed)
+            self.assertEqual(2, len(snapshot))
+
+            # a zone that's currently large is too, and the cached copy is
+            # updated with the changes the worker applied
+            manager.cache.set('example.com.', snapshot)
+            mock_replace.return_value = (
+                [summary],
+                {('mail', 'A'): None, ('new', 'A'): b'{"ttl":30,"value":"5"}'},
+            )
+            manager.replace_records('example.com.', {'www': www})
+            mock_plan.assert_called_once()
+            entry = manager.cache.get('example.com.')
+            self.assertFalse(entry.verified)
+            self.assertEqual(
+                [('new', 'A'), ('www', 'A')],
+                sorted(key for key, _ in entry.snapshot.packed()),
+            )
+
+        with patch.object(manager.manager, 'sync') as mock_sync, patch.object(
+            manager.planning, 'sync_zone'
+        ) as mock_sync_zone:
+            # the cached copy is large
+            mock_sync_zone.return_value = 3
+            result = manager.sync_zone('example.com.', dry_run=False)
+            self.assertEqual(3, result['result'])
+            mock_sync_zone.assert_called_once_with('example.com.', False)
+
+            # the size isn't known
+            manager.cache._retained.clear()
+            manager.sync_zone('example.com.', dry_run=False)
+            self.assertEqual(2, mock_sync_zone.call_count)
+
+            # small
+            manager.cache.set(
+                'example.com.', ZoneSnapshot.from_zone(Zone('example.com.', []))
+            )
+            mock_sync.return_value = 0
+            result = manager.sync_zone('example.com.', dry_run=False)
+            self.assertEqual(0, result['result'])
+            mock_sync.assert_called_once()
+            self.assertEqual(2, mock_sync_zone.call_count)
+
+    def test_replace_zone_targets(self):
+        config_content = '''
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+'''
+        with self._get_config_file(config_content) as config_file:
+            manager = ApiManager(config_file)
+        desired = Zone('example.com.', [])
+        with self.assertRaises(ApiManagerException) as ctx:
+            manager.replace_zone('example.com.', desired)
+        self.assertIn('no targets configured', str(ctx.exception))
+
+        config_content = '''
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - notfound
+'''
+        with self._get_config_file(config_content) as config_file:
+            manager = ApiManager(config_file)
+        with self.assertRaises(ApiManagerException) as ctx:
+            manager.replace_zone('example.com.', desired)
+        self.assertIn('Target notfound not found', str(ctx.exception))
+
+    def _populator(self, desired, existing):
+        # targets are also the sources, what's desired is what's populated
+        # in source mode
+        def populate(zone, target=False, **kwargs):
+            records = existing if target else desired
+            for name, data in records.items():
+                zone.add_record(Record.new(zone, name, dict(data)))
+            return True
+
+        return populate
+
+    def test_plan_and_apply(self):
+        config_content = '''
+api:
+  cache:
+    ttl: 60
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+    supports_root_ns: false
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+'''
+        with self._get_config_file(config_content) as config_file:
+            manager = ApiManager(config_file)
+
+        desired = {
+            'www': {'type': 'A', 'ttl': 30, 'value': '1.2.3.4'},
+            'new': {'type': 'A', 'ttl': 30, 'value': '3.4.5.6'},
+        }
+        existing = {
+            'www': {'type': 'A', 'ttl': 30, 'value': '1.2.3.4'},
+            'old': {'type': 'A', 'ttl': 30, 'value': '2.3.4.5'},
+        }
+
+        target = manager.manager.providers['yaml']
+        with patch.object(
+            target, 'populate', side_effect=self._populator(desired, existing)
+        ) as mock_populate, patch.object(target, 'apply') as mock_apply:
+            mock_apply.return_value = 2
+
+            # the configured plan outputs are run
+            with self.assertLogs('Plan', level='INFO') as logs:
+                result = manager.sync_zone('example.com.', dry_run=True)
+            self.assertIn(
+                'Create <ARecord A 30, new.example.com.', logs.output[0]
+            )
+            plan_id = result['plan_id']
+            self.assertEqual(
+                {
+                    'zone': 'example.com.',
+                    'dry_run': True,
+                    'result': 0,
+                    'changes': 2,
+                    'plan_id': plan_id,
+                    'targets': [
+                        {
+                            'target': 'yaml',
+                            'creates': 1,
+                            'updates': 0,
+                            'deletes': 1,
+                            'applied': False,
+                        }
+                    ],
+                },
+                result,
+            )
+            mock_apply.assert_not_called()
+            # populated once as the source and once as the target
+            self.assertEqual(2, mock_populate.call_count)
+
+            # applying it applies exactly what was planned, planned again
+            # against the provider rather than the cache
+            manager.get_snapshot('example.com.')
+            populates = mock_populate.call_count
+            result = manager.apply_plan(plan_id)
+            self.assertEqual(populates + 1, mock_populate.call_count)
+            mock_apply.assert_called_once()
+            applied = mock_apply.call_args[0][0]
+            self.assertEqual(
+                [('Create', 'new'), ('Delete', 'old')],
+                sorted(
+                    (type(c).__name__, c.record.name) for c in applied.changes
+                ),
+            )
+            self.assertEqual(2, result['result'])
+            self.assertEqual(plan_id, result['plan_id'])
+            self.assertTrue(result['targets'][0]['applied'])
+            self.assertIsNone(manager.cache.get('example.com.'))
+
+            # only once
+            with self.assertRaises(ApiManagerException) as ctx:
+                manager.apply_plan(plan_id)
+            self.assertIn('not found', str(ctx.exception))
+
+            # targets that are no longer configured
+            plan_id = manager.sync_zone('example.com.')['plan_id']
+            with patch.dict(manager.manager.providers, clear=True):
+                with self.assertRaises(ApiManagerException) as ctx:
+                    manager.apply_plan(plan_id)
+            self.assertEqual(
+                f'Target yaml of plan {plan_id} not found', str(ctx.exception)
+            )
+
+            # the zone changing in between invalidates the plan
+            mock_apply.reset_mock()
+            plan_id = manager.sync_zone('example.com.')['plan_id']
+            existing['old'] = {'type': 'A', 'ttl': 30, 'value': '9.9.9.9'}
+            with self.assertRaises(StalePlanException) as ctx:
+                manager.apply_plan(plan_id)
+            self.assertIn('has changed since plan', str(ctx.exception))
+            mock_apply.assert_not_called()
+
+            # as does it being changed to what was planned
+            plan_id = manager.sync_zone('example.com.')['plan_id']
+            existing.pop('old')
+            existing['new'] = desired['new']
+            with self.assertRaises(StalePlanException):
+                manager.apply_plan(plan_id)
+            mock_apply.assert_not_called()
+
+            # unsafe plans aren't kept
+            existing['old'] = {'type': 'A', 'ttl': 30, 'value': '2.3.4.5'}
+            with patch.object(
+                Plan,
+                'raise_if_unsafe',
+                side_effect=UnsafePlan('Too many deletes'),
+            ):
+                with self.assertRaises(UnsafePlan):
+                    manager.sync_zone('example.com.')
+            self.assertEqual(0, len(manager.plans))
+
+            # nor are those for always-dry-run zones
+            zone_config = manager.manager.zones['example.com.']
+            zone_config['always-dry-run'] = True
+            result = manager.sync_zone('example.com.')
+            self.assertIsNone(result['plan_id'])
+            self.assertEqual(0, result['result'])
+            self.assertEqual(1, result['changes'])
+
+        # alias zones are planned by Manager.sync
+        zone_config['alias'] = 'other.com.'
+        with patch.object(manager.manager, 'sync') as mock_sync:
+            mock_sync.return_value = 0
+            result = manager.sync_zone('example.com.')
+            self.assertEqual(
+                {'zone': 'example.com.', 'dry_run': True, 'result': 0}, result
+            )
+            mock_sync.assert_called_once()
+
+    def test_apply_plan_shared(self):
+        tmpdir = mkdtemp()
+        config_content = f'''
+api:
+  cache:
+    ttl: 60
+    path: {tmpdir}/snapshots.db
+    shared: true
+
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+    supports_root_ns: false
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+'''
+        desired = {'new': {'type': 'A', 'ttl': 30, 'value': '3.4.5.6'}}
+        existing = {'old': {'type': 'A', 'ttl': 30, 'value': '2.3.4.5'}}
+        try:
+            with self._get_config_file(config_content) as config_file:
+                # two workers on a host
+                first = ApiManager(config_file)
+                second = ApiManager(config_file)
+            populator = self._populator(desired, existing)
+            targets = [m.manager.providers['yaml'] for m in (first, second)]
+            with patch.object(
+                targets[0], 'populate', side_effect=populator
+            ), patch.object(
+                targets[1], 'populate', side_effect=populator
+            ), patch.object(
+                targets[1], 'apply'
+            ) as mock_apply:
+                mock_apply.return_value = 2
+                plan_id = first.sync_zone('example.com.')['plan_id']
+                self.assertEqual(0, len(first.plans))
+
+                # a plan made by one worker can be applied by the other
+                result = second.apply_plan(plan_id)
+                self.assertEqual(2, result['result'])
+                mock_apply.assert_called_once()
+                # and only once, by either of them
+                with self.assertRaises(ApiManagerException):
+                    first.apply_plan(plan_id)
+        finally:
+            rmtree(tmpdir)
+
+    def test_apply_plan_targets(self):
+        config_content = '''
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+    supports_root_ns: false
+  other:
+    class: octodns.provider.yaml.YamlProvider
+    directory: /tmp
+    supports_root_ns: false
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+      - other
+'''
+        with self._get_config_file(config_content) as config_file:
+            manager = ApiManager(config_file)
+
+        desired = {'www': {'type': 'A', 'ttl': 30, 'value': '1.2.3.4'}}
+        first = {}
+        second = {}
+        providers = manager.manager.providers
+        with patch.object(
+            providers['yaml'],
+            'populate',
+            side_effect=self._populator(desired, first),
+        ), patch.object(
+            providers['other'],
+            'populate',
+            side_effect=self._populator({}, second),
+        ), patch.object(
+            providers['yaml'], 'apply'
+        ) as mock_apply:
+            plan_id = manager.sync_zone('example.com.')['plan_id']
+
+            # a target other than the first changing invalidates the plan
+            second['other'] = {'type': 'A', 'ttl': 30, 'value': '2.3.4.5'}
+            with self.assertRaises(StalePlanException):
+                manager.apply_plan(plan_id)
+            mock_apply.assert_not_called()
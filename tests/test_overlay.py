@@ -0,0 +1,106 @@
+#
+#
+#
+
+from unittest import TestCase
+
+from octodns.record import Record
+from octodns.zone import DuplicateRecordException, Zone
+
+from octodns_api.overlay import OverlayZone
+
+
+class TestOverlayZone(TestCase):
+    def setUp(self):
+        self.base = Zone('example.com.', [])
+        for name, data in (
+            ('', {'type': 'A', 'ttl': 300, 'value': '1.2.3.4'}),
+            ('', {'type': 'NS', 'ttl': 300, 'value': 'ns1.example.com.'}),
+            ('www', {'type': 'A', 'ttl': 300, 'value': '2.3.4.5'}),
+            ('www', {'type': 'AAAA', 'ttl': 300, 'value': '2001::1'}),
+        ):
+            self.base.add_record(Record.new(self.base, name, data))
+
+    def _record(self, name, data):
+        return Record.new(self.base, name, data)
+
+    def _summary(self, records):
+        return sorted((r.name, r._type, str(r.data)) for r in records)
+
+    def test_unchanged(self):
+        overlay = OverlayZone(self.base)
+        self.assertEqual('example.com.', overlay.name)
+        self.assertEqual(
+            self._summary(self.base.records), self._summary(overlay.records)
+        )
+        self.assertEqual(self.base.root_ns, overlay.root_ns)
+        self.assertFalse(overlay.hydrate())
+
+    def test_add_replace_remove(self):
+        before = self._summary(self.base.records)
+        overlay = OverlayZone(self.base)
+
+        new = self._record('new', {'type': 'A', 'ttl': 60, 'value': '3.3.3.3'})
+        overlay.add_record(new)
+        replaced = self._record(
+            'www', {'type': 'A', 'ttl': 60, 'value': '4.4.4.4'}
+        )
+        overlay.add_record(replaced, replace=True)
+        aaaa = self.base.get_type('www', 'AAAA')
+        overlay.remove_record(aaaa)
+
+        records = {(r.name, r._type): r for r in overlay.records}
+        self.assertEqual(
+            {('', 'A'), ('', 'NS'), ('new', 'A'), ('www', 'A')},
+            set(records.keys()),
+        )
+        self.assertEqual(new, records[('new', 'A')])
+        self.assertEqual('4.4.4.4', records[('www', 'A')].values[0])
+
+        self.assertEqual({replaced}, overlay.get('www'))
+        self.assertEqual({replaced}, overlay.get('www', 'A'))
+        self.assertEqual(set(), overlay.get('www', 'AAAA'))
+        self.assertEqual({new}, overlay.get('new'))
+        self.assertEqual(2, len(overlay.get('')))
+        # node view used by validators
+        self.assertEqual({replaced}, overlay._records['www'])
+
+        # duplicates are rejected w/o replace
+        with self.assertRaises(DuplicateRecordException):
+            overlay.add_record(new)
+
+        # removing something that was added just drops it
+        overlay.remove_record(new)
+        self.assertEqual(set(), overlay.get('new'))
+        # and re-adding something that was removed brings it back
+        overlay.add_record(aaaa)
+        self.assertEqual({aaaa}, overlay.get('www', 'AAAA'))
+
+        # the base zone is untouched
+        self.assertEqual(before, self._summary(self.base.records))
+
+    def test_root_ns(self):
+        overlay = OverlayZone(self.base)
+        root_ns = self.base.root_ns
+        overlay.remove_record(root_ns)
+        self.assertIsNone(overlay.root_ns)
+
+        new = self._record(
+            '', {'type': 'NS', 'ttl': 300, 'value': 'ns2.example.com.'}
+        )
+        overlay.add_record(new)
+        self.assertEqual(new, overlay.root_ns)
+
+    def test_copy(self):
+        # targets make a copy of the desired zone and may modify it
+        overlay = OverlayZone(self.base)
+        new = self._record('new', {'type': 'A', 'ttl': 60, 'value': '3.3.3.3'})
+        overlay.add_record(new)
+
+        copy = overlay.copy()
+        self.assertEqual(
+            self._summary(overlay.records), self._summary(copy.records)
+        )
+        copy.remove_record(new)
+        self.assertEqual(set(), copy.get('new'))
+        self.assertEqual({new}, overlay.get('new'))
@@ -0,0 +1,269 @@
+#
+#
+#
+
+from os.path import join
+from pickle import dumps, loads
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from octodns.provider.plan import TooMuchChange, UnsafePlan
+from octodns.record import Create, Delete, Record, ValidationError
+from octodns.zone import Zone
+
+from octodns_api import planning
+from octodns_api.planning import (
+    PlanningException,
+    PlanningPool,
+    PlanningValidationError,
+    summarize,
+)
+from octodns_api.snapshot import ZoneSnapshot
+from octodns_api.zonefile import ZoneFileException
+
+
+class TestPlanning(TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.config_file = join(self.tmpdir, 'config.yaml')
+        with open(self.config_file, 'w') as fh:
+            fh.write(
+                f'''
+providers:
+  yaml:
+    class: octodns.provider.yaml.YamlProvider
+    directory: {self.tmpdir}/yaml
+    supports_root_ns: false
+  other:
+    class: octodns.provider.yaml.YamlProvider
+    directory: {self.tmpdir}/other
+    supports_root_ns: false
+
+zones:
+  example.com.:
+    sources:
+      - yaml
+    targets:
+      - yaml
+      - other
+'''
+            )
+
+    def tearDown(self):
+        planning._manager = None
+        rmtree(self.tmpdir)
+
+    def _snapshot(self, count):
+        zone = Zone('example.com.', [])
+        for i in range(count):
+            zone.add_record(
+                Record.new(
+                    zone, f'r{i}', {'type': 'A', 'ttl': 60, 'value': '1.1.1.1'}
+                )
+            )
+        return ZoneSnapshot.from_zone(zone)
+
+    def test_summarize(self):
+        self.assertEqual(
+            {
+                'target': 'yaml',
+                'creates': 0,
+                'updates': 0,
+                'deletes': 0,
+                'applied': False,
+            },
+            summarize('yaml', None, False),
+        )
+        plan = MagicMock()
+        plan.changes = [MagicMock(spec=Create)] * 2 + [MagicMock(spec=Delete)]
+        summary = summarize('yaml', plan, True)
+        self.assertEqual((2, 1), (summary['creates'], summary['deletes']))
+        self.assertTrue(summary['applied'])
+
+    def test_wants(self):
+        pool = PlanningPool(self.config_file)
+        self.assertFalse(pool.enabled)
+        self.assertFalse(pool.wants(None))
+        self.assertFalse(pool.wants(1000000))
+
+        pool = PlanningPool(self.config_file, processes=2, min_records=100)
+        self.assertTrue(pool.enabled)
+        self.assertFalse(pool.wants(99))
+        self.assertTrue(pool.wants(100))
+        # zones of unknown size are assumed to be large
+        self.assertTrue(pool.wants(None))
+        # noop, nothing was started
+        pool.shutdown()
+
+    def test_worker(self):
+        # the worker functions, run in this process
+        planning._init(self.config_file)
+
+        summaries, changes = planning._replace_zone(
+            'example.com.',
+            ['yaml', 'other'],
+            'snapshot',
+            self._snapshot(12).pack(),
+            False,
+        )
+        self.assertEqual([12, 12], [s['creates'] for s in summaries])
+        self.assertEqual([True, True], [s['applied'] for s in summaries])
+        self.assertEqual(12, len(changes))
+        self.assertEqual(b'{"ttl":60,"value":"1.1.1.1"}', changes[('r0', 'A')])
+
+        # nothing to do
+        summaries, changes = planning._replace_zone(
+            'example.com.',
+            ['yaml', 'other'],
+            'snapshot',
+            self._snapshot(12).pack(),
+            False,
+        )
+        self.assertEqual([False, False], [s['applied'] for s in summaries])
+        self.assertIsNone(changes)
+
+        # deleting everything is unsafe unless forced
+        with self.assertRaises(UnsafePlan) as ctx:
+            planning._replace_zone(
+                'example.com.',
+                ['yaml'],
+                'snapshot',
+                self._snapshot(0).pack(),
+                False,
+            )
+        # as a plain UnsafePlan that can be sent back from the worker
+        self.assertIs(UnsafePlan, ctx.exception.__class__)
+        self.assertIn('Too many deletes', str(ctx.exception))
+        summaries, changes = planning._replace_zone(
+            'example.com.',
+            ['other'],
+            'snapshot',
+            self._snapshot(0).pack(),
+            True,
+        )
+        self.assertEqual(12, summaries[0]['deletes'])
+        self.assertEqual({None}, set(changes.values()))
+
+        # the records yaml has that other no longer does are put back
+        self.assertEqual(12, planning._sync_zone('example.com.', False))
+
+        # exceptions that can't be sent back are replaced
+        planning._manager.sync = MagicMock()
+        planning._manager.sync.side_effect = TooMuchChange(
+            'Too many updates', 50, 30, 6, 12, 'example.com.'
+        )
+        with self.assertRaises(UnsafePlan) as ctx:
+            planning._sync_zone('example.com.', False)
+        self.assertIs(UnsafePlan, ctx.exception.__class__)
+        self.assertIn('Too many updates', str(ctx.exception))
+        # both targets, the sources, have the records now
+        del planning._manager.sync
+        with self.assertRaises(PlanningException) as ctx:
+            planning._sync_zone('example.com.', False)
+        self.assertIn('DuplicateRecordException', str(ctx.exception))
+        # and ones that can are sent back as-is
+        planning._manager.sync = MagicMock(side_effect=ValueError('nope'))
+        with self.assertRaises(ValueError):
+            planning._sync_zone('example.com.', False)
+
+    def test_worker_builds(self):
+        planning._init(self.config_file)
+
+        # records, built and validated in the worker
+        mx = {'preference': 10, 'exchange': 'mx.example.com.'}
+        records = {
+            'www': {'A': {'ttl': 60, 'value': '1.1.1.1'}},
+            'mail': {'MX': {'ttl': 60, 'value': mx}},
+        }
+        summaries, changes = planning._replace_zone(
+            'example.com.', ['yaml'], 'records', records, False
+        )
+        self.assertEqual(2, summaries[0]['creates'])
+        self.assertEqual([('mail', 'MX'), ('www', 'A')], sorted(changes))
+
+        # as is zone file text
+        text = '$ORIGIN example.com.\nwww 60 IN A 2.2.2.2\n'
+        summaries, changes = planning._replace_zone(
+            'example.com.', ['yaml'], 'zonefile', (text, 'bind'), True
+        )
+        summary = summaries[0]
+        self.assertEqual(
+            (0, 1, 1),
+            (summary['creates'], summary['updates'], summary['deletes']),
+        )
+        self.assertEqual(b'{"ttl":60,"value":"2.2.2.2"}', changes[('www', 'A')])
+
+        # invalid records are sent back as validation errors
+        records = {'www': {'A': {'ttl': 60, 'value': 'nope'}}}
+        with self.assertRaises(ValidationError) as ctx:
+            planning._replace_zone(
+                'example.com.', ['yaml'], 'records', records, False
+            )
+        self.assertIs(PlanningValidationError, ctx.exception.__class__)
+        self.assertIn('invalid IPv4 address "nope"', str(ctx.exception))
+        sent = loads(dumps(ctx.exception))
+        self.assertEqual(str(ctx.exception), str(sent))
+        self.assertEqual(['invalid IPv4 address "nope"'], sent.reasons)
+
+        # along with their context
+        text = "---\nwww:\n  type: A\n  value: nope\n"
+        with self.assertRaises(ValidationError) as ctx:
+            planning._replace_zone(
+                'example.com.', ['yaml'], 'zonefile', (text, 'yaml'), False
+            )
+        self.assertEqual(str(ctx.exception), str(loads(dumps(ctx.exception))))
+        self.assertIsInstance(ctx.exception.context, str)
+
+        # unparsable zone files
+        with self.assertRaises(ZoneFileException):
+            planning._replace_zone(
+                'example.com.', ['yaml'], 'zonefile', ('www: [', 'yaml'), False
+            )
+
+    def test_pool(self):
+        pool = PlanningPool(self.config_file, processes=1, min_records=1)
+        try:
+            summaries, changes = pool.replace_zone(
+                'example.com.',
+                ['yaml', 'other'],
+                'snapshot',
+                self._snapshot(12).pack(),
+            )
+            self.assertEqual([12, 12], [s['creates'] for s in summaries])
+            self.assertEqual(12, len(changes))
+
+            with self.assertRaises(UnsafePlan) as ctx:
+                pool.replace_zone(
+                    'example.com.',
+                    ['yaml', 'other'],
+                    'snapshot',
+                    self._snapshot(0).pack(),
+                )
+            self.assertIn('Too many deletes', str(ctx.exception))
+
+            # the pool keeps working after errors that couldn't be pickled
+            with self.assertRaises(PlanningException):
+                pool.sync_zone('example.com.', False)
+            summaries, _ = pool.replace_zone(
+                'example.com.',
+                ['yaml', 'other'],
+                'snapshot',
+                self._snapshot(12).pack(),
+            )
+            self.assertEqual([False, False], [s['applied'] for s in summaries])
+
+            # records are validated in the worker, invalid ones come back as
+            # validation errors
+            records = {'www': {'A': {'ttl': 60, 'value': 'nope'}}}
+            with self.assertRaises(ValidationError) as ctx:
+                pool.replace_zone('example.com.', ['yaml'], 'records', records)
+            self.assertIn('invalid IPv4 address "nope"', str(ctx.exception))
+        finally:
+            pool.shutdown()
+        # the changes were made by the worker
+        zone = Zone('example.com.', [])
+        planning._init(self.config_file)
+        planning._manager.providers['other'].populate(zone)
+        self.assertEqual(12, len(zone.records))
@@ -0,0 +1,126 @@
+#
+#
+#
+
+from marshal import dumps
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+from zlib import compress
+
+from octodns.provider.plan import Plan
+from octodns.record import Record
+from octodns.zone import Zone
+
+from octodns_api.cache import SqliteZoneStore
+from octodns_api.plans import PlanStore, StoredPlan
+
+
+def _plans():
+    existing = Zone('example.com.', [])
+    desired = Zone('example.com.', [])
+    desired.add_record(
+        Record.new(
+            desired, 'www', {'type': 'A', 'ttl': 300, 'value': '1.2.3.4'}
+        )
+    )
+    # only what the target was planned to become is kept
+    return [(SimpleNamespace(id='dump'), Plan(existing, desired, [], True))]
+
+
+class TestStoredPlan(TestCase):
+    def test_pack_unpack(self):
+        stored = PlanStore().add('example.com.', 'abc', _plans())
+        unpacked = StoredPlan.unpack(stored.id, stored.pack())
+        self.assertEqual(stored.id, unpacked.id)
+        self.assertEqual('example.com.', unpacked.zone_name)
+        self.assertEqual('abc', unpacked.fingerprint)
+        self.assertEqual(stored.expires_at, unpacked.expires_at)
+        ((target_id, snapshot),) = unpacked.desired
+        self.assertEqual('dump', target_id)
+        self.assertEqual(
+            [('www', 'A', {'ttl': 300, 'value': '1.2.3.4'})],
+            list(snapshot.records()),
+        )
+
+    def test_unpack_unsupported(self):
+        data = compress(dumps((0, 'example.com.', 'abc', 160, ())))
+        with self.assertRaises(ValueError) as ctx:
+            StoredPlan.unpack('id', data)
+        self.assertEqual('unsupported format 0', str(ctx.exception))
+
+
+class TestPlanStore(TestCase):
+    @patch('octodns_api.plans.time')
+    def test_add_take(self, mock_time):
+        mock_time.return_value = 100
+        store = PlanStore(ttl=60)
+        stored = store.add('example.com.', 'abc', _plans())
+        self.assertEqual(32, len(stored.id))
+        self.assertEqual('example.com.', stored.zone_name)
+        self.assertEqual('abc', stored.fingerprint)
+        # what the target was planned to become
+        ((target_id, snapshot),) = stored.desired
+        self.assertEqual('dump', target_id)
+        self.assertEqual(1, len(snapshot))
+        self.assertEqual(160, stored.expires_at)
+        self.assertEqual(1, len(store))
+
+        # plans can only be taken once
+        self.assertEqual(stored, store.take(stored.id))
+        self.assertIsNone(store.take(stored.id))
+        self.assertIsNone(store.take('unknown'))
+        self.assertEqual(0, len(store))
+
+    @patch('octodns_api.plans.time')
+    def test_expiry(self, mock_time):
+        store = PlanStore(ttl=60)
+        mock_time.return_value = 100
+        first = store.add('example.com.', 'abc', [])
+        mock_time.return_value = 130
+        second = store.add('example.com.', 'def', [])
+        self.assertEqual(2, len(store))
+
+        mock_time.return_value = 159
+        self.assertEqual(2, len(store))
+        mock_time.return_value = 160
+        self.assertEqual(1, len(store))
+        self.assertIsNone(store.take(first.id))
+        self.assertEqual(second, store.take(second.id))
+
+    def test_max_plans(self):
+        store = PlanStore(max_plans=2)
+        ids = [store.add('example.com.', str(i), []).id for i in range(3)]
+        self.assertEqual(2, len(store))
+        # the oldest is dropped
+        self.assertIsNone(store.take(ids[0]))
+        self.assertTrue(store.take(ids[1]))
+        self.assertTrue(store.take(ids[2]))
+
+    def test_shared_store(self):
+        shared = SqliteZoneStore(':memory:')
+        store = PlanStore(store=shared)
+        # another process using the same store
+        other = PlanStore(store=shared)
+
+        stored = store.add('example.com.', 'abc', _plans())
+        # nothing's kept in memory
+        self.assertEqual(0, len(store))
+
+        taken = other.take(stored.id)
+        self.assertEqual(stored.id, taken.id)
+        self.assertEqual('abc', taken.fingerprint)
+        ((target_id, snapshot),) = taken.desired
+        self.assertEqual('dump', target_id)
+        self.assertEqual(
+            list(stored.desired[0][1].records()), list(snapshot.records())
+        )
+        # still only once
+        self.assertIsNone(store.take(stored.id))
+        self.assertIsNone(other.take('unknown'))
+
+        # invalid plans are discarded
+        shared.save_plan('bad', b'\x00', stored.expires_at)
+        with self.assertLogs('PlanStore', 'WARNING'):
+            self.assertIsNone(store.take('bad'))
+        self.assertIsNone(store.take('bad'))
@@ -0,0 +1,127 @@
+#
+#
+#
+
+from sys import modules
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from requests import Session
+
+from octodns_api import pools as pools_module
+from octodns_api.pools import ConnectionPools
+
+
+class _Provider:
+    def __init__(self):
+        self.id = 'http'
+        self._sess = Session()
+        self.other = 'not a session'
+
+
+class _OtherProvider:
+    def __init__(self):
+        self.id = 'other'
+
+
+class TestConnectionPools(TestCase):
+    def test_configure(self):
+        pools = ConnectionPools(pool_connections=2, pool_maxsize=32)
+        provider = _Provider()
+        self.assertEqual(1, pools.configure('http', provider))
+        self.assertEqual(0, pools.configure('other', _OtherProvider()))
+
+        for prefix in ('https://', 'http://'):
+            adapter = provider._sess.get_adapter(f'{prefix}api.example.com')
+            self.assertEqual(32, adapter._pool_maxsize)
+            self.assertEqual(2, adapter._pool_connections)
+            self.assertFalse(adapter._pool_block)
+            # no keep-alive tuning by default
+            self.assertNotIn(
+                'socket_options', adapter.poolmanager.connection_pool_kw
+            )
+
+        # only providers with sessions show up
+        self.assertEqual(
+            {'http': {'pools': 0, 'connections': 0, 'requests': 0}},
+            pools.stats(),
+        )
+
+    def test_configure_without_requests(self):
+        pools = ConnectionPools()
+        with patch.dict(modules, {'requests': None}):
+            self.assertEqual(0, pools.configure('http', _Provider()))
+        self.assertEqual({}, pools.stats())
+
+    def test_keep_alive(self):
+        pools = ConnectionPools(keep_alive=60, pool_block=True)
+        provider = _Provider()
+        pools.configure('http', provider)
+        adapter = provider._sess.get_adapter('https://api.example.com')
+        self.assertTrue(adapter._pool_block)
+        options = adapter.poolmanager.connection_pool_kw['socket_options']
+        self.assertIn(
+            (
+                pools_module.socket.SOL_SOCKET,
+                pools_module.socket.SO_KEEPALIVE,
+                1,
+            ),
+            options,
+        )
+        timing = pools_module._KEEPALIVE_TIMING
+        if timing:
+            self.assertIn(
+                (pools_module.socket.IPPROTO_TCP, timing[0], 60), options
+            )
+            self.assertIn(
+                (pools_module.socket.IPPROTO_TCP, timing[1], 15), options
+            )
+
+            # fractional seconds, e.g. from YAML, are truncated
+            options = ConnectionPools(keep_alive=30.5)._socket_options()
+            self.assertIn(
+                (pools_module.socket.IPPROTO_TCP, timing[0], 30), options
+            )
+            self.assertIn(
+                (pools_module.socket.IPPROTO_TCP, timing[1], 7), options
+            )
+            for _, _, value in options:
+                self.assertIsInstance(value, int)
+
+        # platforms w/o the timing options just get keep-alive enabled
+        with patch.object(pools_module, '_KEEPALIVE_TIMING', ()):
+            options = pools._socket_options()
+        self.assertEqual(
+            (
+                pools_module.socket.SOL_SOCKET,
+                pools_module.socket.SO_KEEPALIVE,
+                1,
+            ),
+            options[-1],
+        )
+
+    def test_stats(self):
+        pools = ConnectionPools()
+        provider = _Provider()
+        pools.configure('http', provider)
+        adapter = provider._sess.get_adapter('https://api.example.com')
+
+        # pools are created, w/o connecting, for each host used
+        for host in ('https://one.example.com', 'https://two.example.com'):
+            pool = adapter.poolmanager.connection_from_url(host)
+            pool.num_connections = 2
+            pool.num_requests = 10
+        self.assertEqual(
+            {'http': {'pools': 2, 'connections': 4, 'requests': 20}},
+            pools.stats(),
+        )
+
+        # pools evicted while stats are being gathered are skipped
+        evicted = MagicMock()
+        evicted.keys.return_value = ['gone']
+        evicted.__getitem__.side_effect = KeyError('gone')
+        with patch.object(adapter.poolmanager, 'pools', evicted):
+            self.assertEqual(
+                {'http': {'pools': 0, 'connections': 0, 'requests': 0}},
+                pools.stats(),
+            )
@@ -0,0 +1,236 @@
+#
+#
+#
+
+from os import listdir, makedirs
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from octodns_api.app import create_app
+from octodns_api.profiling import Profiler
+
+
+class TestProfiling(TestCase):
+    def _create_app(self, profiling=''):
+        config_dir = join(self.tmpdir, 'config')
+        makedirs(config_dir, exist_ok=True)
+        with open(join(config_dir, 'example.com.yaml'), 'w') as f:
+            f.write(
+                '''
+---
+www:
+  ttl: 300
+  type: A
+  value: 5.6.7.8
+'''
+            )
+
+        config_file = join(self.tmpdir, 'config.yaml')
+        with open(config_file, 'w') as f:
+            f.write(
+                f'''
+api:
+  keys:
+    - name: admin
+      key: admin-key
+    - name: other
+      key: other-key
+{profiling}
+
+providers:
+  config:
+    class: octodns.provider.yaml.YamlProvider
+    directory: {config_dir}
+
+zones:
+  example.com.:
+    sources:
+      - config
+    targets:
+      - config
+'''
+            )
+        app = create_app(config_file)
+        app.config['TESTING'] = True
+        return app
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.admin = {'Authorization': 'Bearer admin-key'}
+        self.other = {'Authorization': 'Bearer other-key'}
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_disabled(self):
+        app = self._create_app()
+        self.assertIsNone(app.profiler)
+        self.assertNotIn('profiles.get_profile', app.view_functions)
+
+        client = app.test_client()
+        response = client.get(
+            '/zones/example.com./records/www/A',
+            headers={**self.admin, 'X-Profile': '1'},
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+        # a profiling section w/o any keys is also disabled
+        app = self._create_app(
+            '''
+  profiling:
+    keys: []
+'''
+        )
+        self.assertIsNone(app.profiler)
+        self.assertNotIn('profiles.get_profile', app.view_functions)
+
+    def test_profiling(self):
+        app = self._create_app(
+            '''
+  profiling:
+    keys:
+      - admin
+    max_profiles: 2
+'''
+        )
+        self.assertEqual({'admin'}, app.profiler.keys)
+        client = app.test_client()
+
+        # not requested
+        response = client.get(
+            '/zones/example.com./records/www/A', headers=self.admin
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+        # requested, but key isn't allowed
+        response = client.get(
+            '/zones/example.com./records/www/A',
+            headers={**self.other, 'X-Profile': '1'},
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+        # requested, but not authenticated
+        response = client.get(
+            '/zones/example.com./records/www/A',
+            headers={'Authorization': 'Bearer admin', 'X-Profile': '1'},
+        )
+        self.assertEqual(401, response.status_code)
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+        # requested and allowed
+        response = client.get(
+            '/zones/example.com./records/www/A',
+            headers={**self.admin, 'X-Profile': '1'},
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('www', response.get_json()['name'])
+        profile_id = response.headers['X-Profile-Id']
+
+        response = client.get(f'/profiles/{profile_id}', headers=self.admin)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/octet-stream', response.mimetype)
+        self.assertTrue(response.get_data())
+
+        response = client.get(
+            f'/profiles/{profile_id}?format=text', headers=self.admin
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertIn('get_record', response.get_data(as_text=True))
+
+        # other keys can't download them
+        response = client.get(f'/profiles/{profile_id}', headers=self.other)
+        self.assertEqual(403, response.status_code)
+
+        # unknown and invalid ids
+        response = client.get(f'/profiles/{"0" * 32}', headers=self.admin)
+        self.assertEqual(404, response.status_code)
+        response = client.get('/profiles/not-an-id', headers=self.admin)
+        self.assertEqual(404, response.status_code)
+
+        # only the most recent are kept
+        for _ in range(2):
+            client.get('/zones', headers={**self.admin, 'X-Profile': '1'})
+        response = client.get(f'/profiles/{profile_id}', headers=self.admin)
+        self.assertEqual(404, response.status_code)
+
+    def test_profiling_directory(self):
+        directory = join(self.tmpdir, 'profiles')
+        makedirs(directory)
+        app = self._create_app(
+            f'''
+  profiling:
+    keys:
+      - admin
+    directory: {directory}
+'''
+        )
+        client = app.test_client()
+        response = client.get(
+            '/zones', headers={**self.admin, 'X-Profile': '1'}
+        )
+        profile_id = response.headers['X-Profile-Id']
+        self.assertEqual([f'{profile_id}.prof'], listdir(directory))
+
+        response = client.get(
+            f'/profiles/{profile_id}?format=text', headers=self.admin
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertIn('list_zones', response.get_data(as_text=True))
+
+        response = client.get(f'/profiles/{"0" * 32}', headers=self.admin)
+        self.assertEqual(404, response.status_code)
+
+    def test_busy(self):
+        app = self._create_app(
+            '''
+  profiling:
+    keys:
+      - admin
+'''
+        )
+        client = app.test_client()
+        app.profiler._active.acquire()
+        try:
+            response = client.get(
+                '/zones', headers={**self.admin, 'X-Profile': '1'}
+            )
+        finally:
+            app.profiler._active.release()
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+    def test_get_profile_error(self):
+        app = self._create_app(
+            '''
+  profiling:
+    keys:
+      - admin
+'''
+        )
+        app.profiler.load = None
+        response = app.test_client().get(
+            f'/profiles/{"0" * 32}', headers=self.admin
+        )
+        self.assertEqual(500, response.status_code)
+
+    def test_from_config(self):
+        self.assertIsNone(Profiler.from_config({}))
+        self.assertIsNone(Profiler.from_config({'profiling': {'keys': []}}))
+        profiler = Profiler.from_config(
+            {
+                'keys': [
+                    {'name': 'a', 'key': 'a-key'},
+                    {'name': 'b', 'key': 'b-key'},
+                    {'name': 'c'},
+                ],
+                'profiling': {'keys': ['a', 'c'], 'max_profiles': 5},
+            }
+        )
+        self.assertEqual({'a'}, profiler.keys)
+        self.assertEqual(5, profiler.max_profiles)
+        self.assertIsNone(profiler.directory)
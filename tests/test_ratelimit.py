@@ -0,0 +1,128 @@
+#
+#
+#
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from octodns_api.ratelimit import (
+    KeyLimits,
+    SqliteTokenBuckets,
+    TokenBucket,
+    _take,
+)
+
+
+class TestTokenBucket(TestCase):
+    def test_take(self):
+        # refilled up to burst
+        self.assertEqual((1, 0), _take(1, 10, 1, 2))
+        # half a token, half a second at 1/s to go
+        self.assertEqual((0.5, 0.5), _take(0, 0.5, 1, 2))
+
+    @patch('octodns_api.ratelimit.monotonic')
+    def test_bucket(self, monotonic_mock):
+        monotonic_mock.return_value = 100
+        bucket = TokenBucket(2, 3)
+        # starts full
+        self.assertEqual([0, 0, 0], [bucket.take() for _ in range(3)])
+        self.assertEqual(0.5, bucket.take())
+        # a quarter of a second later there's half a token
+        monotonic_mock.return_value = 100.25
+        self.assertEqual(0.25, bucket.take())
+        monotonic_mock.return_value = 100.5
+        self.assertEqual(0, bucket.take())
+
+
+class TestSqliteTokenBuckets(TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.path = join(self.tmpdir, 'buckets.db')
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    @patch('octodns_api.ratelimit.time')
+    def test_take(self, time_mock):
+        time_mock.return_value = 1000
+        buckets = SqliteTokenBuckets(self.path)
+        self.assertEqual(0, buckets.take('a', 1, 2))
+        self.assertEqual(0, buckets.take('a', 1, 2))
+        self.assertEqual(1, buckets.take('a', 1, 2))
+        # other buckets are independent
+        self.assertEqual(0, buckets.take('b', 1, 2))
+
+        # shared with other connections, e.g. other processes
+        other = SqliteTokenBuckets(self.path)
+        self.assertEqual(1, other.take('a', 1, 2))
+        time_mock.return_value = 1001
+        self.assertEqual(0, other.take('a', 1, 2))
+        self.assertEqual(1, buckets.take('a', 1, 2))
+
+        # clocks going backwards don't add tokens
+        time_mock.return_value = 900
+        self.assertEqual(0, buckets.take('b', 1, 2))
+        self.assertEqual(1, buckets.take('b', 1, 2))
+
+    def test_rollback(self):
+        buckets = SqliteTokenBuckets(self.path)
+        with self.assertRaises(TypeError):
+            buckets.take('a', 'nope', 2)
+        # the transaction was rolled back and the store is still usable
+        self.assertEqual(0, buckets.take('a', 1, 2))
+
+
+class TestKeyLimits(TestCase):
+    def test_unlimited(self):
+        limits = KeyLimits('test')
+        for _ in range(10):
+            self.assertIsNone(limits.acquire())
+        self.assertEqual(
+            {
+                'rate': None,
+                'burst': None,
+                'concurrency': None,
+                'in_flight': 10,
+                'rate_limited': 0,
+                'concurrency_limited': 0,
+            },
+            limits.stats(),
+        )
+
+    def test_rate(self):
+        limits = KeyLimits('test', rate=0.5)
+        # burst defaults to the rate, at least 1
+        self.assertEqual(1, limits.burst)
+        self.assertIsNone(limits.acquire())
+        limits.release()
+        # rounded up to whole seconds
+        self.assertEqual(2, limits.acquire())
+        stats = limits.stats()
+        self.assertEqual((0, 1), (stats['in_flight'], stats['rate_limited']))
+
+        self.assertEqual(3, KeyLimits('test', rate=2.5).burst)
+        self.assertEqual(10, KeyLimits('test', rate=2.5, burst=10).burst)
+
+    def test_concurrency(self):
+        limits = KeyLimits('test', concurrency=2)
+        self.assertIsNone(limits.acquire())
+        self.assertIsNone(limits.acquire())
+        self.assertEqual(1, limits.acquire())
+        limits.release()
+        self.assertIsNone(limits.acquire())
+        stats = limits.stats()
+        self.assertEqual(
+            (2, 1), (stats['in_flight'], stats['concurrency_limited'])
+        )
+
+    def test_store(self):
+        store = MagicMock()
+        store.take.side_effect = [0, 0.2]
+        limits = KeyLimits('test', rate=10, store=store)
+        self.assertIsNone(limits._bucket)
+        self.assertIsNone(limits.acquire())
+        self.assertEqual(1, limits.acquire())
+        store.take.assert_called_with('test', 10, 10)
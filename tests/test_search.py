@@ -0,0 +1,496 @@
+#
+#
+#
+
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+from unittest.mock import MagicMock, call, patch
+
+from octodns.record import Record
+from octodns.zone import Zone
+
+from octodns_api.app import create_app
+from octodns_api.search import SearchIndex
+from octodns_api.snapshot import ZoneSnapshot
+
+
+def _snapshot(zone_name, records):
+    zone = Zone(zone_name, [])
+    for name, data in records:
+        zone.add_record(Record.new(zone, name, data))
+    return ZoneSnapshot.from_zone(zone)
+
+
+class TestSearchIndex(TestCase):
+    def setUp(self):
+        self.first = _snapshot(
+            'example.com.',
+            (
+                ('', {'type': 'A', 'ttl': 300, 'value': '10.1.2.3'}),
+                ('www', {'type': 'A', 'ttl': 300, 'values': ['10.1.2.3']}),
+                ('alias', {'type': 'CNAME', 'ttl': 300, 'value': 'Www.Other.'}),
+                (
+                    '',
+                    {
+                        'type': 'MX',
+                        'ttl': 300,
+                        'value': {'preference': 10, 'exchange': 'mx.other.'},
+                    },
+                ),
+                (
+                    'dyn',
+                    {
+                        'type': 'A',
+                        'ttl': 300,
+                        'value': '10.9.9.9',
+                        'dynamic': {
+                            'pools': {
+                                'one': {'values': [{'value': '10.4.4.4'}]}
+                            },
+                            'rules': [{'pool': 'one'}],
+                        },
+                    },
+                ),
+            ),
+        )
+        self.second = _snapshot(
+            'other.', (('www', {'type': 'A', 'ttl': 300, 'value': '10.1.2.3'}),)
+        )
+        self.index = SearchIndex()
+        self.assertEqual(5, self.index.update('example.com.', self.first))
+        self.assertEqual(1, self.index.update('other.', self.second))
+
+    def _keys(self, results):
+        return [(z, n, t) for z, n, t, _ in results[0]]
+
+    def test_search(self):
+        index = self.index
+        self.assertIn('other.', index)
+        self.assertNotIn('unknown.', index)
+
+        # by value
+        self.assertEqual(
+            [
+                ('example.com.', '', 'A'),
+                ('example.com.', 'www', 'A'),
+                ('other.', 'www', 'A'),
+            ],
+            self._keys(index.search(value='10.1.2.3')),
+        )
+        # cname targets, case and trailing dots don't matter
+        self.assertEqual(
+            [('example.com.', 'alias', 'CNAME')],
+            self._keys(index.search(value='www.other')),
+        )
+        # structured values and dynamic pools
+        self.assertEqual(
+            [('example.com.', '', 'MX')],
+            self._keys(index.search(value='MX.other.')),
+        )
+        self.assertEqual(
+            [('example.com.', 'dyn', 'A')],
+            self._keys(index.search(value='10.4.4.4')),
+        )
+        # by name
+        self.assertEqual(
+            [('other.', 'www', 'A')],
+            self._keys(index.search(name='www.other.')),
+        )
+        self.assertEqual(
+            [('example.com.', '', 'A'), ('example.com.', '', 'MX')],
+            self._keys(index.search(name='example.com')),
+        )
+        # combined
+        self.assertEqual(
+            [('example.com.', '', 'MX')],
+            self._keys(index.search(name='example.com', _type='MX')),
+        )
+        self.assertEqual(
+            [], self._keys(index.search(name='www.other', value='10.4.4.4'))
+        )
+        self.assertEqual([], self._keys(index.search(value='nope')))
+        # no criteria, no results
+        self.assertEqual(([], False), index.search())
+
+        # data comes along with the results
+        results, truncated = index.search(name='www.other')
+        self.assertEqual(
+            [('other.', 'www', 'A', {'ttl': 300, 'value': '10.1.2.3'})], results
+        )
+        self.assertFalse(truncated)
+
+        # limits
+        results, truncated = index.search(value='10.1.2.3', limit=2)
+        self.assertEqual(2, len(results))
+        self.assertTrue(truncated)
+
+    def test_update(self):
+        index = self.index
+        # same snapshot is a no-op
+        self.assertEqual(0, index.update('other.', self.second))
+
+        # only what's changed is touched, a changed record is removed and
+        # re-added, new ones added, and missing ones removed
+        updated = _snapshot(
+            'other.',
+            (
+                ('www', {'type': 'A', 'ttl': 300, 'value': '10.5.5.5'}),
+                ('new', {'type': 'A', 'ttl': 300, 'value': '10.1.2.3'}),
+            ),
+        )
+        self.assertEqual(3, index.update('other.', updated))
+        self.assertEqual(
+            [
+                ('example.com.', '', 'A'),
+                ('example.com.', 'www', 'A'),
+                ('other.', 'new', 'A'),
+            ],
+            self._keys(index.search(value='10.1.2.3')),
+        )
+        self.assertEqual(
+            [('other.', 'www', 'A')], self._keys(index.search(value='10.5.5.5'))
+        )
+
+    def test_update_shared_records(self):
+        index = self.index
+        # versions of a zone that share records, only the layers between the
+        # indexed and new snapshots are looked at
+        first = self.second.versioned(1)
+        second = first.apply_packed(
+            {('new', 'A'): b'{"ttl":300,"value":"10.6.6.6"}'}
+        )
+        third = second.apply_packed({('new', 'A'): None})
+        # nothing's changed between them
+        self.assertEqual(0, index.update('other.', first))
+        with patch.object(ZoneSnapshot, 'packed') as mock_packed:
+            self.assertEqual(1, index.update('other.', second))
+            self.assertEqual(1, index.update('other.', third))
+            mock_packed.assert_not_called()
+        self.assertEqual([], self._keys(index.search(value='10.6.6.6')))
+
+    def test_update_race(self):
+        index = self.index
+        updated = _snapshot(
+            'other.', (('www', {'type': 'A', 'ttl': 300, 'value': '10.5.5.5'}),)
+        )
+        raced = _snapshot(
+            'other.', (('www', {'type': 'A', 'ttl': 300, 'value': '10.6.6.6'}),)
+        )
+        changes = index._changes
+
+        def racing_changes(zone_name, previous, snapshot):
+            if snapshot is updated and previous is self.second:
+                # re-indexed by someone else while we work out our changes
+                index.update(zone_name, raced)
+            return changes(zone_name, previous, snapshot)
+
+        with patch.object(index, '_changes', side_effect=racing_changes):
+            self.assertEqual(2, index.update('other.', updated))
+        # started over from what had been indexed in the meantime
+        self.assertEqual([], self._keys(index.search(value='10.6.6.6')))
+        self.assertEqual(
+            [('other.', 'www', 'A')], self._keys(index.search(value='10.5.5.5'))
+        )
+
+    def test_remove(self):
+        index = self.index
+        # values that normalize to the same term
+        index.update(
+            'txt.',
+            _snapshot(
+                'txt.',
+                (('', {'type': 'TXT', 'ttl': 300, 'values': ['Foo', 'foo']}),),
+            ),
+        )
+        self.assertEqual(
+            [('txt.', '', 'TXT')], self._keys(index.search(value='FOO'))
+        )
+        index.remove('txt.')
+        index.remove('example.com.')
+        index.remove('unknown.')
+        self.assertNotIn('example.com.', index)
+        self.assertEqual(
+            [('other.', 'www', 'A')], self._keys(index.search(value='10.1.2.3'))
+        )
+        index.remove('other.')
+        # nothing's left behind
+        self.assertEqual({}, dict(index._names))
+        self.assertEqual({}, dict(index._types))
+        self.assertEqual({}, dict(index._values))
+
+
+class TestSearchApi(TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        config_dir = join(self.tmpdir, 'config')
+        makedirs(config_dir)
+        with open(join(config_dir, 'example.com.yaml'), 'w') as f:
+            f.write(
+                '''
+---
+alias:
+  ttl: 300
+  type: CNAME
+  value: www.other.com.
+www:
+  ttl: 300
+  type: A
+  value: 10.1.2.3
+'''
+            )
+        with open(join(config_dir, 'other.com.yaml'), 'w') as f:
+            f.write(
+                '''
+---
+www:
+  ttl: 300
+  type: A
+  value: 10.1.2.3
+'''
+            )
+        config_file = join(self.tmpdir, 'config.yaml')
+        with open(config_file, 'w') as f:
+            f.write(
+                f'''
+api:
+  keys:
+    - name: admin
+      key: admin-key
+  cache:
+    ttl: 60
+
+providers:
+  config:
+    class: octodns.provider.yaml.YamlProvider
+    directory: {config_dir}
+
+zones:
+  example.com.:
+    sources:
+      - config
+    targets:
+      - config
+  other.com.:
+    sources:
+      - config
+    targets:
+      - config
+'''
+            )
+        self.app = create_app(config_file)
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        self.headers = {'Authorization': 'Bearer admin-key'}
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def _warm(self):
+        # searches only look at cached zones
+        for zone_name in ('example.com.', 'other.com.'):
+            self.app.manager.get_snapshot(zone_name)
+
+    def _search(self, **params):
+        return self.client.get(
+            '/search', headers=self.headers, query_string=params
+        )
+
+    def test_search(self):
+        self._warm()
+        response = self._search(value='10.1.2.3')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            {
+                'records': [
+                    {
+                        'zone': 'example.com.',
+                        'name': 'www',
+                        'type': 'A',
+                        'ttl': 300,
+                        'value': '10.1.2.3',
+                    },
+                    {
+                        'zone': 'other.com.',
+                        'name': 'www',
+                        'type': 'A',
+                        'ttl': 300,
+                        'value': '10.1.2.3',
+                    },
+                ],
+                'truncated': False,
+            },
+            response.get_json(),
+        )
+
+        response = self._search(value='www.other.com', type='CNAME')
+        self.assertEqual(
+            [('example.com.', 'alias')],
+            [(r['zone'], r['name']) for r in response.get_json()['records']],
+        )
+
+        response = self._search(name='www.other.com', limit=1)
+        self.assertEqual(
+            {
+                'records': [
+                    {
+                        'zone': 'other.com.',
+                        'name': 'www',
+                        'type': 'A',
+                        'ttl': 300,
+                        'value': '10.1.2.3',
+                    }
+                ],
+                'truncated': False,
+            },
+            response.get_json(),
+        )
+
+    def test_search_after_write(self):
+        self._warm()
+        self.assertEqual(2, len(self._search(value='10.1.2.3').json['records']))
+
+        # the written zone is re-indexed as its written, just its changed
+        # record
+        index = self.app.manager.search_index
+        update = index.update
+        changed = {}
+
+        def recording_update(zone_name, snapshot):
+            ret = update(zone_name, snapshot)
+            changed[zone_name] = changed.get(zone_name, 0) + ret
+            return ret
+
+        with patch.object(
+            index, 'update', side_effect=recording_update
+        ), patch.object(self.app.manager, '_schedule_refresh'):
+            response = self.client.post(
+                '/zones/other.com./records/www/A',
+                headers=self.headers,
+                json={'ttl': 300, 'value': '10.5.5.5'},
+            )
+            self.assertEqual(201, response.status_code)
+            self.assertEqual({'other.com.': 2}, changed)
+
+            records = self._search(value='10.1.2.3').json['records']
+            # the written, unverified, zone is refreshed in the background
+            self.app.manager._schedule_refresh.assert_called_once_with(
+                'other.com.'
+            )
+        self.assertEqual(
+            [('example.com.', 'www')], [(r['zone'], r['name']) for r in records]
+        )
+        self.assertEqual({'example.com.': 0, 'other.com.': 2}, changed)
+
+    def test_refresh_updates_index(self):
+        manager = self.app.manager
+        self._warm()
+        self._search(value='10.1.2.3')
+        snapshot = manager.get_snapshot('other.com.')
+        # refreshes re-index zones that are in the index
+        manager._refresh('other.com.')
+        self.assertIsNot(snapshot, manager.search_index._zones['other.com.'])
+
+        # including when another process populated them
+        entry = MagicMock()
+        entry.snapshot = snapshot
+        populating = MagicMock()
+        populating.return_value.__enter__.return_value = entry
+        with patch.object(manager.cache, 'populating', populating):
+            manager._refresh('other.com.')
+        self.assertIs(snapshot, manager.search_index._zones['other.com.'])
+
+    def test_search_cold(self):
+        manager = self.app.manager
+        with patch.object(
+            manager, '_populate_zone'
+        ) as mock_populate, patch.object(
+            manager, '_schedule_refresh'
+        ) as mock_refresh:
+            response = self._search(value='10.1.2.3')
+            self.assertEqual(200, response.status_code)
+            # zones aren't populated by searches, they're refreshed in the
+            # background
+            self.assertEqual([], response.json['records'])
+            mock_populate.assert_not_called()
+            mock_refresh.assert_has_calls(
+                [call('example.com.'), call('other.com.')]
+            )
+
+        # and searched once they have been
+        for zone_name in ('example.com.', 'other.com.'):
+            manager._refresh(zone_name)
+        with patch.object(manager, '_schedule_refresh') as mock_refresh:
+            response = self._search(value='10.1.2.3')
+            mock_refresh.assert_not_called()
+        self.assertEqual(2, len(response.json['records']))
+
+    def test_search_uncached(self):
+        # without the cache every search would refresh every zone
+        self.app.manager.cache.ttl = 0
+        with patch.object(
+            self.app.manager, '_schedule_refresh'
+        ) as mock_refresh:
+            response = self._search(value='10.1.2.3')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(
+            {'error': 'Search requires the zone cache, api.cache.ttl'},
+            response.get_json(),
+        )
+        mock_refresh.assert_not_called()
+
+    def test_search_after_sync(self):
+        manager = self.app.manager
+        self._warm()
+        self.assertEqual(2, len(self._search(value='10.1.2.3').json['records']))
+
+        # syncs drop the zone from the index along with the cache, it's
+        # searched again once it's been refreshed
+        with patch.object(manager.manager, 'sync', return_value=1):
+            response = self.client.post(
+                '/zones/other.com./sync',
+                headers=self.headers,
+                json={'dry_run': False},
+            )
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('other.com.', manager.search_index._zones)
+        with patch.object(manager, '_schedule_refresh') as mock_refresh:
+            records = self._search(value='10.1.2.3').json['records']
+            mock_refresh.assert_called_once_with('other.com.')
+        self.assertEqual(
+            [('example.com.', 'www')], [(r['zone'], r['name']) for r in records]
+        )
+
+        # as do writes when there's nothing cached to write through to, e.g.
+        # it was invalidated while they were applied
+        self._warm()
+        self._search(value='10.1.2.3')
+        with patch.object(manager.cache, 'update', return_value=None):
+            response = self.client.post(
+                '/zones/other.com./records/www/A',
+                headers=self.headers,
+                json={'ttl': 300, 'value': '10.5.5.5'},
+            )
+        self.assertEqual(201, response.status_code)
+        self.assertNotIn('other.com.', manager.search_index._zones)
+
+    def test_search_invalid(self):
+        for params in (
+            {},
+            {'type': 'A'},
+            {'value': '10.1.2.3', 'limit': 'lots'},
+            {'value': '10.1.2.3', 'limit': 0},
+            {'value': '10.1.2.3', 'limit': 1001},
+        ):
+            response = self._search(**params)
+            self.assertEqual(400, response.status_code, params)
+
+    def test_search_error(self):
+        mock_manager = MagicMock()
+        mock_manager.manager.config = {'api': {'keys': [{'key': 'admin-key'}]}}
+        mock_manager.search.side_effect = Exception('Unexpected')
+        with patch.object(self.app, 'manager', mock_manager):
+            response = self._search(value='10.1.2.3')
+        self.assertEqual(500, response.status_code)
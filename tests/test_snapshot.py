@@ -0,0 +1,309 @@
+#
+#
+#
+
+from json import dumps, loads
+from unittest import TestCase
+
+from octodns.record import Create, Delete, Record, Update
+from octodns.zone import Zone
+
+from octodns_api.snapshot import ZoneSnapshot
+
+
+class TestZoneSnapshot(TestCase):
+    def setUp(self):
+        self.zone = Zone('ÿëḿ.com.', [])
+        for name, data in (
+            ('', {'type': 'A', 'ttl': 300, 'values': ['1.2.3.4', '2.3.4.5']}),
+            ('www', {'type': 'CNAME', 'ttl': 60, 'value': 'ÿëḿ.com.'}),
+            ('ÿëḿ', {'type': 'TXT', 'ttl': 60, 'value': 'tab\\ttab'}),
+            (
+                'mail',
+                {
+                    'type': 'MX',
+                    'ttl': 600,
+                    'value': {'preference': 10, 'exchange': 'mx.ÿëḿ.com.'},
+                    'octodns': {'ignored': True},
+                },
+            ),
+        ):
+            self.zone.add_record(Record.new(self.zone, name, data))
+
+    def test_from_zone(self):
+        snapshot = ZoneSnapshot.from_zone(self.zone)
+        self.assertEqual(self.zone.name, snapshot.name)
+        self.assertEqual('ÿëḿ.com.', snapshot.decoded_name)
+        self.assertEqual(4, len(snapshot))
+
+        self.assertEqual(
+            {'ttl': 300, 'values': ['1.2.3.4', '2.3.4.5']},
+            snapshot.get('', 'A'),
+        )
+        self.assertEqual(
+            {
+                'ttl': 600,
+                'octodns': {'ignored': True},
+                'value': {
+                    'exchange': 'mx.xn--cda3bz01m.com.',
+                    'preference': 10,
+                },
+            },
+            snapshot.get('mail', 'MX'),
+        )
+        # keyed on decoded names
+        self.assertTrue(snapshot.get('ÿëḿ', 'TXT'))
+        self.assertIsNone(snapshot.get('xn--ts9aa1n', 'TXT'))
+        self.assertIsNone(snapshot.get('www', 'A'))
+
+        # records match what we'd get from the Record objects
+        self.assertEqual(
+            {
+                (r.decoded_name, r._type): loads(dumps(r.data))
+                for r in self.zone.records
+            },
+            {(n, t): d for n, t, d in snapshot.records()},
+        )
+
+    def test_record(self):
+        snapshot = ZoneSnapshot.from_zone(self.zone)
+        record = snapshot.record('ÿëḿ', 'TXT')
+        self.assertEqual('TXT', record._type)
+        self.assertEqual('ÿëḿ', record.decoded_name)
+        self.assertEqual(self.zone.name, record.zone.name)
+        self.assertIsNone(snapshot.record('nope', 'A'))
+
+    def test_to_zone(self):
+        zone = ZoneSnapshot.from_zone(self.zone).to_zone()
+        self.assertEqual(self.zone.name, zone.name)
+        self.assertEqual(
+            sorted((r.name, r._type, str(r.data)) for r in self.zone.records),
+            sorted((r.name, r._type, str(r.data)) for r in zone.records),
+        )
+
+    def test_pack_unpack(self):
+        snapshot = ZoneSnapshot.from_zone(self.zone)
+        unpacked = ZoneSnapshot.unpack('ÿëḿ.com.', snapshot.pack())
+        self.assertEqual(snapshot.name, unpacked.name)
+        self.assertEqual(snapshot.decoded_name, unpacked.decoded_name)
+        self.assertEqual(snapshot._records, unpacked._records)
+
+        empty = ZoneSnapshot.from_zone(Zone('empty.com.', []))
+        self.assertEqual(b'', empty.pack())
+        self.assertEqual(0, len(ZoneSnapshot.unpack('empty.com.', b'')))
+
+    def test_derived(self):
+        snapshot = ZoneSnapshot.from_zone(self.zone)
+        built = []
+
+        def build():
+            built.append(True)
+            return len(snapshot)
+
+        self.assertEqual(4, snapshot.derived('count', build))
+        self.assertEqual(4, snapshot.derived('count', build))
+        self.assertEqual([True], built)
+
+    def test_apply(self):
+        snapshot = ZoneSnapshot.from_zone(self.zone)
+        www = self.zone.get_type('www', 'CNAME')
+        apex = self.zone.get_type('', 'A')
+        new = Record.new(
+            self.zone, 'new', {'type': 'A', 'ttl': 30, 'value': '3.3.3.3'}
+        )
+        updated = Record.new(
+            self.zone, '', {'type': 'A', 'ttl': 30, 'value': '4.4.4.4'}
+        )
+        missing = Record.new(
+            self.zone, 'missing', {'type': 'A', 'ttl': 30, 'value': '5.5.5.5'}
+        )
+
+        applied = snapshot.apply(
+            [
+                Create(new),
+                Update(apex, updated),
+                Delete(www),
+                # deleting something that isn't there is a no-op
+                Delete(missing),
+            ]
+        )
+        self.assertEqual(
+            {('', 'A'), ('new', 'A'), ('ÿëḿ', 'TXT'), ('mail', 'MX')},
+            {(n, t) for n, t, _ in applied.records()},
+        )
+        self.assertEqual({'ttl': 30, 'value': '4.4.4.4'}, applied.get('', 'A'))
+        self.assertEqual(snapshot.name, applied.name)
+        self.assertEqual(snapshot.decoded_name, applied.decoded_name)
+        # the original is untouched
+        self.assertEqual(4, len(snapshot))
+        self.assertIsNotNone(snapshot.get('www', 'CNAME'))
+
+    def test_fingerprint(self):
+        snapshot = ZoneSnapshot.from_zone(self.zone)
+        fingerprint = snapshot.fingerprint()
+        self.assertEqual(64, len(fingerprint))
+        # the same records, in a different order, have the same fingerprint
+        packed = snapshot.pack().split(b'\n')
+        unpacked = ZoneSnapshot.unpack(
+            snapshot.decoded_name, b'\n'.join(reversed(packed))
+        )
+        self.assertEqual(fingerprint, unpacked.fingerprint())
+
+        www = self.zone.get_type('www', 'CNAME')
+        self.assertNotEqual(
+            fingerprint, snapshot.apply([Delete(www)]).fingerprint()
+        )
+
+    def test_layers(self):
+        snapshot = ZoneSnapshot.from_zone(self.zone)
+        www = self.zone.get_type('www', 'CNAME')
+        deleted = snapshot.apply([Delete(www)])
+        # only the change is held, the rest is shared
+        self.assertEqual({('www', 'CNAME'): None}, deleted._records)
+        self.assertIs(snapshot, deleted._base)
+        self.assertEqual(3, len(deleted))
+        self.assertIsNone(deleted.get('www', 'CNAME'))
+        self.assertIsNone(deleted.record('www', 'CNAME'))
+        self.assertEqual(3, len(list(deleted.packed())))
+        self.assertEqual(3, len(deleted.to_zone().records))
+
+        # a long chain of changes is flattened
+        current = deleted
+        for i in range(ZoneSnapshot.MAX_DEPTH + 1):
+            record = Record.new(
+                self.zone,
+                f'r{i}',
+                {'type': 'A', 'ttl': 30, 'value': f'1.1.1.{i}'},
+            )
+            current = current.apply([Create(record)])
+            self.assertLess(current._depth, ZoneSnapshot.MAX_DEPTH)
+            self.assertEqual(4 + i, len(current))
+            self.assertEqual(len(current), len(list(current.packed())))
+        self.assertEqual(
+            {'ttl': 30, 'value': '1.1.1.0'}, current.get('r0', 'A')
+        )
+        self.assertIsNone(current.get('www', 'CNAME'))
+
+        # flattening drops deletes, including of things that aren't there
+        current = deleted
+        for _ in range(ZoneSnapshot.MAX_DEPTH - 1):
+            current = current.apply([Delete(www)])
+        self.assertIsNone(current._base)
+        self.assertEqual(3, len(current))
+
+    def test_versioned(self):
+        snapshot = ZoneSnapshot.from_zone(self.zone)
+        self.assertIsNone(snapshot.version)
+
+        first = snapshot.versioned(1)
+        self.assertEqual(1, first.version)
+        self.assertIsNone(snapshot.version)
+        self.assertIs(snapshot._records, first._records)
+        self.assertEqual(4, len(first))
+
+        # a fresh copy with the same records is layered on the previous
+        # version with nothing of its own
+        second = ZoneSnapshot.from_zone(self.zone).versioned(2, first)
+        self.assertEqual(2, second.version)
+        self.assertIs(first, second._base)
+        self.assertEqual({}, second._records)
+        self.assertEqual(first.pack(), second.pack())
+
+        # a layered snapshot is copied as-is
+        www = self.zone.get_type('www', 'CNAME')
+        applied = snapshot.apply([Delete(www)])
+        third = applied.versioned(3, second)
+        self.assertIs(snapshot, third._base)
+        self.assertEqual(3, len(third))
+
+        # too many differences and it stands on its own
+        zone = Zone(self.zone.name, [])
+        zone.add_record(
+            Record.new(zone, '', {'type': 'A', 'ttl': 30, 'value': '9.9.9.9'})
+        )
+        fourth = ZoneSnapshot.from_zone(zone).versioned(4, third)
+        self.assertIsNone(fourth._base)
+        self.assertEqual(1, len(fourth))
+
+        # a small difference, three of sixteen records changed, added, or
+        # removed, is layered
+        for i in range(12):
+            self.zone.add_record(
+                Record.new(
+                    self.zone,
+                    f'r{i}',
+                    {'type': 'A', 'ttl': 30, 'value': f'1.1.1.{i}'},
+                )
+            )
+        previous = ZoneSnapshot.from_zone(self.zone).versioned(5)
+        self.zone.remove_record(self.zone.get_type('r0', 'A'))
+        self.zone.add_record(
+            Record.new(
+                self.zone, 'r12', {'type': 'A', 'ttl': 30, 'value': '1.1.1.1'}
+            )
+        )
+        self.zone.add_record(
+            Record.new(
+                self.zone, 'r1', {'type': 'A', 'ttl': 60, 'value': '1.1.1.1'}
+            ),
+            replace=True,
+        )
+        current = ZoneSnapshot.from_zone(self.zone).versioned(6, previous)
+        self.assertIs(previous, current._base)
+        self.assertEqual(
+            {('r0', 'A'), ('r1', 'A'), ('r12', 'A')}, set(current._records)
+        )
+        self.assertEqual(16, len(current))
+        self.assertEqual(
+            sorted(ZoneSnapshot.from_zone(self.zone).packed()),
+            sorted(current.packed()),
+        )
+
+    def test_diff(self):
+        snapshot = ZoneSnapshot.from_zone(self.zone)
+        www = self.zone.get_type('www', 'CNAME')
+        apex = self.zone.get_type('', 'A')
+        new = Record.new(
+            self.zone, 'new', {'type': 'A', 'ttl': 30, 'value': '3.3.3.3'}
+        )
+        updated = Record.new(
+            self.zone, '', {'type': 'A', 'ttl': 30, 'value': '4.4.4.4'}
+        )
+
+        applied = snapshot.apply([Create(new), Update(apex, updated)])
+        applied = applied.apply([Delete(www)])
+        expected = [
+            ('', 'A', apex.data, {'ttl': 30, 'value': '4.4.4.4'}),
+            ('new', 'A', None, {'ttl': 30, 'value': '3.3.3.3'}),
+            ('www', 'CNAME', www.data, None),
+        ]
+        self.assertEqual(expected, snapshot.diff(applied))
+        # only the layers between them are looked at
+        self.assertEqual(
+            {('', 'A'), ('new', 'A'), ('www', 'CNAME')},
+            snapshot._changed_keys(applied),
+        )
+        # the other way around
+        self.assertEqual(
+            [(n, t, after, before) for n, t, before, after in expected],
+            applied.diff(snapshot),
+        )
+        self.assertEqual([], applied.diff(applied))
+
+        # siblings, changes that are undone don't show up
+        other = snapshot.apply([Delete(www)]).apply([Create(www)])
+        self.assertEqual([], snapshot.diff(other))
+        self.assertEqual(
+            [
+                ('', 'A', {'ttl': 30, 'value': '4.4.4.4'}, apex.data),
+                ('new', 'A', {'ttl': 30, 'value': '3.3.3.3'}, None),
+                ('www', 'CNAME', None, www.data),
+            ],
+            applied.diff(other),
+        )
+
+        # unrelated snapshots are compared in full
+        unpacked = ZoneSnapshot.unpack(snapshot.decoded_name, applied.pack())
+        self.assertIsNone(snapshot._changed_keys(unpacked))
+        self.assertEqual(expected, snapshot.diff(unpacked))
+        self.assertEqual([], applied.diff(unpacked))
@@ -0,0 +1,71 @@
+#
+#
+#
+
+from subprocess import run
+from sys import executable
+from unittest import TestCase
+
+# modules that are expensive to import and shouldn't be until they're needed
+HEAVY = (
+    'cProfile',
+    'flask',
+    'octodns.manager',
+    'octodns_api.app',
+    'octodns_api.profiling',
+    'pstats',
+    'sqlite3',
+)
+
+
+class TestStartup(TestCase):
+    '''
+    Guards against imports creeping back in to the startup path, comparing
+    import times directly would be too noisy to be useful in tests, see
+    script/benchmark-startup for that
+    '''
+
+    def _loaded(self, code):
+        # a fresh interpreter, ignoring PYTHON* environment variables, so that
+        # nothing's already been imported
+        result = run(
+            [
+                executable,
+                '-E',
+                '-c',
+                f'''
+import sys
+{code}
+print('loaded=' + ','.join(m for m in {HEAVY!r} if m in sys.modules))
+''',
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # --help writes to stdout too, what was loaded is on the last line
+        loaded = result.stdout.strip().split('\n')[-1]
+        self.assertTrue(loaded.startswith('loaded='))
+        return set(filter(None, loaded[len('loaded=') :].split(',')))
+
+    def test_cli_help(self):
+        self.assertEqual(
+            set(),
+            self._loaded(
+                '''
+sys.argv = ['octodns-api', '--help']
+from octodns_api.cli import main
+try:
+    main()
+except SystemExit:
+    pass
+'''
+            ),
+        )
+
+    def test_app(self):
+        # flask and the manager are needed, the optional bits aren't
+        self.assertEqual(
+            {'flask', 'octodns.manager', 'octodns_api.app'},
+            self._loaded('import octodns_api.app'),
+        )
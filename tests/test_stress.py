@@ -0,0 +1,66 @@
+#
+#
+#
+
+from json import loads
+from os.path import dirname, join
+from shutil import rmtree
+from subprocess import run
+from sys import executable
+from tempfile import mkdtemp
+from unittest import TestCase
+
+SCRIPTS = join(dirname(dirname(__file__)), 'script')
+
+
+class TestStress(TestCase):
+    '''
+    Smoke test of the large zone generator and stress runner, at a size that
+    keeps the tests quick, see the README for running them at scale
+    '''
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def _run(self, script, *args):
+        return run(
+            [executable, join(SCRIPTS, script), *args],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+    def test_generate_and_stress(self):
+        output = self._run(
+            'generate-zone', '--records', '200', self.tmpdir, 'stress.com'
+        )
+        self.assertIn('wrote 200 records', output)
+
+        results = loads(
+            self._run(
+                'stress',
+                '--requests',
+                '50',
+                '--workers',
+                '1',
+                '--write-ratio',
+                '0.1',
+                '--json',
+                self.tmpdir,
+                'stress.com.',
+            )
+        )
+        # the generated zone is valid, in order, YAML that loads in full
+        self.assertEqual(200, results['records'])
+        self.assertEqual(50, results['requests'])
+        self.assertTrue(results['throughput_rps'] > 0)
+        self.assertTrue(results['peak_rss_mb'] > 0)
+        self.assertEqual(
+            {'delete', 'get', 'lookup', 'update'}, set(results['ops'].keys())
+        )
+        for op, stats in results['ops'].items():
+            self.assertEqual(0, stats['errors'], op)
+            self.assertTrue(stats['p50_ms'] <= stats['max_ms'])
@@ -0,0 +1,166 @@
+#
+#
+#
+
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from octodns_api.app import create_app
+from octodns_api.timing import (
+    RequestTimer,
+    after_request,
+    current_timer,
+    teardown_request,
+    timed,
+)
+
+
+class TestRequestTimer(TestCase):
+    def test_add(self):
+        timer = RequestTimer()
+        timer.add('plan', 0.001)
+        timer.add('plan', 0.002, 'second')
+        timer.add('zone', 0.0005, 'hit')
+        timer.add('zone', 0.0005)
+        self.assertEqual(
+            'plan;desc="second";dur=3.00, zone;desc="hit";dur=1.00, '
+            'total;dur=10.00',
+            timer.server_timing(0.01),
+        )
+        self.assertEqual(
+            [
+                'total_ms=10.00',
+                'plan_ms=3.00',
+                'plan=second',
+                'zone_ms=1.00',
+                'zone=hit',
+            ],
+            timer.log_fields(0.01),
+        )
+        self.assertGreater(timer.total, 0)
+
+    def test_timed_outside_request(self):
+        self.assertIsNone(current_timer())
+        # no-op, but still usable, when there's no request being timed
+        with timed('plan', 'desc') as span:
+            span.desc = 'other'
+        self.assertIsNone(current_timer())
+
+
+class TestTiming(TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        config_dir = join(self.tmpdir, 'config')
+        makedirs(config_dir)
+        with open(join(config_dir, 'example.com.yaml'), 'w') as f:
+            f.write(
+                '''
+---
+www:
+  ttl: 300
+  type: A
+  value: 5.6.7.8
+'''
+            )
+        config_file = join(self.tmpdir, 'config.yaml')
+        with open(config_file, 'w') as f:
+            f.write(
+                f'''
+api:
+  keys:
+    - name: admin
+      key: admin-key
+  cache:
+    ttl: 60
+
+providers:
+  config:
+    class: octodns.provider.yaml.YamlProvider
+    directory: {config_dir}
+
+zones:
+  example.com.:
+    sources:
+      - config
+    targets:
+      - config
+'''
+            )
+        self.app = create_app(config_file)
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        self.headers = {'Authorization': 'Bearer admin-key'}
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def _metrics(self, response):
+        return {
+            m.split(';')[0]: m
+            for m in response.headers['Server-Timing'].split(', ')
+        }
+
+    def test_server_timing(self):
+        with self.assertLogs('api.Access', level='INFO') as logs:
+            response = self.client.get(
+                '/zones/example.com./records', headers=self.headers
+            )
+        self.assertEqual(200, response.status_code)
+        metrics = self._metrics(response)
+        self.assertEqual(
+            {'auth', 'zone', 'serialize', 'total'}, set(metrics.keys())
+        )
+        self.assertIn('desc="miss"', metrics['zone'])
+        self.assertEqual(1, len(logs.output))
+        line = logs.output[0]
+        self.assertIn('method=GET path=/zones/example.com./records', line)
+        self.assertIn('status=200', line)
+        # the key the request was made with
+        self.assertIn('key=admin ', line)
+        self.assertIn('zone=miss', line)
+        self.assertIn('total_ms=', line)
+
+        # second time around the zone comes from the cache
+        response = self.client.get(
+            '/zones/example.com./records/www/A', headers=self.headers
+        )
+        metrics = self._metrics(response)
+        self.assertIn('desc="hit"', metrics['zone'])
+        self.assertIn('lookup', metrics)
+
+        # the timer is cleared once the request is done
+        self.assertIsNone(current_timer())
+
+        # requests that aren't authenticated don't have a key
+        with self.assertLogs('api.Access', level='INFO') as logs:
+            self.client.get('/zones')
+        self.assertIn('status=401 key=- ', logs.output[0])
+
+    def test_write(self):
+        response = self.client.post(
+            '/zones/example.com./records/new/A',
+            headers=self.headers,
+            json={'ttl': 60, 'value': '1.2.3.4'},
+        )
+        self.assertEqual(201, response.status_code)
+        metrics = self._metrics(response)
+        self.assertIn('plan', metrics)
+        self.assertIn('apply', metrics)
+
+    def test_unauthorized(self):
+        with self.assertLogs('api.Access', level='INFO') as logs:
+            response = self.client.get('/zones/example.com./records')
+        self.assertEqual(401, response.status_code)
+        self.assertEqual({'auth', 'total'}, set(self._metrics(response).keys()))
+        self.assertIn('status=401', logs.output[0])
+
+    def test_hooks_without_timer(self):
+        # e.g. when an earlier before_request hook short-circuits the request
+        with self.app.test_request_context('/zones'):
+            response = self.app.response_class('')
+            self.assertIs(response, after_request(response))
+            self.assertNotIn('Server-Timing', response.headers)
+            teardown_request()
@@ -0,0 +1,213 @@
+#
+#
+#
+
+from io import StringIO
+from unittest import TestCase
+
+from octodns.record import Record, ValidationError
+from octodns.zone import Zone
+
+from octodns_api.snapshot import ZoneSnapshot
+from octodns_api.zonefile import (
+    ZoneFileException,
+    export,
+    parse,
+    parse_bind,
+    parse_yaml,
+)
+
+
+class TestZoneFile(TestCase):
+    def setUp(self):
+        self.zone = Zone('example.com.', [])
+        for name, data in (
+            ('', {'type': 'A', 'ttl': 300, 'values': ['1.2.3.4', '1.2.3.5']}),
+            (
+                '',
+                {
+                    'type': 'MX',
+                    'ttl': 300,
+                    'value': {'preference': 10, 'exchange': 'mx.example.com.'},
+                },
+            ),
+            ('www', {'type': 'CNAME', 'ttl': 60, 'value': 'example.com.'}),
+            ('host12', {'type': 'A', 'ttl': 60, 'value': '2.3.4.5'}),
+            ('host2', {'type': 'AAAA', 'ttl': 60, 'value': '2001::1'}),
+            ('_txt', {'type': 'TXT', 'ttl': 60, 'value': 'v=spf1 -all'}),
+            (
+                'fwd',
+                {
+                    'type': 'URLFWD',
+                    'ttl': 60,
+                    'value': {
+                        'path': '/',
+                        'target': 'https://www.example.com/',
+                        'code': 301,
+                        'masking': 2,
+                        'query': 0,
+                    },
+                },
+            ),
+        ):
+            self.zone.add_record(Record.new(self.zone, name, data))
+        self.snapshot = ZoneSnapshot.from_zone(self.zone)
+
+    def _summary(self, zone):
+        return sorted(
+            (r.name, r._type, r.ttl, str(r.data)) for r in zone.records
+        )
+
+    def test_yaml(self):
+        chunks = list(export(self.snapshot, 'yaml'))
+        # one chunk per name, after the document start
+        self.assertEqual('---\n', chunks[0])
+        self.assertEqual(7, len(chunks))
+        text = ''.join(chunks)
+        # names are in octoDNS's natural order so it's a valid config file
+        names = [c.split(':', 1)[0] for c in chunks[1:]]
+        self.assertEqual(
+            ["? ''\n", '_txt', 'fwd', 'host2', 'host12', 'www'], names
+        )
+
+        zone = Zone('example.com.', [])
+        parse_yaml(StringIO(text), zone)
+        self.assertEqual(self._summary(self.zone), self._summary(zone))
+
+        # order doesn't matter on the way in, nor do comments
+        zone = Zone('example.com.', [])
+        parse(
+            StringIO(
+                '''# comment
+www:
+  type: A
+  value: 1.1.1.1
+# another
+'':
+  - type: A
+    value: 2.2.2.2
+'''
+            ),
+            zone,
+            'yaml',
+        )
+        self.assertEqual(
+            [('', 'A'), ('www', 'A')],
+            sorted((r.name, r._type) for r in zone.records),
+        )
+
+        # anchors can be aliased, and merged, from later names
+        zone = Zone('example.com.', [])
+        parse_yaml(
+            StringIO(
+                '''---
+a: &a
+  type: A
+  ttl: 60
+  value: &ip 1.2.3.4
+b:
+  <<: *a
+  ttl: 120
+c:
+  - type: A
+    value: *ip
+'''
+            ),
+            zone,
+        )
+        self.assertEqual(
+            [
+                ('a', 60, '1.2.3.4'),
+                ('b', 120, '1.2.3.4'),
+                ('c', 3600, '1.2.3.4'),
+            ],
+            sorted((r.name, r.ttl, r.values[0]) for r in zone.records),
+        )
+
+        # names can be split across documents
+        zone = Zone('example.com.', [])
+        parse_yaml(
+            StringIO(
+                '---\na:\n  type: A\n  value: 1.1.1.1\n'
+                '---\nb:\n  type: A\n  value: 2.2.2.2\n...\n'
+            ),
+            zone,
+        )
+        self.assertEqual(['a', 'b'], sorted(r.name for r in zone.records))
+
+        # empty
+        zone = Zone('example.com.', [])
+        parse_yaml(StringIO(''), zone)
+        parse_yaml(StringIO('---\n'), zone)
+        self.assertEqual(0, len(zone.records))
+
+    def test_yaml_invalid(self):
+        for text, msg in (
+            ('www: [\n', 'Invalid YAML'),
+            ('- www\n', 'expected a mapping'),
+            ('www: 42\n', 'Invalid record data for "www"'),
+            (
+                'www:\n  type: A\n  value: 1.1.1.1\n'
+                'www:\n  type: A\n  value: 2.2.2.2\n',
+                'Duplicate record',
+            ),
+        ):
+            with self.assertRaises(ZoneFileException) as ctx:
+                parse_yaml(StringIO(text), Zone('example.com.', []))
+            self.assertIn(msg, str(ctx.exception))
+
+        with self.assertRaises(ValidationError):
+            parse_yaml(
+                StringIO('www:\n  type: A\n  value: nope\n'),
+                Zone('example.com.', []),
+            )
+
+    def test_bind(self):
+        lines = list(export(self.snapshot, 'bind'))
+        self.assertEqual(
+            [
+                '$ORIGIN example.com.\n',
+                'example.com. 300 IN A 1.2.3.4\n',
+                'example.com. 300 IN A 1.2.3.5\n',
+                'example.com. 300 IN MX 10 mx.example.com.\n',
+                '_txt.example.com. 60 IN TXT "v=spf1 -all"\n',
+                '; fwd.example.com. 60 URLFWD skipped, not a standard type\n',
+                'host12.example.com. 60 IN A 2.3.4.5\n',
+                'host2.example.com. 60 IN AAAA 2001::1\n',
+                'www.example.com. 60 IN CNAME example.com.\n',
+            ],
+            lines,
+        )
+
+        zone = Zone('example.com.', [])
+        parse(StringIO(''.join(lines)), zone, 'bind')
+        expected = Zone('example.com.', [])
+        for record in self.zone.records:
+            if record._type != 'URLFWD':
+                expected.add_record(record)
+        self.assertEqual(self._summary(expected), self._summary(zone))
+
+        # relative names, $TTL, and SOA, which is ignored
+        zone = Zone('example.com.', [])
+        parse_bind(
+            StringIO(
+                '''$TTL 120
+@ IN SOA ns1.example.com. admin.example.com. 1 2 3 4 5
+www IN A 1.1.1.1
+'''
+            ),
+            zone,
+        )
+        self.assertEqual(
+            [('www', 'A', 120)],
+            [(r.name, r._type, r.ttl) for r in zone.records],
+        )
+
+    def test_bind_invalid(self):
+        for text, msg in (
+            ('www 60 IN A nope\n', 'Invalid zone file'),
+            ('www 60 IN HINFO "a" "b"\n', 'Unsupported record type HINFO'),
+        ):
+            with self.assertRaises(ZoneFileException) as ctx:
+                parse_bind(StringIO(text), Zone('example.com.', []))
+            self.assertIn(msg, str(ctx.exception))